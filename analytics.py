@@ -0,0 +1,258 @@
+"""
+情绪趋势分析
+面向心理咨询老师的批量分析，按列读取情绪记录，用 pandas / NumPy 向量化计算：
+- 每日计数在数据库内按 (会话, 日期, 情绪) 聚合后再读取，原始记录与保留策略生成的日汇总合并
+- 分析维度：全体、队列（用户首次使用所在的周）、用户（没有用户ID的会话按会话计）
+- 负面情绪占比的滚动平均、各情绪占比的周环比变化，负面情绪占比明显上升时预警
+- 增量计算：已完成日期的每日计数缓存在 ANALYTICS_CACHE_DIR，之后只读取缓存之后的日期
+- 以只读方式打开数据库，不迁移；结构不是最新版本时报错，需先运行 python migrations.py
+
+用法：
+    python analytics.py                         # 按队列分析，打印周环比和预警
+    python analytics.py --by user --output reports
+    python analytics.py --full                  # 忽略缓存全部重算
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional
+import argparse
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from config import Config
+from data_system import EmotionTrend, EmotionTrendDaily, UserSession, create_readonly_engine
+from migrations import require_latest
+
+
+NEGATIVE_EMOTIONS = ("焦虑", "压力", "困惑", "沮丧", "孤独", "疲惫")
+GROUPINGS = ("all", "cohort", "user")
+CACHE_FILE = "emotion_daily_counts.pkl"
+COUNT_COLUMNS = ["session_id", "day", "emotion", "count"]
+
+
+class EmotionAnalytics:
+    """情绪趋势分析器"""
+    
+    def __init__(self, database_url: str = None, cache_dir: str = None,
+                 rolling_days: int = None):
+        self.config = Config()
+        self.database_url = database_url or self.config.DATABASE_URL
+        self.engine = create_readonly_engine(self.database_url)
+        try:
+            require_latest(self.engine)
+        except Exception:
+            self.engine.dispose()
+            raise
+        self.cache_dir = cache_dir or self.config.ANALYTICS_CACHE_DIR
+        self.rolling_days = rolling_days or self.config.ANALYTICS_ROLLING_DAYS
+        self.negative_emotions = list(NEGATIVE_EMOTIONS)
+        self.last_load = {}  # 最近一次加载：缓存行数、新读取的行数、读取起始日期
+    
+    # ---------- 加载 ----------
+    
+    def _query_daily_counts(self, since: Optional[date]) -> pd.DataFrame:
+        """从数据库读取 since（含）之后的每日计数"""
+        day = func.date(EmotionTrend.timestamp)
+        raw = select(
+            EmotionTrend.session_id, day.label("day"), EmotionTrend.emotion,
+            func.count().label("count")
+        ).group_by(EmotionTrend.session_id, day, EmotionTrend.emotion)
+        rollup = select(
+            EmotionTrendDaily.session_id, EmotionTrendDaily.day,
+            EmotionTrendDaily.emotion, EmotionTrendDaily.count
+        )
+        if since is not None:
+            raw = raw.where(EmotionTrend.timestamp >= datetime.combine(since, time.min))
+            rollup = rollup.where(EmotionTrendDaily.day >= since.isoformat())
+        
+        with self.engine.connect() as conn:
+            frames = [pd.read_sql(query, conn) for query in (raw, rollup)]
+        counts = pd.concat([frame for frame in frames if len(frame)] or [frames[0]],
+                           ignore_index=True)
+        counts["day"] = pd.to_datetime(counts["day"])
+        counts["count"] = counts["count"].astype(np.int64)
+        return counts[COUNT_COLUMNS]
+    
+    def _cache_path(self) -> str:
+        return os.path.join(self.cache_dir, CACHE_FILE)
+    
+    def _read_cache(self) -> Optional[Dict]:
+        try:
+            with open(self._cache_path(), "rb") as f:
+                state = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        # 换了数据库的缓存不可用
+        return state if state.get("database_url") == self.database_url else None
+    
+    def _write_cache(self, counts: pd.DataFrame, through: date):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path()
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump({"database_url": self.database_url, "through": through, "counts": counts}, f)
+        os.replace(path + ".tmp", path)
+    
+    def load_daily_counts(self, full: bool = False) -> pd.DataFrame:
+        """每个会话每天每种情绪的记录数（session_id, day, emotion, count）
+
+        只缓存今天之前的日期（今天的数据还会增加）；之后的调用只查询缓存日期之后的记录。
+        保留策略把原始记录汇总为日汇总时，同一天的计数不变，缓存仍然有效
+        """
+        today = date.today()
+        state = None if full else self._read_cache()
+        since = state["through"] + timedelta(days=1) if state else None
+        fresh = self._query_daily_counts(since)
+        
+        counts = fresh if state is None else pd.concat([state["counts"], fresh], ignore_index=True)
+        # 同一天可能同时有原始记录和日汇总（汇总进行到一半），合并计数
+        counts = counts.groupby(["session_id", "day", "emotion"], as_index=False, sort=False)["count"].sum()
+        
+        self._write_cache(counts[counts["day"] < pd.Timestamp(today)], today - timedelta(days=1))
+        self.last_load = {
+            "cached_rows": 0 if state is None else len(state["counts"]),
+            "new_rows": len(fresh),
+            "since": since
+        }
+        return counts
+    
+    def load_session_groups(self) -> pd.DataFrame:
+        """会话 -> 用户、队列（用户首次会话所在周的周一，YYYY-MM-DD）"""
+        query = select(UserSession.session_id, UserSession.user_id, UserSession.start_time)
+        with self.engine.connect() as conn:
+            sessions = pd.read_sql(query, conn)
+        sessions["user"] = sessions["user_id"].fillna(sessions["session_id"])
+        first_seen = pd.to_datetime(sessions.groupby("user")["start_time"].transform("min"))
+        week_start = first_seen.dt.normalize() - pd.to_timedelta(first_seen.dt.weekday, unit="D")
+        sessions["cohort"] = week_start.dt.strftime("%Y-%m-%d")
+        return sessions[["session_id", "user", "cohort"]]
+    
+    # ---------- 计算 ----------
+    
+    def daily_series(self, counts: pd.DataFrame, groups: pd.DataFrame, by: str = "cohort") -> pd.DataFrame:
+        """按维度汇总的每日情绪计数宽表：索引 (group, day)，每种情绪一列"""
+        if by not in GROUPINGS:
+            raise ValueError(f"未知的分析维度: {by}")
+        frame = counts.merge(groups, on="session_id", how="left")
+        if by == "all":
+            frame["group"] = "全体"
+        elif by == "user":
+            frame["group"] = frame["user"].fillna(frame["session_id"])
+        else:
+            frame["group"] = frame["cohort"].fillna("未知")
+        
+        wide = frame.pivot_table(index=["group", "day"], columns="emotion", values="count",
+                                 aggfunc="sum", fill_value=0)
+        wide.columns.name = None
+        return wide.astype(np.int64).sort_index()
+    
+    def _negative_counts(self, wide: pd.DataFrame) -> pd.Series:
+        columns = [emotion for emotion in self.negative_emotions if emotion in wide.columns]
+        return wide[columns].sum(axis=1)
+    
+    def rolling_negative_share(self, wide: pd.DataFrame) -> pd.DataFrame:
+        """每个维度每天的滚动负面情绪占比（最近 rolling_days 天的负面记录数 / 总记录数）
+
+        按日历天滚动，没有记录的日期不占窗口
+        """
+        frame = pd.DataFrame({
+            "negative": self._negative_counts(wide),
+            "total": wide.sum(axis=1)
+        }).reset_index(level="group")
+        rolled = frame.groupby("group")[["negative", "total"]].rolling(f"{self.rolling_days}D").sum()
+        rolled["negative_share"] = rolled["negative"] / rolled["total"]
+        return rolled
+    
+    def week_over_week(self, wide: pd.DataFrame, end: date) -> pd.DataFrame:
+        """最近7天（含 end）与之前7天相比，各维度的负面情绪占比变化和上升最多的情绪"""
+        days_back = (pd.Timestamp(end) - wide.index.get_level_values("day")).days.to_numpy()
+        mask = (days_back >= 0) & (days_back < 14)
+        recent = wide[mask]
+        week = pd.Index(days_back[mask] // 7, name="week")  # 0 = 本周，1 = 上周
+        weekly = recent.groupby([recent.index.get_level_values("group"), week]).sum()
+        
+        # 只分析本周有记录的维度；上周没有记录的维度占比为 NaN，没有可比的变化
+        groups = weekly.xs(0, level="week").index if 0 in week else pd.Index([], name="group")
+        weekly = weekly.reindex(pd.MultiIndex.from_product([groups, [0, 1]], names=["group", "week"]),
+                                fill_value=0)
+        totals = weekly.sum(axis=1)
+        negative = self._negative_counts(weekly)
+        shares = weekly.div(totals.where(totals > 0), axis=0)
+        shifts = shares.xs(0, level="week") - shares.xs(1, level="week")
+        
+        result = pd.DataFrame(index=groups)
+        result["total_current"] = totals.xs(0, level="week")
+        result["negative_current"] = negative.xs(0, level="week")
+        result["negative_share_current"] = result["negative_current"] / result["total_current"]
+        result["negative_share_previous"] = (negative / totals.where(totals > 0)).xs(1, level="week")
+        result["negative_shift"] = result["negative_share_current"] - result["negative_share_previous"]
+        comparable = shifts.notna().all(axis=1)
+        result["top_rising_emotion"] = shifts[comparable].idxmax(axis=1).reindex(groups)
+        result["top_rising_shift"] = shifts[comparable].max(axis=1).reindex(groups)
+        return result.sort_values("negative_shift", ascending=False)
+    
+    def alerts(self, weekly: pd.DataFrame, delta: float = None, min_count: int = None) -> pd.DataFrame:
+        """负面情绪占比周环比上升不少于 delta、且本周负面记录不少于 min_count 的维度"""
+        delta = self.config.ANALYTICS_ALERT_DELTA if delta is None else delta
+        min_count = self.config.ANALYTICS_ALERT_MIN_COUNT if min_count is None else min_count
+        return weekly[(weekly["negative_shift"] >= delta) & (weekly["negative_current"] >= min_count)]
+    
+    def report(self, by: str = "cohort", end: date = None, full: bool = False) -> Dict:
+        """完整分析：每日计数宽表、滚动负面占比、周环比和预警（截至 end，默认今天）"""
+        end = end or date.today()
+        counts = self.load_daily_counts(full=full)
+        counts = counts[counts["day"] <= pd.Timestamp(end)]
+        wide = self.daily_series(counts, self.load_session_groups(), by)
+        weekly = self.week_over_week(wide, end)
+        return {
+            "by": by,
+            "end": end.isoformat(),
+            "daily": wide,
+            "rolling": self.rolling_negative_share(wide),
+            "week_over_week": weekly,
+            "alerts": self.alerts(weekly)
+        }
+    
+    def close(self):
+        self.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按队列/用户分析情绪趋势并输出预警")
+    parser.add_argument("--by", choices=GROUPINGS, default="cohort", help="分析维度")
+    parser.add_argument("--end", type=date.fromisoformat, default=None, help="截止日期 YYYY-MM-DD（默认今天）")
+    parser.add_argument("--output", default=None, help="把结果写成 CSV 的目录")
+    parser.add_argument("--full", action="store_true", help="忽略缓存，全部重新计算")
+    args = parser.parse_args()
+    
+    analytics = EmotionAnalytics()
+    try:
+        result = analytics.report(by=args.by, end=args.end, full=args.full)
+        load = analytics.last_load
+    finally:
+        analytics.close()
+    
+    print(f"✓ 读取 {load['new_rows']} 行新的每日计数（缓存 {load['cached_rows']} 行）")
+    weekly = result["week_over_week"]
+    print(f"截至 {result['end']}，{len(weekly)} 个{args.by}维度本周有情绪记录")
+    with pd.option_context("display.max_rows", 20, "display.width", 120):
+        print(weekly.head(20).to_string(float_format=lambda v: f"{v:.2f}"))
+    
+    alerts = result["alerts"]
+    if len(alerts):
+        print(f"\n⚠️ {len(alerts)} 个维度负面情绪占比明显上升：")
+        for group, row in alerts.iterrows():
+            print(f"  {group}: {row['negative_share_previous']:.0%} -> {row['negative_share_current']:.0%}"
+                  f"（本周负面记录 {row['negative_current']} 条，上升最多：{row['top_rising_emotion']}）")
+    else:
+        print("\n✓ 没有需要关注的上升趋势")
+    
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for name in ("daily", "rolling", "week_over_week", "alerts"):
+            result[name].to_csv(os.path.join(args.output, f"emotion_{args.by}_{name}.csv"))
+        print(f"✓ 结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
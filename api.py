@@ -0,0 +1,268 @@
+"""
+HTTP/JSON 接口
+与 Web 界面共用同一套聊天机器人核心，供移动端、集成测试等程序化客户端直接调用，
+不经过 Gradio 的界面事件协议：
+- POST /sessions                    创建会话
+- POST /chat                        对话（一次返回完整回复）
+- POST /chat/stream                 流式对话（Server-Sent Events）
+- POST /feedback                    提交反馈
+- GET  /sessions/{session_id}/stats 会话统计
+- GET  /knowledge-base              知识库信息
+- GET  /health                      健康检查
+
+请求和响应用 pydantic 模型校验；响应超过 API_GZIP_MIN_SIZE 字节时 gzip 压缩
+（SSE 流式接口除外），连接保持 API_KEEPALIVE_SECONDS 秒供客户端复用。接口无状态（会话上下文按请求中的
+session_id 从数据库恢复），可以用 serve.py --app api 启动多个工作进程并轮询分发。
+
+用法：
+    python api.py
+    python api.py --host 0.0.0.0 --port 8000
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+from fastapi import FastAPI, HTTPException
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from config import Config
+from chatbot import ChatbotPool
+from rag_system import RAGSystem
+
+
+class SessionRequest(BaseModel):
+    user_id: Optional[str] = Field(None, max_length=100)
+
+
+class SessionResponse(BaseModel):
+    session_id: str
+
+
+class ChatRequest(BaseModel):
+    message: str = Field(..., min_length=1, max_length=Config.API_MAX_MESSAGE_LENGTH)
+    session_id: Optional[str] = Field(None, max_length=100, description="不指定时创建新会话")
+    user_id: Optional[str] = Field(None, max_length=100, description="仅在创建新会话时使用")
+    use_rag: bool = True
+
+
+class ChatResponse(BaseModel):
+    response: str
+    session_id: str
+    conversation_id: int
+    detected_emotions: List[str]
+    rag_docs_count: int
+    safety: Dict[str, Any]
+    usage: Optional[Dict[str, Any]] = None
+
+
+class FeedbackRequest(BaseModel):
+    conversation_id: int
+    score: float = Field(..., ge=1, le=5)
+    feedback_text: Optional[str] = Field(None, max_length=2000)
+
+
+class FeedbackResponse(BaseModel):
+    success: bool
+
+
+class SessionStats(BaseModel):
+    session_id: str
+    message_count: int
+    avg_feedback_score: Optional[float] = None
+    start_time: str
+    last_active: str
+    emotion_distribution: Dict[str, int]
+    total_prompt_tokens: int
+    total_completion_tokens: int
+    total_cached_tokens: int
+    estimated_cost_usd: float
+
+
+class KnowledgeBaseInfo(BaseModel):
+    total_documents: int
+    model: str
+    read_only: bool
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class StreamAwareGZipMiddleware:
+    """gzip 压缩普通响应，SSE 流式接口直接透传
+
+    较早版本的 Starlette GZipMiddleware 不区分 text/event-stream，会压缩并缓冲流式响应，
+    客户端要等缓冲区写满才收到片段；这里按路径绕过，不依赖具体的 Starlette 版本
+    """
+    
+    def __init__(self, app, stream_paths: Tuple[str, ...], minimum_size: int):
+        self.app = app
+        self.stream_paths = frozenset(stream_paths)
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.stream_paths:
+            await self.app(scope, receive, send)
+        else:
+            await self.gzip(scope, receive, send)
+
+
+class ChatAPI:
+    """HTTP 接口的处理逻辑
+
+    机器人调用是阻塞的，在专用线程池（APP_CONCURRENCY_LIMIT 个线程）中执行；
+    每个线程有自己的机器人实例，共用同一个RAG系统
+    """
+    
+    def __init__(self, rag_system: RAGSystem = None, max_workers: int = None):
+        self.pool = ChatbotPool(rag_system)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or Config.APP_CONCURRENCY_LIMIT,
+            thread_name_prefix="api-worker"
+        )
+    
+    async def run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+    
+    def create_session(self, user_id: Optional[str]) -> str:
+        return self.pool.bot.start_new_session(user_id=user_id)
+    
+    def chat(self, request: ChatRequest) -> Dict:
+        bot = self.pool.bot
+        # 未指定会话时新建，避免沿用本线程上一个请求的会话
+        session_id = request.session_id or bot.start_new_session(user_id=request.user_id)
+        return bot.chat(request.message, use_rag=request.use_rag, session_id=session_id)
+    
+    def stream_chat(self, request: ChatRequest, loop, queue: asyncio.Queue):
+        """在工作线程中逐段生成回复，通过队列交给事件循环发送；None 表示结束"""
+        try:
+            bot = self.pool.bot
+            session_id = request.session_id or bot.start_new_session(user_id=request.user_id)
+            for event in bot.chat_stream(request.message, use_rag=request.use_rag,
+                                         session_id=session_id):
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, {"type": "error", "detail": str(e)})
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+    
+    async def stream_events(self, request: ChatRequest):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        # 客户端中途断开时生成仍会完成，对话照常记录
+        loop.run_in_executor(self.executor, self.stream_chat, request, loop, queue)
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            kind = event.pop("type")
+            if kind == "done":
+                event = ChatResponse(**event).model_dump()
+            yield _sse(kind, event)
+    
+    def feedback(self, request: FeedbackRequest) -> bool:
+        return bool(self.pool.bot.add_feedback(
+            request.conversation_id, request.score, request.feedback_text
+        ))
+    
+    def session_stats(self, session_id: str) -> Dict:
+        return self.pool.bot.get_session_stats(session_id)
+    
+    def knowledge_base_info(self) -> Dict:
+        info = self.pool.bot.get_knowledge_base_info()
+        info["read_only"] = self.pool.rag_system.read_only
+        return info
+    
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+
+def create_app(rag_system: RAGSystem = None) -> FastAPI:
+    """创建 ASGI 应用；rag_system 可选，不指定时应用自己创建并在关闭时释放"""
+    api = ChatAPI(rag_system)
+    
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        yield
+        api.close()
+    
+    app = FastAPI(title="学习伙伴 API", description="大学生情绪支持AI助手的HTTP/JSON接口",
+                  lifespan=lifespan)
+    app.state.chat_api = api
+    app.add_middleware(StreamAwareGZipMiddleware, stream_paths=("/chat/stream",),
+                       minimum_size=Config.API_GZIP_MIN_SIZE)
+    
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+    
+    @app.post("/sessions", response_model=SessionResponse, status_code=201)
+    async def create_session(request: SessionRequest = None):
+        user_id = request.user_id if request else None
+        return SessionResponse(session_id=await api.run(api.create_session, user_id))
+    
+    @app.post("/chat", response_model=ChatResponse)
+    async def chat(request: ChatRequest):
+        return await api.run(api.chat, request)
+    
+    @app.post("/chat/stream")
+    async def chat_stream(request: ChatRequest):
+        """以 SSE 返回：若干 delta 事件（回复片段），最后一个 done 事件（与 /chat 的响应相同）"""
+        return StreamingResponse(
+            api.stream_events(request),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
+    @app.post("/feedback", response_model=FeedbackResponse)
+    async def feedback(request: FeedbackRequest):
+        if not await api.run(api.feedback, request):
+            raise HTTPException(status_code=404, detail="对话不存在")
+        return FeedbackResponse(success=True)
+    
+    @app.get("/sessions/{session_id}/stats", response_model=SessionStats)
+    async def session_stats(session_id: str):
+        stats = await api.run(api.session_stats, session_id)
+        if not stats:
+            raise HTTPException(status_code=404, detail="会话不存在")
+        return stats
+    
+    @app.get("/knowledge-base", response_model=KnowledgeBaseInfo)
+    async def knowledge_base():
+        return await api.run(api.knowledge_base_info)
+    
+    return app
+
+
+def launch_api(host: str = None, port: int = None):
+    """启动HTTP接口"""
+    import uvicorn
+    from metrics import start_metrics_server
+    from retention import start_retention_scheduler
+    
+    if Config.ENABLE_LATENCY_METRICS:
+        # 与应用监听同一地址（--host / APP_HOST）
+        start_metrics_server(host=host or Config.APP_HOST, port=Config.METRICS_PORT)
+        print(f"📈 延迟指标: http://{host or Config.APP_HOST}:{Config.METRICS_PORT}/metrics")
+    if Config.RETENTION_ENABLED:
+        start_retention_scheduler()
+    
+    uvicorn.run(
+        create_app(),
+        host=host or Config.APP_HOST,
+        port=port or Config.API_PORT,
+        timeout_keep_alive=Config.API_KEEPALIVE_SECONDS
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动HTTP/JSON接口")
+    parser.add_argument("--host", default=Config.APP_HOST)
+    parser.add_argument("--port", type=int, default=Config.API_PORT)
+    args = parser.parse_args()
+    launch_api(args.host, args.port)
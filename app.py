@@ -2,29 +2,52 @@
 Gradio Web界面
 提供友好的用户交互界面
 """
+import argparse
+import threading
+from collections import OrderedDict
 import gradio as gr
-from chatbot import create_chatbot
+from chatbot import ChatbotPool, EmotionalSupportChatbot
+from config import Config
+from rag_system import RAGSystem
+from metrics import start_metrics_server
+from retention import start_retention_scheduler
 from datetime import datetime
-import pandas as pd
 
 
 class ChatInterface:
-    """聊天界面类"""
+    """聊天界面类
     
-    def __init__(self):
-        self.bot = create_chatbot()
-        self.current_conversation_id = None
+    每个浏览器会话的状态（会话ID、最近一次对话ID）保存在 gr.State 中，对话历史在数据库中，
+    进程内不保存任何用户状态；每个处理线程使用自己的机器人实例，共用同一个RAG系统
+    """
     
-    def chat_response(self, message, history):
+    STATS_MARKDOWN_CACHE_SIZE = 1024
+    
+    def __init__(self, rag_system: RAGSystem = None):
+        self.pool = ChatbotPool(rag_system)
+        self.rag_system = self.pool.rag_system
+        # 会话ID -> (统计签名, 渲染好的Markdown)；统计未变化时直接返回
+        self._stats_markdown = OrderedDict()
+        self._stats_markdown_lock = threading.Lock()
+    
+    @property
+    def bot(self) -> EmotionalSupportChatbot:
+        """当前线程的机器人实例（首次使用时创建）"""
+        return self.pool.bot
+    
+    def chat_response(self, message, history, state=None):
         """处理聊天响应"""
+        state = dict(state or {})
         if not message.strip():
-            return history, ""
+            return history, "", state
         
-        # 调用聊天机器人
-        result = self.bot.chat(message)
+        # 调用聊天机器人（按会话ID恢复上下文，任一工作进程都可以继续该会话）
+        session_id = state.get("session_id") or self.bot.start_new_session()
+        result = self.bot.chat(message, session_id=session_id)
         
-        # 保存当前对话ID用于反馈
-        self.current_conversation_id = result['conversation_id']
+        # 保存会话ID和当前对话ID用于反馈
+        state["session_id"] = result['session_id']
+        state["conversation_id"] = result['conversation_id']
         
         # 格式化响应
         response = result['response']
@@ -38,23 +61,45 @@ class ChatInterface:
         # 更新历史
         history.append((message, response))
         
-        return history, ""
+        return history, "", state
     
-    def submit_feedback(self, score):
+    def submit_feedback(self, score, state=None):
         """提交反馈"""
-        if self.current_conversation_id:
-            self.bot.add_feedback(self.current_conversation_id, float(score))
+        conversation_id = (state or {}).get("conversation_id")
+        if conversation_id:
+            self.bot.add_feedback(conversation_id, float(score))
             return "✅ 感谢您的反馈！"
         return "❌ 没有可反馈的对话"
     
-    def get_statistics(self):
-        """获取统计信息"""
-        stats = self.bot.get_session_stats()
-        kb_info = self.bot.get_knowledge_base_info()
-        
+    def get_statistics(self, state=None):
+        """获取统计信息（会话统计和知识库文档数都来自缓存）"""
+        session_id = (state or {}).get("session_id")
+        stats = self.bot.get_session_stats(session_id) if session_id else {}
         if not stats:
             return "暂无统计数据"
+        kb_info = self.bot.get_knowledge_base_info()
         
+        signature = (
+            stats.get('message_count'), stats.get('avg_feedback_score'),
+            tuple(sorted(stats.get('emotion_distribution', {}).items())),
+            kb_info['total_documents']
+        )
+        with self._stats_markdown_lock:
+            cached = self._stats_markdown.get(session_id)
+            if cached is not None and cached[0] == signature:
+                self._stats_markdown.move_to_end(session_id)
+                return cached[1]
+        
+        output = self._render_statistics(stats, kb_info)
+        with self._stats_markdown_lock:
+            self._stats_markdown[session_id] = (signature, output)
+            self._stats_markdown.move_to_end(session_id)
+            while len(self._stats_markdown) > self.STATS_MARKDOWN_CACHE_SIZE:
+                self._stats_markdown.popitem(last=False)
+        return output
+    
+    @staticmethod
+    def _render_statistics(stats, kb_info):
         output = f"""
 ## 📊 会话统计
 
@@ -77,13 +122,15 @@ class ChatInterface:
         
         return output
     
-    def reset_chat(self):
+    def reset_chat(self, state=None):
         """重置对话"""
-        self.bot.reset_conversation()
-        return [], "✅ 对话已重置，开始新的会话！"
+        session_id = self.bot.start_new_session()
+        return [], "✅ 对话已重置，开始新的会话！", {"session_id": session_id}
     
     def trigger_learning(self):
         """触发学习"""
+        if self.rag_system.read_only:
+            return "⚠️ 当前工作进程的知识库为只读，学习任务由 writer 进程执行。"
         count = self.bot.trigger_learning()
         return f"✅ 学习完成！从高质量对话中学到了 {count} 条新知识。"
     
@@ -121,6 +168,9 @@ class ChatInterface:
                 """
             )
             
+            # 每个浏览器会话独立的状态
+            session_state = gr.State({})
+            
             with gr.Tab("💬 聊天"):
                 chatbot_ui = gr.Chatbot(
                     label="对话窗口",
@@ -139,7 +189,7 @@ class ChatInterface:
                 
                 with gr.Row():
                     clear_btn = gr.Button("🔄 重置对话")
-                    
+                
                 gr.Markdown("### 💝 为这次对话打分")
                 with gr.Row():
                     feedback_slider = gr.Slider(
@@ -156,24 +206,25 @@ class ChatInterface:
                 # 绑定事件
                 submit_btn.click(
                     self.chat_response,
-                    inputs=[msg_input, chatbot_ui],
-                    outputs=[chatbot_ui, msg_input]
+                    inputs=[msg_input, chatbot_ui, session_state],
+                    outputs=[chatbot_ui, msg_input, session_state]
                 )
                 
                 msg_input.submit(
                     self.chat_response,
-                    inputs=[msg_input, chatbot_ui],
-                    outputs=[chatbot_ui, msg_input]
+                    inputs=[msg_input, chatbot_ui, session_state],
+                    outputs=[chatbot_ui, msg_input, session_state]
                 )
                 
                 clear_btn.click(
                     self.reset_chat,
-                    outputs=[chatbot_ui, feedback_output]
+                    inputs=[session_state],
+                    outputs=[chatbot_ui, feedback_output, session_state]
                 )
                 
                 feedback_btn.click(
                     self.submit_feedback,
-                    inputs=[feedback_slider],
+                    inputs=[feedback_slider, session_state],
                     outputs=[feedback_output]
                 )
             
@@ -185,6 +236,7 @@ class ChatInterface:
                 
                 stats_btn.click(
                     self.get_statistics,
+                    inputs=[session_state],
                     outputs=[stats_output]
                 )
             
@@ -243,20 +295,41 @@ class ChatInterface:
                 )
         
         return interface
+    
+    def close(self):
+        """关闭所有线程的机器人实例和共用的RAG系统"""
+        self.pool.close()
 
 
-def launch_app():
+def launch_app(host: str = None, port: int = None):
     """启动应用"""
     app = ChatInterface()
     interface = app.build_interface()
     
+    # 在独立端口提供 Prometheus 指标
+    if Config.ENABLE_LATENCY_METRICS:
+        # 与应用监听同一地址（--host / APP_HOST）
+        start_metrics_server(host=host or Config.APP_HOST, port=Config.METRICS_PORT)
+        print(f"📈 延迟指标: http://{host or Config.APP_HOST}:{Config.METRICS_PORT}/metrics")
+    
+    # 定期归档和清理过期数据
+    if Config.RETENTION_ENABLED:
+        start_retention_scheduler()
+        print(f"🧹 数据保留策略已启用，每 {Config.RETENTION_INTERVAL_HOURS:g} 小时执行一次")
+    
+    # 每个处理线程有自己的机器人实例，可以并发处理多个会话
+    interface.queue(default_concurrency_limit=Config.APP_CONCURRENCY_LIMIT)
     interface.launch(
-        server_name="0.0.0.0",
-        server_port=7860,
+        server_name=host or Config.APP_HOST,
+        server_port=port or Config.APP_PORT,
         share=False,
         show_error=True
     )
 
 
 if __name__ == "__main__":
-    launch_app()
+    parser = argparse.ArgumentParser(description="启动Web界面")
+    parser.add_argument("--host", default=Config.APP_HOST)
+    parser.add_argument("--port", type=int, default=Config.APP_PORT)
+    args = parser.parse_args()
+    launch_app(args.host, args.port)
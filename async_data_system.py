@@ -0,0 +1,292 @@
+"""
+异步数据收集器
+基于 SQLAlchemy asyncio 引擎的 DataCollector 实现，面向 PostgreSQL 等支持并发写入的数据库：
+- 会话计数用 INSERT ... ON CONFLICT DO UPDATE 原子累加，不需要先查再改，也不会丢失并发更新
+- 一条消息的多个情绪记录一次批量插入
+- 每个操作一个短事务，连接来自连接池，多个工作进程并发写入互不阻塞
+
+AsyncDataCollector 的方法与 DataCollector 同名同参，均为协程；
+同步代码（聊天机器人）使用 BlockingDataCollector，它在后台事件循环线程中执行这些协程。
+一般通过 data_system.create_data_collector() 按 DATABASE_URL 自动选择。
+
+依赖：PostgreSQL 需要 asyncpg（迁移使用同步驱动 psycopg2），SQLite 需要 aiosqlite
+"""
+from datetime import datetime
+from typing import List, Dict, Optional
+import asyncio
+import functools
+import threading
+from sqlalchemy import event, func, insert, update, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from config import Config
+from data_system import (
+    CollectorQueries, Conversation, UserSession, EmotionTrend, SafetyCheck, create_db_engine
+)
+
+
+# 同步驱动 -> 异步驱动；迁移仍使用同步驱动执行
+ASYNC_DRIVER_FOR = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+SYNC_DRIVER_FOR = {
+    "postgresql+asyncpg": "postgresql",
+    "sqlite+aiosqlite": "sqlite",
+}
+
+
+def to_async_url(database_url: str) -> str:
+    url = make_url(database_url)
+    url = url.set(drivername=ASYNC_DRIVER_FOR.get(url.drivername, url.drivername))
+    return url.render_as_string(hide_password=False)
+
+
+def to_sync_url(database_url: str) -> str:
+    url = make_url(database_url)
+    url = url.set(drivername=SYNC_DRIVER_FOR.get(url.drivername, url.drivername))
+    return url.render_as_string(hide_password=False)
+
+
+class AsyncDataCollector(CollectorQueries):
+    """异步数据收集器（接口与 DataCollector 相同，方法为协程）"""
+    
+    def __init__(self, database_url: str = None):
+        from migrations import migrate
+        self.config = Config()
+        database_url = database_url or self.config.DATABASE_URL
+        
+        # 表结构迁移在启动时用同步引擎执行一次
+        sync_engine = create_db_engine(to_sync_url(database_url))
+        try:
+            migrate(sync_engine)
+        finally:
+            sync_engine.dispose()
+        
+        self.engine = create_async_engine(
+            to_async_url(database_url),
+            **self._pool_options(make_url(database_url))
+        )
+        self.dialect_name = self.engine.dialect.name
+        if self.dialect_name == "sqlite":
+            @event.listens_for(self.engine.sync_engine, "connect")
+            def _enable_foreign_keys(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA foreign_keys=ON")
+                cursor.close()
+    
+    def _pool_options(self, url) -> Dict:
+        if url.get_backend_name() == "sqlite":
+            return {}
+        return {
+            "pool_size": self.config.DATABASE_POOL_SIZE,
+            "max_overflow": self.config.DATABASE_MAX_OVERFLOW,
+            "pool_pre_ping": True
+        }
+    
+    def _insert(self, table):
+        """支持 ON CONFLICT 的方言 INSERT"""
+        if self.dialect_name == "postgresql":
+            return postgresql.insert(table)
+        if self.dialect_name == "sqlite":
+            return sqlite.insert(table)
+        raise NotImplementedError(f"异步数据收集器不支持的数据库: {self.dialect_name}")
+    
+    async def create_session(self, session_id: str, user_id: str = None) -> UserSession:
+        """创建新会话（已存在时保持不变，返回已有会话）"""
+        now = datetime.now()
+        table = UserSession.__table__
+        async with self.engine.begin() as conn:
+            await conn.execute(self._insert(table).values(
+                session_id=session_id,
+                user_id=user_id,
+                start_time=now,
+                last_active=now,
+                message_count=0
+            ).on_conflict_do_nothing(index_elements=["session_id"]))
+            row = (await conn.execute(select(table).where(table.c.session_id == session_id))).one()
+        return UserSession(**row._mapping)
+    
+    async def record_conversation(self, session_id: str, user_message: str,
+                                  ai_response: str, detected_emotions: List[str] = None,
+                                  rag_docs: List[Dict] = None,
+                                  usage: Dict = None) -> Conversation:
+        """记录对话，并原子累加会话计数与token用量（未知会话以本轮为首条消息创建）"""
+        usage = usage or {}
+        values = self.conversation_values(
+            session_id, user_message, ai_response, detected_emotions, rag_docs, usage
+        )
+        now = datetime.now()
+        values["timestamp"] = now
+        
+        table = UserSession.__table__
+        upsert = self._insert(table).values(
+            session_id=session_id,
+            start_time=now,
+            last_active=now,
+            message_count=1,
+            total_prompt_tokens=usage.get("prompt_tokens") or 0,
+            total_completion_tokens=usage.get("completion_tokens") or 0,
+            total_cached_tokens=usage.get("cached_tokens") or 0,
+            total_llm_latency_ms=usage.get("latency_ms") or 0.0
+        )
+        counters = ("message_count", "total_prompt_tokens", "total_completion_tokens",
+                    "total_cached_tokens", "total_llm_latency_ms")
+        upsert = upsert.on_conflict_do_update(
+            index_elements=["session_id"],
+            set_=dict(
+                {name: func.coalesce(table.c[name], 0) + upsert.excluded[name] for name in counters},
+                last_active=upsert.excluded.last_active
+            )
+        )
+        
+        async with self.engine.begin() as conn:
+            # 先保证会话行存在（外键），再写入对话
+            await conn.execute(upsert)
+            conversation_id = (await conn.execute(
+                insert(Conversation.__table__).values(**values).returning(Conversation.id)
+            )).scalar_one()
+        
+        return Conversation(id=conversation_id, **values)
+    
+    async def record_emotion_trend(self, session_id: str, emotion: str,
+                                   intensity: str = "中"):
+        """记录情绪趋势"""
+        await self.record_emotion_trends(session_id, [emotion], intensity)
+    
+    async def record_emotion_trends(self, session_id: str, emotions: List[str],
+                                    intensity: str = "中"):
+        """批量记录一条消息中检测到的多个情绪（一次 executemany）"""
+        if not emotions:
+            return
+        now = datetime.now()
+        async with self.engine.begin() as conn:
+            await conn.execute(insert(EmotionTrend.__table__), [
+                {"session_id": session_id, "emotion": emotion, "intensity": intensity, "timestamp": now}
+                for emotion in emotions
+            ])
+    
+    async def record_safety_check(self, session_id: str, screen_result: Dict,
+                                  conversation_id: int = None) -> SafetyCheck:
+        """记录安全筛查决策"""
+        values = self.safety_check_values(session_id, screen_result, conversation_id)
+        values["timestamp"] = datetime.now()
+        async with self.engine.begin() as conn:
+            check_id = (await conn.execute(
+                insert(SafetyCheck.__table__).values(**values).returning(SafetyCheck.id)
+            )).scalar_one()
+        return SafetyCheck(id=check_id, **values)
+    
+    async def add_feedback(self, conversation_id: int, score: float,
+                           feedback_text: str = None) -> bool:
+        """添加用户反馈，并在同一事务内用一条 UPDATE 重算会话平均评分"""
+        async with self.engine.begin() as conn:
+            session_id = (await conn.execute(
+                update(Conversation.__table__).where(
+                    Conversation.id == conversation_id
+                ).values(
+                    feedback_score=score, feedback_text=feedback_text
+                ).returning(Conversation.session_id)
+            )).scalar_one_or_none()
+            if session_id is None:
+                return False
+            
+            average = select(func.avg(Conversation.feedback_score)).where(
+                Conversation.session_id == session_id,
+                Conversation.feedback_score.isnot(None)
+            ).scalar_subquery()
+            await conn.execute(
+                update(UserSession.__table__).where(
+                    UserSession.session_id == session_id
+                ).values(avg_feedback_score=average)
+            )
+        return True
+    
+    async def _all(self, query) -> list:
+        async with self.engine.connect() as conn:
+            return (await conn.execute(query)).all()
+    
+    async def get_conversation(self, conversation_id: int) -> Optional[Dict]:
+        """按ID获取单条对话"""
+        rows = await self._all(self.conversation_query(conversation_id))
+        return dict(rows[0]._mapping) if rows else None
+    
+    async def get_conversation_history(self, session_id: str,
+                                       limit: int = 10) -> List[Dict]:
+        """获取对话历史"""
+        return self.history_from_rows(await self._all(self.history_query(session_id, limit)))
+    
+    async def get_message_count(self, session_id: str) -> Optional[int]:
+        """会话已记录的对话轮数；会话不存在时返回 None"""
+        rows = await self._all(self.message_count_query(session_id))
+        return (rows[0][0] or 0) if rows else None
+    
+    async def get_session_statistics(self, session_id: str) -> Dict:
+        """获取会话统计信息"""
+        async with self.engine.connect() as conn:
+            user_session = (await conn.execute(self.user_session_query(session_id))).first()
+            if not user_session:
+                return {}
+            emotion_rows = []
+            for query in self.emotion_count_queries(session_id):
+                emotion_rows.extend((await conn.execute(query)).all())
+            feedback_count = (await conn.execute(self.feedback_count_query(session_id))).scalar()
+        return self.session_statistics(user_session, emotion_rows, feedback_count)
+    
+    async def get_high_quality_conversations(self, min_score: float = 4.0,
+                                             limit: int = 50) -> List[Dict]:
+        """获取高质量对话（用于学习）"""
+        return self.high_quality_from_rows(await self._all(self.high_quality_query(min_score, limit)))
+    
+    async def get_cost_report(self, days: int = 7, top_n: int = 10) -> Dict:
+        """成本报表（与 DataCollector.get_cost_report 相同）"""
+        since, queries = self.cost_report_queries(days, top_n)
+        rows = {}
+        async with self.engine.connect() as conn:
+            for name, query in queries.items():
+                rows[name] = (await conn.execute(query)).all()
+        return self.build_cost_report(since, rows)
+    
+    async def close(self):
+        """释放连接池"""
+        await self.engine.dispose()
+
+
+class BlockingDataCollector:
+    """AsyncDataCollector 的同步包装，对外提供与 DataCollector 相同的同步接口
+
+    协程在专用的后台事件循环线程中执行，调用方线程阻塞等待结果；
+    多个调用方线程可以共用一个实例，数据库操作在连接池上并发进行
+    """
+    
+    def __init__(self, database_url: str = None):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="async-data-collector", daemon=True
+        )
+        self._thread.start()
+        self.collector = AsyncDataCollector(database_url)
+    
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+    
+    def __getattr__(self, name):
+        attr = getattr(self.collector, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            return self._run(attr(*args, **kwargs))
+        return call
+    
+    def close(self):
+        """释放连接池并停止事件循环线程"""
+        if self._loop.is_closed():
+            return
+        self._run(self.collector.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
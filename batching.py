@@ -0,0 +1,122 @@
+"""
+微批处理
+把短时间窗口内到达的并发请求合并为一次批量调用，再把结果分发回各调用方
+"""
+from concurrent.futures import Future
+from typing import Any, Callable, List
+import queue
+import threading
+import time
+
+
+class MicroBatcher:
+    """微批处理器 - 后台线程按时间窗口/批大小收集请求并批量执行"""
+    
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 64, max_wait_ms: float = 5.0,
+                 name: str = "micro-batcher"):
+        """
+        batch_fn: 接收请求列表，返回等长的结果列表
+        max_wait_ms: 第一个请求到达后最多等待多久再执行（限制附加延迟）
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._closed = False
+        # 关闭检查与入队在锁内完成，停止信号之后不会再有请求入队
+        self._close_lock = threading.Lock()
+        
+        # 统计信息
+        self.batch_count = 0
+        self.item_count = 0
+        
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+    
+    def submit(self, item: Any, timeout: float = None) -> Any:
+        """提交一个请求并阻塞等待结果"""
+        return self.submit_async(item).result(timeout=timeout)
+    
+    def submit_async(self, item: Any) -> Future:
+        """提交一个请求，返回 Future"""
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("批处理器已关闭")
+            self._queue.put((item, future))
+        return future
+    
+    def _collect(self):
+        """阻塞等待第一个请求，然后在时间窗口内尽量凑满一批
+
+        返回 (批次, 是否收到停止信号)
+        """
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+    
+    def _run(self):
+        while True:
+            batch, stop = self._collect()
+            if batch:
+                self._process(batch)
+            if stop:
+                return
+    
+    def _process(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = self.batch_fn(items)
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"批处理结果数量不匹配: {len(results)} != {len(items)}"
+                )
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        
+        self.batch_count += 1
+        self.item_count += len(items)
+    
+    @property
+    def avg_batch_size(self) -> float:
+        return self.item_count / self.batch_count if self.batch_count else 0.0
+    
+    def close(self):
+        """停止后台线程（已提交的请求会先处理完）
+        
+        后台线程已退出而队列中仍有请求时（线程异常退出），让这些请求失败，调用方不会一直等待
+        """
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join(timeout=5)
+        if self._worker.is_alive():
+            return  # 仍在处理，停止信号之前的请求由后台线程处理完
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if entry is not None:
+                entry[1].set_exception(RuntimeError("批处理器已关闭"))
@@ -0,0 +1,82 @@
+"""
+基准测试结果对比
+比较两次 run_benchmarks.py 的JSON输出，超过阈值的退化会被标记，并以非零状态码退出
+
+用法：
+    python benchmarks/compare.py baseline.json current.json --threshold 10
+"""
+from typing import Dict, Iterator, Tuple
+import argparse
+import json
+import sys
+
+
+def flatten(results: Dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    """把嵌套结果展开为 (路径, 数值)"""
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, float(value)
+
+
+def direction(metric: str) -> int:
+    """1: 越大越好（吞吐）；-1: 越小越好（延迟）；0: 不参与比较"""
+    name = metric.rsplit(".", 1)[-1]
+    if name.endswith("_per_sec"):
+        return 1
+    if name.endswith("_ms"):
+        return -1
+    return 0
+
+
+def compare(baseline: Dict, current: Dict, threshold: float):
+    """返回 [(指标, 基线值, 当前值, 变化百分比, 是否退化)]"""
+    base_metrics = dict(flatten(baseline.get("results", {})))
+    rows = []
+    for metric, value in flatten(current.get("results", {})):
+        sign = direction(metric)
+        if sign == 0 or metric not in base_metrics:
+            continue
+        base_value = base_metrics[metric]
+        if base_value == 0:
+            continue
+        change = (value - base_value) / base_value * 100
+        regressed = change * sign < -threshold
+        rows.append((metric, base_value, value, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比两次基准测试结果")
+    parser.add_argument("baseline", help="基线结果JSON")
+    parser.add_argument("current", help="当前结果JSON")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="判定为退化的变化百分比（默认10%%）")
+    args = parser.parse_args()
+    
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    
+    print(f"基线: {baseline['meta'].get('commit')}  当前: {current['meta'].get('commit')}")
+    if baseline["meta"].get("params") != current["meta"].get("params"):
+        print("⚠️ 两次运行的参数不同，对比结果仅供参考")
+    
+    rows = compare(baseline, current, args.threshold)
+    width = max((len(r[0]) for r in rows), default=10)
+    for metric, base_value, value, change, regressed in rows:
+        flag = "❌ 退化" if regressed else ""
+        print(f"{metric:<{width}}  {base_value:>12.2f}  {value:>12.2f}  {change:>+8.1f}%  {flag}")
+    
+    regressions = [r for r in rows if r[4]]
+    if regressions:
+        print(f"\n共 {len(regressions)} 项指标退化超过 {args.threshold}%")
+        sys.exit(1)
+    print("\n✅ 未发现超过阈值的退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+并发负载测试
+模拟大量学生同时使用：按真实的多轮对话脚本发送消息（含反馈打分），统计吞吐、延迟分位数、
+错误率以及各阶段（数据库提交、向量检索等）的耗时，用于评估硬件规模和验证并发改动
+
+目标：
+    bot        每个虚拟用户一个 EmotionalSupportChatbot，共享知识库（进程内）
+    interface  所有用户共用一个 app.ChatInterface，与当前 Gradio 部署方式一致（进程内，需要 gradio）
+    http       通过 gradio_client 访问已启动的 Gradio 服务（需要 gradio_client）
+
+用法：
+    python benchmarks/load_test.py --users 200 --target bot --llm-latency lognormal:800:0.4
+    python benchmarks/load_test.py --users 50 --target http --url http://127.0.0.1:7860
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from synthetic import LatencyModel, StubOpenAIServer, generate_knowledge
+from run_benchmarks import (
+    create_encoder_for, fresh_rag_system, git_commit, setup_environment, summarize
+)
+
+
+# 多轮对话脚本：(消息, 反馈分数或None)
+CONVERSATION_SCRIPTS = [
+    [
+        ("下周就要期末考试了，我感觉好焦虑，根本复习不完", None),
+        ("主要是高数和大物，每门都有好多章节没看", None),
+        ("我试试把复习计划拆成每天的小目标吧，谢谢", 5),
+    ],
+    [
+        ("最近和室友关系很僵，回宿舍都觉得压抑", None),
+        ("她总是很晚打电话，我说过一次但没什么用", None),
+        ("如果再沟通一次，我应该怎么开口比较好？", None),
+        ("好的，我今晚试着跟她聊聊", 4),
+    ],
+    [
+        ("找实习投了三十多份简历都没有回音，好沮丧", None),
+        ("身边同学都拿到offer了，感觉自己很失败", None),
+        ("谢谢你的建议，我会先改改简历", 4),
+    ],
+    [
+        ("我每天都熬夜到三点，白天上课特别困", None),
+        ("一躺下就忍不住刷手机，停不下来", 3),
+    ],
+    [
+        ("刚来大学一个人在外地，感觉很孤独", None),
+        ("社团也不知道该加哪个，怕融入不了", None),
+        ("听起来可以先去看看感兴趣的活动", None),
+        ("嗯，这周末有个读书会，我去试试", 5),
+    ],
+    [
+        ("论文下周截止，我一个字都还没写，怎么办", None),
+        ("每次打开文档就想逃避，一拖再拖", None),
+        ("两分钟规则听起来不错，我现在就先写个提纲", 4),
+    ],
+    [
+        ("考研还是工作，我纠结了好几个月了", None),
+        ("家里希望我考研，但我自己更想早点工作", None),
+        ("好的，我会找时间和父母好好谈谈", None),
+    ],
+]
+
+
+class TurnError(Exception):
+    """对话轮次失败（接口没有抛异常但返回了错误结果）"""
+
+
+class BotTarget:
+    """进程内目标：每个虚拟用户一个聊天机器人实例，共享RAG系统"""
+    
+    def __init__(self, rag_system):
+        from data_system import DataCollector
+        self.rag_system = rag_system
+        # 预先建表和迁移，避免首批用户的初始化开销干扰稳态测量
+        DataCollector().close()
+    
+    def new_user(self):
+        from chatbot import EmotionalSupportChatbot
+        return _BotUser(EmotionalSupportChatbot(rag_system=self.rag_system))
+    
+    def close(self):
+        pass
+
+
+class _BotUser:
+    def __init__(self, bot):
+        self.bot = bot
+        self.conversation_id = None
+    
+    def send(self, message: str):
+        result = self.bot.chat(message)
+        self.conversation_id = result["conversation_id"]
+        if result.get("usage") is None:
+            raise TurnError("LLM调用失败")
+    
+    def feedback(self, score: float):
+        if not self.bot.add_feedback(self.conversation_id, score):
+            raise TurnError("反馈写入失败")
+    
+    def close(self):
+        self.bot.close()
+
+
+class InterfaceTarget:
+    """进程内目标：所有用户共用一个 ChatInterface（与 app.py 的部署方式一致）"""
+    
+    def __init__(self, rag_system):
+        from app import ChatInterface
+        self.interface = ChatInterface(rag_system=rag_system)
+    
+    def new_user(self):
+        return _InterfaceUser(self.interface)
+    
+    def close(self):
+        self.interface.close()
+
+
+class _InterfaceUser:
+    def __init__(self, interface):
+        self.interface = interface
+        self.history = []
+        self.state = {}  # 相当于浏览器会话的 gr.State
+    
+    def send(self, message: str):
+        self.history, _, self.state = self.interface.chat_response(message, self.history, self.state)
+    
+    def feedback(self, score: float):
+        status = self.interface.submit_feedback(score, self.state)
+        if status.startswith("❌"):
+            raise TurnError(status)
+    
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """HTTP目标：通过 gradio_client 调用已启动的 Gradio 服务"""
+    
+    def __init__(self, url: str):
+        from gradio_client import Client  # 可选依赖
+        self.client_class = Client
+        self.url = url
+    
+    def new_user(self):
+        return _HttpUser(self.client_class(self.url, verbose=False))
+    
+    def close(self):
+        pass
+
+
+class _HttpUser:
+    def __init__(self, client):
+        self.client = client
+        self.history = []
+    
+    def send(self, message: str):
+        self.history, _ = self.client.predict(message, self.history, api_name="/chat_response")
+    
+    def feedback(self, score: float):
+        status = self.client.predict(score, api_name="/submit_feedback")
+        if status.startswith("❌"):
+            raise TurnError(status)
+    
+    def close(self):
+        pass
+
+
+class LoadTestStats:
+    """线程安全的结果收集"""
+    
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {"chat": [], "feedback": []}
+        self.errors: Dict[str, Counter] = {"chat": Counter(), "feedback": Counter()}
+        self._lock = threading.Lock()
+    
+    def record(self, op: str, seconds: float, error: Exception = None):
+        with self._lock:
+            if error is None:
+                self.latencies[op].append(seconds)
+            else:
+                message = str(error).splitlines()[0][:80] if str(error) else ""
+                self.errors[op][f"{type(error).__name__}: {message}"] += 1
+    
+    def report(self, elapsed: float) -> Dict:
+        result = {}
+        for op, latencies in self.latencies.items():
+            error_count = sum(self.errors[op].values())
+            total = len(latencies) + error_count
+            result[op] = dict(
+                summarize(latencies),
+                requests=total,
+                errors=error_count,
+                error_rate=error_count / total if total else 0.0,
+                ok_per_sec=len(latencies) / elapsed,
+                error_types=dict(self.errors[op].most_common(5))
+            )
+        return result
+
+
+def run_user(target, user_idx: int, args, stats: LoadTestStats,
+             think_time: LatencyModel, start_delay: float):
+    """单个虚拟用户：按脚本多轮对话，对话间隔模拟思考时间"""
+    rng = random.Random(args.seed + user_idx)
+    time.sleep(start_delay)
+    
+    try:
+        user = target.new_user()
+    except Exception as e:
+        stats.record("chat", 0.0, e)
+        return
+    
+    try:
+        for _ in range(args.iterations):
+            for message, score in rng.choice(CONVERSATION_SCRIPTS):
+                start = time.perf_counter()
+                try:
+                    user.send(message)
+                    stats.record("chat", time.perf_counter() - start)
+                except Exception as e:
+                    stats.record("chat", time.perf_counter() - start, e)
+                    continue
+                
+                if score is not None and rng.random() < args.feedback_rate:
+                    start = time.perf_counter()
+                    try:
+                        user.feedback(float(score))
+                        stats.record("feedback", time.perf_counter() - start)
+                    except Exception as e:
+                        stats.record("feedback", time.perf_counter() - start, e)
+                
+                time.sleep(think_time.sample())
+    finally:
+        user.close()
+
+
+def print_report(report: Dict):
+    for op, data in report["results"].items():
+        if not data.get("requests"):
+            continue
+        print(f"\n[{op}] 请求 {data['requests']}，错误率 {data['error_rate']:.1%}，"
+              f"成功吞吐 {data['ok_per_sec']:.1f}/s")
+        if data.get("count"):
+            print(f"  p50 {data['p50_ms']:.0f}ms  p95 {data['p95_ms']:.0f}ms  p99 {data['p99_ms']:.0f}ms")
+        for error, count in data["error_types"].items():
+            print(f"  ❌ {count} × {error}")
+    
+    stages = report.get("stages")
+    if stages:
+        print("\n[各阶段耗时] 数据库提交(*_commit)与检索(embedding/retrieval)的尾延迟反映资源争用")
+        for stage, data in stages.items():
+            print(f"  {stage:<22} n={data['count']:<6} p50 {data['p50_ms']:8.1f}ms  "
+                  f"p95 {data['p95_ms']:8.1f}ms  p99 {data['p99_ms']:8.1f}ms")
+    
+    llm = report.get("llm_stub")
+    if llm:
+        print(f"\n[模拟LLM] 请求 {llm['requests']}，注入错误 {llm['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="学习伙伴并发负载测试")
+    parser.add_argument("--target", choices=["bot", "interface", "http"], default="bot")
+    parser.add_argument("--url", default="http://127.0.0.1:7860", help="http目标的Gradio地址")
+    parser.add_argument("--users", type=int, default=50, help="并发虚拟用户数")
+    parser.add_argument("--iterations", type=int, default=1, help="每个用户执行的对话脚本数")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="所有用户启动完毕所需秒数")
+    parser.add_argument("--think-time", default="uniform:500:2000", help="两轮消息之间的间隔分布（毫秒）")
+    parser.add_argument("--feedback-rate", type=float, default=0.6, help="脚本中反馈被实际点击的概率")
+    parser.add_argument("--llm-latency", default="lognormal:800:0.4", help="模拟LLM延迟分布（毫秒）")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="模拟LLM错误率")
+    parser.add_argument("--kb-size", type=int, default=1000, help="合成知识库条目数")
+    parser.add_argument("--encoder", choices=["hash", "configured"], default="hash")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果JSON路径")
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    server = None
+    rag = None
+    
+    try:
+        if args.target == "http":
+            target = HttpTarget(args.url)
+        else:
+            setup_environment(workdir)
+            from config import Config
+            from metrics import REGISTRY
+            
+            server = StubOpenAIServer(
+                latency=args.llm_latency, error_rate=args.llm_error_rate, seed=args.seed
+            ).start()
+            Config.OPENAI_BASE_URL = server.base_url
+            Config.ENABLE_LATENCY_METRICS = True
+            REGISTRY.reset()
+            
+            rag = fresh_rag_system(workdir, "load", create_encoder_for(args.encoder))
+            knowledge = generate_knowledge(args.kb_size, seed=args.seed)
+            for i in range(0, len(knowledge), 500):
+                rag.add_knowledge_batch(knowledge[i:i + 500])
+            
+            target = BotTarget(rag) if args.target == "bot" else InterfaceTarget(rag)
+        
+        stats = LoadTestStats()
+        think_time = LatencyModel(args.think_time, seed=args.seed)
+        threads = [
+            threading.Thread(
+                target=run_user,
+                args=(target, i, args, stats, think_time, args.ramp_up * i / max(1, args.users)),
+                name=f"vuser-{i}",
+                daemon=True
+            )
+            for i in range(args.users)
+        ]
+        
+        print(f"▶ {args.users} 个虚拟用户 → {args.target}，LLM延迟 {args.llm_latency}")
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        target.close()
+        
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "params": vars(args),
+                "elapsed_seconds": elapsed
+            },
+            "results": stats.report(elapsed)
+        }
+        if server is not None:
+            report["stages"] = REGISTRY.summary()
+            report["llm_stub"] = {"requests": server.request_count, "errors": server.error_count}
+        
+        print(f"\n耗时 {elapsed:.1f}s")
+        print_report(report)
+        
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"\n✅ 结果已写入 {args.output}")
+    finally:
+        if server is not None:
+            server.shutdown()
+        if rag is not None:
+            rag.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
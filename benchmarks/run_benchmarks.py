@@ -0,0 +1,295 @@
+"""
+性能基准测试
+完全离线运行：合成知识库 + 哈希编码器 + 本地模拟 OpenAI 接口，结果输出为JSON便于跨提交对比
+
+用法：
+    python benchmarks/run_benchmarks.py --output bench_results.json
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/compare.py baseline.json bench_results.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import (  # noqa: E402
+    HashingEncoder, StubOpenAIServer, generate_knowledge, generate_messages
+)
+
+
+def setup_environment(workdir: str):
+    """在导入项目模块之前设置隔离的测试环境"""
+    os.environ["OPENAI_API_KEY"] = "bench-key"
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["CHROMA_PERSIST_DIRECTORY"] = os.path.join(workdir, "chroma")
+
+
+def summarize(latencies: List[float]) -> Dict:
+    """延迟列表（秒）-> 分位数摘要（毫秒）"""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+    last = len(ordered) - 1
+    
+    def pick(q):
+        return ordered[min(last, int(q * len(ordered)))] * 1000
+    
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": pick(0.5),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99)
+    }
+
+
+def create_encoder_for(kind: str):
+    if kind == "hash":
+        return HashingEncoder()
+    from embedding_backends import create_encoder
+    return create_encoder()
+
+
+def fresh_rag_system(workdir: str, name: str, encoder):
+    """在独立的Chroma目录中创建RAG系统"""
+    from config import Config
+    from rag_system import RAGSystem
+    
+    Config.CHROMA_PERSIST_DIRECTORY = os.path.join(workdir, f"chroma_{name}")
+    return RAGSystem(embedding_model=encoder)
+
+
+def bench_ingest(workdir: str, encoder, doc_count: int, batch_size: int) -> Dict:
+    """add_knowledge_batch 写入速率"""
+    rag = fresh_rag_system(workdir, "ingest", encoder)
+    knowledge = generate_knowledge(doc_count, seed=1)
+    
+    start = time.perf_counter()
+    for i in range(0, doc_count, batch_size):
+        rag.add_knowledge_batch(knowledge[i:i + batch_size])
+    elapsed = time.perf_counter() - start
+    rag.close()
+    
+    return {
+        "docs": doc_count,
+        "batch_size": batch_size,
+        "seconds": elapsed,
+        "docs_per_sec": doc_count / elapsed
+    }
+
+
+def bench_retrieve(workdir: str, encoder, kb_sizes: List[int],
+                   query_count: int, modes: List[str]) -> Dict:
+    """retrieve 延迟随知识库规模的变化"""
+    queries = generate_messages(query_count, seed=2)
+    results = {}
+    for size in kb_sizes:
+        rag = fresh_rag_system(workdir, f"kb_{size}", encoder)
+        knowledge = generate_knowledge(size, seed=3)
+        for i in range(0, size, 500):
+            rag.add_knowledge_batch(knowledge[i:i + 500])
+        
+        size_results = {}
+        for mode in modes:
+            rag.retrieve(queries[0], mode=mode)  # 预热
+            latencies = []
+            for query in queries:
+                # 清空查询向量缓存，使每次测量包含编码开销
+                rag._query_embedding_cache.clear()
+                start = time.perf_counter()
+                rag.retrieve(query, mode=mode)
+                latencies.append(time.perf_counter() - start)
+            size_results[mode] = summarize(latencies)
+        results[f"kb_{size}"] = size_results
+        rag.close()
+    return results
+
+
+def bench_data_collector(records: int) -> Dict:
+    """数据收集器写入吞吐（按 DATABASE_URL 选择同步或异步实现）"""
+    from data_system import create_data_collector
+    import uuid
+    
+    collector = create_data_collector()
+    session_id = str(uuid.uuid4())
+    collector.create_session(session_id)
+    
+    start = time.perf_counter()
+    for i in range(records):
+        collector.record_conversation(
+            session_id=session_id,
+            user_message=f"基准测试消息 {i}",
+            ai_response="基准测试回复",
+            detected_emotions=["焦虑"],
+            rag_docs=[{"content": "参考内容", "metadata": {"category": "焦虑"}}]
+        )
+    conversation_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for i in range(records):
+        collector.record_emotion_trend(session_id, "压力")
+    trend_seconds = time.perf_counter() - start
+    collector.close()
+    
+    return {
+        "records": records,
+        "conversations_per_sec": records / conversation_seconds,
+        "emotion_trends_per_sec": records / trend_seconds
+    }
+
+
+def bench_emotion_analyzer(message_count: int) -> Dict:
+    """EmotionAnalyzer 关键词检测吞吐"""
+    from prompt_engineering import EmotionAnalyzer
+    
+    analyzer = EmotionAnalyzer()
+    messages = generate_messages(message_count, seed=4)
+    
+    start = time.perf_counter()
+    for message in messages:
+        analyzer.detect_emotion_keywords(message)
+    elapsed = time.perf_counter() - start
+    
+    return {"messages": message_count, "messages_per_sec": message_count / elapsed}
+
+
+def bench_chat(workdir: str, encoder, concurrency_levels: List[int],
+               turns_per_worker: int, llm_latency: str, kb_size: int) -> Dict:
+    """端到端 chat 吞吐（每个并发用户一个机器人实例，共享知识库）"""
+    from config import Config
+    from chatbot import EmotionalSupportChatbot
+    
+    server = StubOpenAIServer(latency=llm_latency, seed=5).start()
+    Config.OPENAI_BASE_URL = server.base_url
+    
+    rag = fresh_rag_system(workdir, "chat", encoder)
+    rag.add_knowledge_batch(generate_knowledge(kb_size, seed=6))
+    messages = generate_messages(turns_per_worker * max(concurrency_levels), seed=7)
+    
+    results = {}
+    try:
+        for concurrency in concurrency_levels:
+            bots = [EmotionalSupportChatbot(rag_system=rag) for _ in range(concurrency)]
+            
+            def run_worker(worker_idx):
+                bot = bots[worker_idx]
+                latencies = []
+                for turn in range(turns_per_worker):
+                    message = messages[worker_idx * turns_per_worker + turn]
+                    start = time.perf_counter()
+                    bot.chat(message)
+                    latencies.append(time.perf_counter() - start)
+                return latencies
+            
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                worker_latencies = list(pool.map(run_worker, range(concurrency)))
+            elapsed = time.perf_counter() - start
+            
+            for bot in bots:
+                bot.close()
+            
+            all_latencies = [l for latencies in worker_latencies for l in latencies]
+            results[f"concurrency_{concurrency}"] = dict(
+                summarize(all_latencies),
+                turns_per_sec=len(all_latencies) / elapsed
+            )
+    finally:
+        server.shutdown()
+        rag.close()
+    
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="学习伙伴性能基准测试（离线）")
+    parser.add_argument("--output", default="bench_results.json", help="结果JSON路径")
+    parser.add_argument("--quick", action="store_true", help="使用较小的数据规模快速运行")
+    parser.add_argument("--encoder", choices=["hash", "configured"], default="hash",
+                        help="hash: 离线哈希编码器；configured: 按配置加载真实嵌入模型")
+    parser.add_argument("--llm-latency", default="fixed:20",
+                        help="模拟LLM延迟，如 fixed:20 / uniform:10:50 / lognormal:300:0.5")
+    parser.add_argument("--only", nargs="*",
+                        choices=["ingest", "retrieve", "data_collector", "emotion", "chat"],
+                        help="只运行指定的基准项")
+    args = parser.parse_args()
+    
+    if args.quick:
+        params = {"ingest_docs": 500, "kb_sizes": [100, 1000], "queries": 50,
+                  "db_records": 300, "emotion_messages": 5000,
+                  "concurrency": [1, 4], "turns_per_worker": 5, "chat_kb_size": 200}
+    else:
+        params = {"ingest_docs": 3000, "kb_sizes": [100, 1000, 5000], "queries": 200,
+                  "db_records": 2000, "emotion_messages": 50000,
+                  "concurrency": [1, 4, 16], "turns_per_worker": 20, "chat_kb_size": 1000}
+    
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    setup_environment(workdir)
+    selected = set(args.only or ["ingest", "retrieve", "data_collector", "emotion", "chat"])
+    
+    encoder = create_encoder_for(args.encoder)
+    results = {}
+    try:
+        if "ingest" in selected:
+            print("▶ 知识库写入...")
+            results["ingest"] = bench_ingest(workdir, encoder, params["ingest_docs"], batch_size=100)
+        if "retrieve" in selected:
+            print("▶ 检索延迟...")
+            results["retrieve"] = bench_retrieve(
+                workdir, encoder, params["kb_sizes"], params["queries"],
+                modes=["vector", "keyword", "hybrid"]
+            )
+        if "data_collector" in selected:
+            print("▶ 数据库写入...")
+            results["data_collector"] = bench_data_collector(params["db_records"])
+        if "emotion" in selected:
+            print("▶ 情绪分析...")
+            results["emotion_analyzer"] = bench_emotion_analyzer(params["emotion_messages"])
+        if "chat" in selected:
+            print("▶ 端到端对话...")
+            results["chat"] = bench_chat(
+                workdir, encoder, params["concurrency"], params["turns_per_worker"],
+                args.llm_latency, params["chat_kb_size"]
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "encoder": args.encoder,
+            "llm_latency": args.llm_latency,
+            "params": params
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 基准测试完成，结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
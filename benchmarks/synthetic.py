@@ -0,0 +1,241 @@
+"""
+基准测试用的离线组件
+合成知识库/消息生成器、无需下载模型的哈希编码器、模拟 OpenAI 接口的本地服务
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+import hashlib
+import json
+import random
+import threading
+import time
+import numpy as np
+
+
+CATEGORIES = ["焦虑", "压力", "困惑", "沮丧", "孤独", "疲惫", "拖延", "睡眠", "人际关系"]
+
+TOPICS = [
+    "考试", "期末复习", "论文", "实习", "找工作", "室友关系", "社团活动", "家人期待",
+    "时间管理", "早起", "熬夜", "考研", "出国申请", "绩点", "小组作业", "演讲",
+]
+
+STRATEGIES = [
+    "深呼吸练习：吸气4秒，保持4秒，呼气4秒",
+    "番茄工作法：专注25分钟，休息5分钟",
+    "把大目标拆成可以在一天内完成的小目标",
+    "写情绪日记，记录触发情绪的具体事件",
+    "每天30分钟有氧运动，比如快走或慢跑",
+    "睡前一小时放下手机，保持规律作息",
+    "主动约一位朋友聊天或一起吃饭",
+    "预约学校心理咨询中心的免费咨询",
+    "用'两分钟规则'立即完成很小的任务",
+    "练习正念，观察呼吸和身体感觉而不评判",
+]
+
+MESSAGE_TEMPLATES = [
+    "最近{topic}让我特别{emotion}，不知道该怎么办",
+    "我因为{topic}已经好几天睡不好了，感觉很{emotion}",
+    "{topic}的压力太大了，我有点承受不了",
+    "有没有什么方法能缓解{topic}带来的{emotion}？",
+    "我对{topic}感到很迷茫，身边也没人可以说",
+    "今天{topic}进展不错，心情好一些了",
+]
+
+EMOTION_WORDS = ["焦虑", "紧张", "难过", "孤独", "疲惫", "迷茫", "沮丧", "担心"]
+
+
+def generate_knowledge(count: int, seed: int = 0) -> List[Dict]:
+    """生成合成知识条目（格式与 add_knowledge_batch 一致）"""
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        category = rng.choice(CATEGORIES)
+        topic = rng.choice(TOPICS)
+        strategy = rng.choice(STRATEGIES)
+        items.append({
+            "content": f"面对{topic}带来的{category}时，可以尝试{strategy}。坚持一段时间会有帮助。（条目{i}）",
+            "category": category,
+            "type": "合成数据"
+        })
+    return items
+
+
+def generate_messages(count: int, seed: int = 0) -> List[str]:
+    """生成合成用户消息"""
+    rng = random.Random(seed)
+    return [
+        rng.choice(MESSAGE_TEMPLATES).format(
+            topic=rng.choice(TOPICS),
+            emotion=rng.choice(EMOTION_WORDS)
+        )
+        for _ in range(count)
+    ]
+
+
+class HashingEncoder:
+    """哈希编码器 - 字符n-gram哈希到固定维度，确定性且无需下载模型"""
+    
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+    
+    def _encode_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for n in (1, 2, 3):
+            for i in range(len(text) - n + 1):
+                digest = hashlib.blake2b(text[i:i + n].encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vector[value % self.dimension] += 1.0 if value & (1 << 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.stack([self._encode_one(t) for t in texts]) if texts else \
+            np.zeros((0, self.dimension), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+class LatencyModel:
+    """模拟LLM延迟分布
+
+    规格字符串：
+      fixed:MS             固定延迟
+      uniform:LOW:HIGH     均匀分布（毫秒）
+      lognormal:MEDIAN:SIGMA  对数正态分布（中位数毫秒，sigma）
+    """
+    
+    def __init__(self, spec: str = "fixed:0", seed: int = None):
+        parts = spec.split(":")
+        self.kind = parts[0]
+        self.params = [float(p) for p in parts[1:]]
+        if self.kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"未知的延迟分布: {spec}")
+        self.spec = spec
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    def sample(self) -> float:
+        """采样一次延迟（秒）"""
+        with self._lock:
+            if self.kind == "fixed":
+                ms = self.params[0]
+            elif self.kind == "uniform":
+                ms = self._rng.uniform(self.params[0], self.params[1])
+            else:
+                ms = self.params[0] * self._rng.lognormvariate(0.0, self.params[1])
+        return ms / 1000.0
+
+
+class StubOpenAIServer:
+    """本地模拟 OpenAI Chat Completions 接口（支持 stream=True）"""
+    
+    REPLY = "我能理解你现在的感受，这种情绪很正常。可以先试着把任务拆小，一步一步来。需要的话也可以和身边信任的人聊聊。"
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: str = "fixed:0", error_rate: float = 0.0, seed: int = None):
+        self.latency = LatencyModel(latency, seed=seed)
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self.request_count = 0
+        self.error_count = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+    
+    def _reply_for(self, messages: List[Dict]) -> str:
+        last = messages[-1].get("content", "") if messages else ""
+        if "请评估以下消息" in last:
+            return json.dumps({"is_critical": False, "reason": "模拟安全检查"}, ensure_ascii=False)
+        return self.REPLY
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.request_count += 1
+                    fail = server._rng.random() < server.error_rate
+                    if fail:
+                        server.error_count += 1
+                
+                time.sleep(server.latency.sample())
+                
+                if fail:
+                    body = json.dumps({"error": {"message": "模拟的服务端错误", "type": "server_error"}})
+                    self._send(500, "application/json", body.encode("utf-8"))
+                    return
+                
+                messages = request.get("messages", [])
+                content = server._reply_for(messages)
+                prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 2
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(content) // 2,
+                    "total_tokens": prompt_tokens + len(content) // 2,
+                    "prompt_tokens_details": {"cached_tokens": 0}
+                }
+                base = {
+                    "id": "chatcmpl-stub",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub")
+                }
+                
+                if request.get("stream"):
+                    self._send_stream(base, content, usage)
+                    return
+                
+                body = dict(base, object="chat.completion", usage=usage, choices=[{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }])
+                self._send(200, "application/json", json.dumps(body).encode("utf-8"))
+            
+            def _send(self, status: int, content_type: str, data: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def _send_stream(self, base: Dict, content: str, usage: Dict):
+                chunks = [content[i:i + 8] for i in range(0, len(content), 8)]
+                events = []
+                for piece in chunks:
+                    events.append(dict(base, object="chat.completion.chunk", choices=[{
+                        "index": 0, "delta": {"content": piece}, "finish_reason": None
+                    }]))
+                events.append(dict(base, object="chat.completion.chunk", choices=[{
+                    "index": 0, "delta": {}, "finish_reason": "stop"
+                }]))
+                events.append(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+                
+                data = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+                self._send(200, "text/event-stream", data.encode("utf-8"))
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="stub-openai", daemon=True).start()
+        return self
+    
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -2,89 +2,436 @@
 AI聊天机器人核心引擎
 整合RAG、Prompt Engineering和数据收集系统
 """
+from collections import OrderedDict
+from datetime import datetime
 from openai import OpenAI
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Tuple
+import json
+import re
+import threading
+import time
 import uuid
 from config import Config
 from rag_system import RAGSystem, KnowledgeEnricher
 from prompt_engineering import PromptBuilder, EmotionAnalyzer
-from data_system import DataCollector, LearningSystem
+from data_system import LearningSystem, create_data_collector
+from safety import CrisisScreener
+from metrics import REGISTRY, StageTimer
+
+
+class SessionHistoryCache:
+    """会话历史LRU缓存（进程内共享）
+    
+    每个条目同时记录缓存时会话的对话轮数；恢复会话时与数据库中的轮数比对，
+    会话在其他进程中继续过则视为未命中，从数据库重新加载
+    """
+    
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, session_id: str) -> Optional[Tuple[int, List[Dict]]]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+            return entry
+    
+    def put(self, session_id: str, message_count: int, history: List[Dict]):
+        with self._lock:
+            self._entries[session_id] = (message_count, list(history))
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SessionStatsCache:
+    """会话统计缓存（进程内共享）
+    
+    本进程记录情绪、对话和反馈时增量更新条目，统计页读取时不查询数据库；
+    会话可能在其他进程中继续，条目缓存超过 ttl_seconds 后视为未命中，从数据库重新加载
+    """
+    
+    def __init__(self, max_sessions: int, ttl_seconds: float):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # session_id -> (加载时间, 统计)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def empty(session_id: str) -> Dict:
+        """新会话的统计（字段与 get_session_statistics 相同）"""
+        now = datetime.now().isoformat()
+        return {
+            "session_id": session_id,
+            "message_count": 0,
+            "avg_feedback_score": None,
+            "feedback_count": 0,
+            "start_time": now,
+            "last_active": now,
+            "emotion_distribution": {},
+            "total_prompt_tokens": 0,
+            "total_completion_tokens": 0,
+            "total_cached_tokens": 0,
+            "estimated_cost_usd": 0.0
+        }
+    
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            stats = entry[1]
+            return dict(stats, emotion_distribution=dict(stats["emotion_distribution"]))
+    
+    def put(self, session_id: str, stats: Dict):
+        with self._lock:
+            self._entries[session_id] = (
+                time.monotonic(),
+                dict(stats, emotion_distribution=dict(stats.get("emotion_distribution") or {}))
+            )
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+    
+    def _update(self, session_id: str, apply):
+        """只更新已缓存的会话；未缓存的会话在读取时从数据库加载"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                apply(entry[1])
+    
+    def record_emotions(self, session_id: str, emotions: List[str]):
+        if not emotions:
+            return
+        
+        def apply(stats):
+            distribution = stats["emotion_distribution"]
+            for emotion in emotions:
+                distribution[emotion] = distribution.get(emotion, 0) + 1
+        self._update(session_id, apply)
+    
+    def record_turn(self, session_id: str, usage: Optional[Dict]):
+        usage = usage or {}
+        
+        def apply(stats):
+            stats["message_count"] = (stats["message_count"] or 0) + 1
+            stats["last_active"] = datetime.now().isoformat()
+            stats["total_prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["total_completion_tokens"] += usage.get("completion_tokens") or 0
+            stats["total_cached_tokens"] += usage.get("cached_tokens") or 0
+        self._update(session_id, apply)
+    
+    def record_feedback(self, session_id: str, previous_score: Optional[float], score: float):
+        """previous_score 为该对话原有的评分（首次评分为 None），平均分按总分增量更新"""
+        def apply(stats):
+            count = stats["feedback_count"]
+            total = (stats["avg_feedback_score"] or 0.0) * count
+            if previous_score is None:
+                count += 1
+                total += score
+            else:
+                total += score - previous_score
+            stats["feedback_count"] = count
+            stats["avg_feedback_score"] = total / count if count else None
+        self._update(session_id, apply)
+    
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# 同一进程内的所有聊天机器人实例共用
+SESSION_HISTORY_CACHE = SessionHistoryCache(Config.SESSION_HISTORY_CACHE_SIZE)
+SESSION_STATS_CACHE = SessionStatsCache(
+    Config.SESSION_HISTORY_CACHE_SIZE, Config.SESSION_STATS_CACHE_TTL_SECONDS
+)
+
+
+def create_crisis_screener(rag_system: RAGSystem) -> CrisisScreener:
+    """创建与检索共用嵌入模型的危机筛查器"""
+    return CrisisScreener(
+        encoder=rag_system.embedding_model,
+        similarity_threshold=Config.CRISIS_SIMILARITY_THRESHOLD
+    )
 
 
 class EmotionalSupportChatbot:
     """情绪支持聊天机器人"""
     
-    def __init__(self):
-        """初始化聊天机器人"""
+    def __init__(self, rag_system: RAGSystem = None, crisis_screener: CrisisScreener = None,
+                 data_collector=None):
+        """初始化聊天机器人
+        
+        rag_system: 可选的共享RAG系统实例（多个会话共用同一知识库和嵌入模型）
+        crisis_screener: 可选的共享危机筛查器（示例句向量每个进程只编码一次）
+        data_collector: 可选的共享数据收集器（多个线程共用一个连接池，异步实现共用一个事件循环）
+        """
         self.config = Config()
         self.config.validate()
         
         # 初始化OpenAI客户端
-        self.client = OpenAI(api_key=self.config.OPENAI_API_KEY)
+        self.client = OpenAI(
+            api_key=self.config.OPENAI_API_KEY,
+            base_url=self.config.OPENAI_BASE_URL
+        )
         
         # 初始化各个系统
-        self.rag_system = RAGSystem()
+        self._owns_rag_system = rag_system is None
+        self.rag_system = rag_system or RAGSystem()
         self.prompt_builder = PromptBuilder()
         self.emotion_analyzer = EmotionAnalyzer()
-        self.data_collector = DataCollector()
+        self._owns_data_collector = data_collector is None
+        self.data_collector = data_collector or create_data_collector()
         self.learning_system = LearningSystem(self.data_collector, self.rag_system)
         self.knowledge_enricher = KnowledgeEnricher(self.rag_system)
+        # 危机筛查与检索共用嵌入模型
+        self.crisis_screener = crisis_screener or create_crisis_screener(self.rag_system)
         
         # 会话管理
         self.current_session_id = None
         self.conversation_history = []
+        self.history_cache = SESSION_HISTORY_CACHE
+        self.stats_cache = SESSION_STATS_CACHE
+        self._message_count = 0
     
-    def start_new_session(self, user_id: str = None) -> str:
+    def start_new_session(self, user_id: str = None, session_id: str = None) -> str:
         """开始新会话"""
-        session_id = str(uuid.uuid4())
+        session_id = session_id or str(uuid.uuid4())
         self.current_session_id = session_id
         self.conversation_history = []
+        self._message_count = 0
         self.data_collector.create_session(session_id, user_id)
+        self.history_cache.put(session_id, 0, [])
+        self.stats_cache.put(session_id, SessionStatsCache.empty(session_id))
         return session_id
     
-    def chat(self, user_message: str, use_rag: bool = True) -> Dict:
-        """处理用户消息并返回AI回复"""
+    def resume_session(self, session_id: str) -> bool:
+        """恢复已有会话的上下文，会话不存在时返回 False
+        
+        先按会话ID查询已记录的轮数（唯一索引查找），与缓存一致时直接使用缓存的历史；
+        否则用一次 (session_id, timestamp) 索引查询加载最近的对话并写入缓存
+        """
+        message_count = self.data_collector.get_message_count(session_id)
+        if message_count is None:
+            return False
         
+        cached = self.history_cache.get(session_id)
+        if cached is not None and cached[0] == message_count:
+            history = cached[1]
+        else:
+            history = self._load_history(session_id)
+            self.history_cache.put(session_id, message_count, history)
+        
+        self.current_session_id = session_id
+        self.conversation_history = list(history)
+        self._message_count = message_count
+        return True
+    
+    def _load_history(self, session_id: str) -> List[Dict]:
+        """从数据库加载最近的对话，截断规则与内存中的历史一致"""
+        history = [
+            {"role": turn["role"], "content": turn["content"]}
+            for turn in self.data_collector.get_conversation_history(
+                session_id, limit=self.config.MAX_CONVERSATION_HISTORY
+            )
+        ]
+        if self.prompt_builder.prefix_caching:
+            history = self.prompt_builder.trim_history(history)
+        return history
+    
+    def chat(self, user_message: str, use_rag: bool = True,
+             return_timings: bool = False, session_id: str = None) -> Dict:
+        """处理用户消息并返回AI回复
+        
+        return_timings: 为 True 时在结果中返回各阶段耗时（毫秒）
+        session_id: 指定时先恢复该会话（不存在则以该ID新建），任一进程都可以继续同一会话
+        """
+        self._enter_session(session_id)
+        timer = self._new_timer(return_timings)
+        
+        with timer.span("total"):
+            turn = self._prepare_turn(user_message, use_rag, timer)
+            with timer.span("llm_call"):
+                ai_response, usage = self._complete(turn["messages"], user_message)
+            result = self._finish_turn(user_message, turn, ai_response, usage, timer)
+        
+        if return_timings:
+            result["timings"] = dict(timer.timings)
+        return result
+    
+    def chat_stream(self, user_message: str, use_rag: bool = True,
+                    session_id: str = None) -> Iterator[Dict]:
+        """流式处理用户消息
+        
+        逐段产出 {"type": "delta", "content": 文本片段}，回复完成并记录后产出
+        {"type": "done", ...}，其余字段与 chat() 的返回值相同；
+        中途关闭生成器时已生成的部分同样记录
+        """
+        self._enter_session(session_id)
+        timer = self._new_timer(False)
+        
+        with timer.span("total"):
+            turn = self._prepare_turn(user_message, use_rag, timer)
+            pieces = []
+            usage = None
+            try:
+                with timer.span("llm_call"):
+                    try:
+                        llm_start = time.perf_counter()
+                        stream = self.client.chat.completions.create(
+                            model=self.config.OPENAI_MODEL,
+                            messages=turn["messages"],
+                            temperature=self.config.TEMPERATURE,
+                            max_tokens=self.config.MAX_TOKENS,
+                            stream=True,
+                            stream_options={"include_usage": True}
+                        )
+                        model = None
+                        for chunk in stream:
+                            model = getattr(chunk, "model", None) or model
+                            if getattr(chunk, "usage", None) is not None:
+                                usage = self._extract_usage(chunk)
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                piece = chunk.choices[0].delta.content
+                                pieces.append(piece)
+                                yield {"type": "delta", "content": piece}
+                        if usage:
+                            self._annotate_usage(usage, turn["messages"], user_message,
+                                                 (time.perf_counter() - llm_start) * 1000, model)
+                    
+                    except Exception as e:
+                        apology = f"抱歉，我遇到了一些技术问题：{str(e)}。请稍后再试。"
+                        pieces.append(apology)
+                        usage = None
+                        yield {"type": "delta", "content": apology}
+            finally:
+                # 消费方中途关闭生成器（客户端断开）时也记录已生成的部分回复
+                result = self._finish_turn(user_message, turn, "".join(pieces), usage, timer)
+        
+        yield dict(result, type="done")
+    
+    def _enter_session(self, session_id: Optional[str]):
+        """切换到指定会话（不存在则以该ID新建）；未指定时沿用当前会话"""
+        if session_id and not self.resume_session(session_id):
+            self.start_new_session(session_id=session_id)
         if not self.current_session_id:
             self.start_new_session()
-        
+    
+    def _new_timer(self, return_timings: bool) -> StageTimer:
+        return StageTimer(
+            registry=REGISTRY if self.config.ENABLE_LATENCY_METRICS else None,
+            enabled=self.config.ENABLE_LATENCY_METRICS or return_timings
+        )
+    
+    def _prepare_turn(self, user_message: str, use_rag: bool, timer: StageTimer) -> Dict:
+        """调用LLM之前的步骤：情绪分析、安全筛查、检索和构建提示词"""
         # 1. 情绪分析
-        detected_emotions = self.emotion_analyzer.detect_emotion_keywords(user_message)
+        with timer.span("emotion_detection"):
+            detected_emotions = self.emotion_analyzer.detect_emotion_keywords(user_message)
         
         # 记录情绪趋势
-        for emotion in detected_emotions:
-            self.data_collector.record_emotion_trend(
-                self.current_session_id, 
-                emotion
+        with timer.span("emotion_trend_commit"):
+            self.data_collector.record_emotion_trends(
+                self.current_session_id,
+                detected_emotions
             )
+            self.stats_cache.record_emotions(self.current_session_id, detected_emotions)
+        
+        # 2. 生成查询向量（缓存后供安全筛查和检索共用）
+        query_embedding = None
+        if use_rag or self.config.CRISIS_SCREEN_ENABLED:
+            with timer.span("embedding"):
+                query_embedding = self.rag_system.encode_query(user_message)
+        
+        # 3. 危机风险筛查（本地完成，仅命中时调用LLM安全检查）
+        with timer.span("safety_screen"):
+            safety = self.screen_message(user_message, query_embedding)
         
-        # 2. RAG检索（如果启用）
+        # 4. RAG检索（如果启用）
         rag_docs = []
         if use_rag:
-            rag_docs = self.rag_system.retrieve(user_message)
+            with timer.span("retrieval"):
+                rag_docs = self.rag_system.retrieve(user_message, emotions=detected_emotions)
         
-        # 3. 构建提示词
-        messages = self.prompt_builder.build_messages(
-            user_message=user_message,
-            conversation_history=self.conversation_history,
-            rag_docs=rag_docs if use_rag else None
-        )
+        # 5. 构建提示词
+        with timer.span("prompt_build"):
+            messages = self.prompt_builder.build_messages(
+                user_message=user_message,
+                conversation_history=self.conversation_history,
+                rag_docs=rag_docs if use_rag else None,
+                safety_alert=bool(safety.get("is_critical"))
+            )
         
-        # 4. 调用GPT-4o-mini
+        return {
+            "detected_emotions": detected_emotions,
+            "safety": safety,
+            "rag_docs": rag_docs,
+            "messages": messages
+        }
+    
+    def _complete(self, messages: List[Dict], user_message: str) -> Tuple[str, Optional[Dict]]:
+        """6. 调用GPT-4o-mini，返回 (回复, token用量)"""
         try:
+            llm_start = time.perf_counter()
             response = self.client.chat.completions.create(
                 model=self.config.OPENAI_MODEL,
                 messages=messages,
                 temperature=self.config.TEMPERATURE,
                 max_tokens=self.config.MAX_TOKENS
             )
+            llm_latency_ms = (time.perf_counter() - llm_start) * 1000
             
             ai_response = response.choices[0].message.content
-            
+            usage = self._extract_usage(response)
+            if usage:
+                self._annotate_usage(usage, messages, user_message, llm_latency_ms,
+                                     getattr(response, "model", None))
+            return ai_response, usage
+        
         except Exception as e:
-            ai_response = f"抱歉，我遇到了一些技术问题：{str(e)}。请稍后再试。"
+            return f"抱歉，我遇到了一些技术问题：{str(e)}。请稍后再试。", None
+    
+    def _annotate_usage(self, usage: Dict, messages: List[Dict], user_message: str,
+                        latency_ms: float, model: Optional[str]):
+        usage.update(self._split_prompt_tokens(
+            usage["prompt_tokens"],
+            self.prompt_builder.prompt_composition(messages, user_message)
+        ))
+        usage["latency_ms"] = latency_ms
+        usage["model"] = model or self.config.OPENAI_MODEL
+    
+    def _finish_turn(self, user_message: str, turn: Dict, ai_response: str,
+                     usage: Optional[Dict], timer: StageTimer) -> Dict:
+        """LLM返回之后的步骤：更新历史、记录对话并组装结果"""
+        detected_emotions = turn["detected_emotions"]
+        safety = turn["safety"]
+        rag_docs = turn["rag_docs"]
         
-        # 5. 更新对话历史
+        # 7. 更新对话历史
         self.conversation_history.append({
             "role": "user",
             "content": user_message
@@ -95,66 +442,163 @@ class EmotionalSupportChatbot:
         })
         
         # 保持历史记录在合理长度
-        if len(self.conversation_history) > self.config.MAX_CONVERSATION_HISTORY * 2:
+        if self.prompt_builder.prefix_caching:
+            # 按块截断，保持下一轮的提示词前缀不变
+            self.conversation_history = self.prompt_builder.trim_history(self.conversation_history)
+        elif len(self.conversation_history) > self.config.MAX_CONVERSATION_HISTORY * 2:
             self.conversation_history = self.conversation_history[-self.config.MAX_CONVERSATION_HISTORY * 2:]
         
-        # 6. 记录对话到数据库
-        conversation_record = self.data_collector.record_conversation(
-            session_id=self.current_session_id,
-            user_message=user_message,
-            ai_response=ai_response,
-            detected_emotions=detected_emotions,
-            rag_docs=[{
-                'content': doc.get('content', ''),
-                'metadata': doc.get('metadata', {})
-            } for doc in rag_docs]
-        )
+        # 8. 记录对话到数据库
+        with timer.span("conversation_commit"):
+            conversation_record = self.data_collector.record_conversation(
+                session_id=self.current_session_id,
+                user_message=user_message,
+                ai_response=ai_response,
+                detected_emotions=detected_emotions,
+                rag_docs=[{
+                    'content': doc.get('content', ''),
+                    'metadata': doc.get('metadata', {})
+                } for doc in rag_docs],
+                usage=usage
+            )
+            self._message_count += 1
+            self.history_cache.put(
+                self.current_session_id, self._message_count, self.conversation_history
+            )
+            self.stats_cache.record_turn(self.current_session_id, usage)
+            
+            if safety["flagged"]:
+                self.data_collector.record_safety_check(
+                    self.current_session_id,
+                    safety,
+                    conversation_id=conversation_record.id
+                )
         
-        # 7. 返回结果
+        # 9. 返回结果
         return {
             "response": ai_response,
             "detected_emotions": detected_emotions,
             "rag_docs_count": len(rag_docs),
             "conversation_id": conversation_record.id,
-            "session_id": self.current_session_id
+            "session_id": self.current_session_id,
+            "safety": safety,
+            "usage": usage
+        }
+    
+    @staticmethod
+    def _extract_usage(response) -> Optional[Dict]:
+        """从API响应中提取token用量（含命中前缀缓存的token数）"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        return {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0
+        }
+    
+    @staticmethod
+    def _split_prompt_tokens(prompt_tokens: int, composition: Dict[str, int]) -> Dict:
+        """按字符占比把提示词token分摊到知识库参考和对话历史（估算值）"""
+        total_chars = sum(composition.values())
+        if not total_chars:
+            return {"rag_context_tokens": 0, "history_tokens": 0}
+        return {
+            "rag_context_tokens": round(prompt_tokens * composition["rag_context"] / total_chars),
+            "history_tokens": round(prompt_tokens * composition["history"] / total_chars)
         }
     
+    def screen_message(self, user_message: str, query_embedding=None) -> Dict:
+        """危机风险筛查：本地短语/相似度筛查，命中后升级为LLM安全检查"""
+        if not self.config.CRISIS_SCREEN_ENABLED:
+            return {"flagged": False, "method": None, "matched_phrases": [],
+                    "similarity": None, "escalated": False}
+        
+        # 知识库切换嵌入模型后，危机示例句改用新模型编码
+        if self.crisis_screener.encoder is not self.rag_system.embedding_model:
+            self.crisis_screener.set_encoder(self.rag_system.embedding_model)
+        # 查询向量进入缓存，随后的检索直接复用
+        if query_embedding is None:
+            query_embedding = self.rag_system.encode_query(user_message)
+        safety = self.crisis_screener.screen(user_message, query_embedding)
+        safety["escalated"] = False
+        
+        if safety["flagged"]:
+            safety["escalated"] = True
+            safety.update(self._llm_safety_check(user_message))
+        
+        return safety
+    
+    def _llm_safety_check(self, user_message: str) -> Dict:
+        """调用LLM安全检查；无法得到明确结论时按高风险处理"""
+        try:
+            response = self.client.chat.completions.create(
+                model=self.config.OPENAI_MODEL,
+                messages=[{
+                    "role": "user",
+                    "content": self.prompt_builder.create_safety_check_prompt(user_message)
+                }],
+                temperature=0,
+                max_tokens=200
+            )
+            content = response.choices[0].message.content or ""
+            match = re.search(r"\{.*\}", content, re.S)
+            result = json.loads(match.group(0) if match else content)
+            return {
+                "is_critical": bool(result.get("is_critical")),
+                "reason": result.get("reason", "")
+            }
+        except Exception as e:
+            return {"is_critical": True, "reason": f"安全检查失败，按高风险处理：{e}"}
+    
     def add_feedback(self, conversation_id: int, score: float, 
                     feedback_text: str = None):
         """添加用户反馈"""
+        # 先取对话记录：所属会话和原有评分用于增量更新统计，内容用于学习
+        conv = self.data_collector.get_conversation(conversation_id)
         success = self.data_collector.add_feedback(
             conversation_id, 
             score, 
             feedback_text
         )
+        if success and conv:
+            self.stats_cache.record_feedback(conv["session_id"], conv["feedback_score"], score)
         
         # 如果反馈良好，考虑加入学习缓冲区
-        if success and score >= 4.0:
-            # 获取对话记录
-            conv = self.data_collector.session.query(
-                self.data_collector.session.query(
-                    self.data_collector.Conversation
-                ).filter_by(id=conversation_id).first()
+        if success and conv and score >= 4.0:
+            knowledge_item = self.knowledge_enricher.extract_useful_exchange(
+                conv["user_message"],
+                conv["ai_response"],
+                score
             )
-            if conv:
-                knowledge_item = self.knowledge_enricher.extract_useful_exchange(
-                    conv.user_message,
-                    conv.ai_response,
-                    score
-                )
-                if knowledge_item:
-                    self.knowledge_enricher.add_to_buffer(knowledge_item)
+            if knowledge_item:
+                self.knowledge_enricher.add_to_buffer(knowledge_item)
         
         return success
     
-    def get_session_stats(self) -> Dict:
-        """获取当前会话统计"""
-        if not self.current_session_id:
+    def get_session_stats(self, session_id: str = None) -> Dict:
+        """获取会话统计（默认当前会话）
+        
+        优先使用增量维护的缓存，未命中或过期时从数据库加载一次
+        """
+        session_id = session_id or self.current_session_id
+        if not session_id:
             return {}
         
-        return self.data_collector.get_session_statistics(
-            self.current_session_id
+        stats = self.stats_cache.get(session_id)
+        if stats is None:
+            stats = self.data_collector.get_session_statistics(session_id)
+            if stats:
+                self.stats_cache.put(session_id, stats)
+            return stats
+        
+        stats["estimated_cost_usd"] = self.data_collector.estimate_cost(
+            stats["total_prompt_tokens"],
+            stats["total_completion_tokens"],
+            stats["total_cached_tokens"]
         )
+        return stats
     
     def trigger_learning(self, min_score: float = 4.0) -> int:
         """触发学习过程"""
@@ -164,13 +608,21 @@ class EmotionalSupportChatbot:
         # 提交缓冲区中的知识
         buffer_count = self.knowledge_enricher.commit_buffer_to_kb(min_buffer_size=1)
         
+        # 导出新快照，快照模式的服务进程随后切换
+        if learned_count + buffer_count and self.config.KB_SNAPSHOT_EXPORT:
+            self.rag_system.export_snapshot()
+        
         return learned_count + buffer_count
     
+    def get_cost_report(self, days: int = 7, top_n: int = 10) -> Dict:
+        """获取token用量与成本报表"""
+        return self.data_collector.get_cost_report(days=days, top_n=top_n)
+    
     def get_knowledge_base_info(self) -> Dict:
         """获取知识库信息"""
         return {
             "total_documents": self.rag_system.get_knowledge_count(),
-            "model": self.config.EMBEDDING_MODEL
+            "model": self.rag_system.embedding_model_name
         }
     
     def reset_conversation(self):
@@ -180,7 +632,54 @@ class EmotionalSupportChatbot:
     
     def close(self):
         """关闭系统，释放资源"""
+        if self._owns_rag_system:
+            self.rag_system.close()
+        if self._owns_data_collector:
+            self.data_collector.close()
+
+
+class ChatbotPool:
+    """每个处理线程一个机器人实例，共用同一个RAG系统（知识库和嵌入模型）、危机筛查器和数据收集器
+    
+    机器人实例持有当前会话的上下文，不能被并发调用；Web界面和HTTP接口在各自的
+    工作线程中通过 pool.bot 取得本线程的实例，并按请求携带的会话ID恢复上下文
+    """
+    
+    def __init__(self, rag_system: RAGSystem = None):
+        self._owns_rag_system = rag_system is None
+        self.rag_system = rag_system or RAGSystem()
+        # 危机示例句向量只编码一次，供所有线程的机器人共用
+        self.crisis_screener = create_crisis_screener(self.rag_system)
+        # 数据收集器线程安全，所有线程共用一个连接池（异步实现还共用一个事件循环线程）
+        self.data_collector = create_data_collector()
+        self._local = threading.local()
+        self._bots = []
+        self._bots_lock = threading.Lock()
+    
+    @property
+    def bot(self) -> EmotionalSupportChatbot:
+        """当前线程的机器人实例（首次使用时创建）"""
+        bot = getattr(self._local, "bot", None)
+        if bot is None:
+            bot = EmotionalSupportChatbot(
+                rag_system=self.rag_system,
+                crisis_screener=self.crisis_screener,
+                data_collector=self.data_collector
+            )
+            with self._bots_lock:
+                self._bots.append(bot)
+            self._local.bot = bot
+        return bot
+    
+    def close(self):
+        """关闭所有线程的机器人实例、共用的数据收集器和RAG系统"""
+        with self._bots_lock:
+            bots, self._bots = self._bots, []
+        for bot in bots:
+            bot.close()
         self.data_collector.close()
+        if self._owns_rag_system:
+            self.rag_system.close()
 
 
 # 便捷函数
@@ -13,23 +13,101 @@ class Config:
     # OpenAI 配置
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    # 可选：兼容OpenAI协议的自定义端点（如代理或本地模拟服务）
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
     TEMPERATURE = float(os.getenv("TEMPERATURE", "0.7"))
     MAX_TOKENS = int(os.getenv("MAX_TOKENS", "1000"))
+    # 模型单价（美元/百万token，默认按 gpt-4o-mini），用于成本报表
+    LLM_PRICE_INPUT_PER_1M = float(os.getenv("LLM_PRICE_INPUT_PER_1M", "0.15"))
+    LLM_PRICE_CACHED_INPUT_PER_1M = float(os.getenv("LLM_PRICE_CACHED_INPUT_PER_1M", "0.075"))
+    LLM_PRICE_OUTPUT_PER_1M = float(os.getenv("LLM_PRICE_OUTPUT_PER_1M", "0.60"))
     
     # 数据库配置
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chat_history.db")
+    # postgresql:// 或异步驱动（+asyncpg / +aiosqlite）使用异步数据收集器，以下为其连接池大小
+    DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+    DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+    # SQLite 日志模式；WAL 允许多个工作进程在写入的同时读取
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
     
     # 向量数据库配置
     CHROMA_PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_db")
-    # 使用 all-MiniLM-L6-v2 - 最小的模型（约80MB），下载更快
-    EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+    # 多进程部署时只有一个 writer 进程写入知识库，reader 进程只读，
+    # 发现 writer 更新后（最多每 CHROMA_REFRESH_SECONDS 秒检查一次）重新打开集合
+    CHROMA_ROLE = os.getenv("CHROMA_ROLE", "writer")
+    CHROMA_REFRESH_SECONDS = float(os.getenv("CHROMA_REFRESH_SECONDS", "10"))
+    # 快照模式（CHROMA_ROLE=snapshot）：服务进程不打开 Chroma，只把 writer 导出的只读快照加载到内存，
+    # 后台每 CHROMA_REFRESH_SECONDS 秒检查新版本并原子切换；writer 开启 KB_SNAPSHOT_EXPORT 后
+    # 在启动（知识库有变化时）、入库和学习完成后导出快照
+    KB_SNAPSHOT_DIR = os.getenv("KB_SNAPSHOT_DIR", "./kb_snapshots")
+    KB_SNAPSHOT_EXPORT = os.getenv("KB_SNAPSHOT_EXPORT", "false").lower() == "true"
+    KB_SNAPSHOT_KEEP = int(os.getenv("KB_SNAPSHOT_KEEP", "3"))
+    # 知识库去重（kb_maintenance.py）：余弦相似度不低于阈值的学习案例每簇只保留评分最高的一篇
+    KB_DEDUP_THRESHOLD = float(os.getenv("KB_DEDUP_THRESHOLD", "0.95"))
+    KB_DEDUP_BLOCK_SIZE = int(os.getenv("KB_DEDUP_BLOCK_SIZE", "256"))  # 每块相似度矩阵 block × 文档数
+    KB_DEDUP_BATCH_SIZE = int(os.getenv("KB_DEDUP_BATCH_SIZE", "500"))  # 每批删除的文档数
+    # 默认使用 all-MiniLM-L6-v2 - 最小的模型（约80MB），下载更快
+    # 新部署使用的嵌入模型；已有知识库更换模型请用 embedding_registry.py 重建并切换（不停服）
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    EMBEDDING_REINDEX_BATCH_SIZE = int(os.getenv("EMBEDDING_REINDEX_BATCH_SIZE", "256"))  # 重建索引时每批编码的文档数
+    # 嵌入后端：sentence-transformers（PyTorch）/ onnx（ONNX Runtime，无需torch）
+    #          / remote（调用共享嵌入服务 embedding_server.py）
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+    EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "./onnx_model")
+    # model.onnx 或 int8动态量化后的 model_quantized.onnx
+    EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "model.onnx")
+    # 共享嵌入服务配置
+    EMBEDDING_SERVER_HOST = os.getenv("EMBEDDING_SERVER_HOST", "127.0.0.1")
+    EMBEDDING_SERVER_PORT = int(os.getenv("EMBEDDING_SERVER_PORT", "8765"))
+    EMBEDDING_SERVER_URL = os.getenv(
+        "EMBEDDING_SERVER_URL",
+        f"http://{EMBEDDING_SERVER_HOST}:{EMBEDDING_SERVER_PORT}"
+    )
+    EMBEDDING_SERVER_BACKEND = os.getenv("EMBEDDING_SERVER_BACKEND", "sentence-transformers")
+    EMBEDDING_SERVER_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_SERVER_BATCH_WAIT_MS", "5"))
+    # 文档嵌入持久化缓存（embedding_cache.py）：按 (模型, 文本哈希) 保存向量，重建知识库时只编码新文本
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "false").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+    # 向量量化：none（向量保存在Chroma中检索）/ int8 / float16（向量保存在量化存储中，首轮检索量化编码，float32重排）
+    # 量化集合的 Chroma 只保存文档和元数据，常驻内存的编码为 float32 的 1/4（int8）或 1/2（float16），
+    # float32 原始向量只在磁盘上按需读取；只对新建的集合生效，已有集合用 embedding_registry.py reindex 转换
+    EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "none")
+    QUANTIZED_RERANK_MULTIPLIER = 4  # 量化检索候选数为 top_k 的倍数，再用float32重排
     
     # 对话配置
     MAX_CONVERSATION_HISTORY = int(os.getenv("MAX_CONVERSATION_HISTORY", "10"))
+    # 会话历史LRU缓存（按会话数），未命中时从数据库加载最近的对话
+    SESSION_HISTORY_CACHE_SIZE = int(os.getenv("SESSION_HISTORY_CACHE_SIZE", "1024"))
+    # 会话统计缓存（条目数同上）：本进程记录对话时增量更新，超过该秒数后从数据库重新加载
+    # （会话可能在其他工作进程中继续）
+    SESSION_STATS_CACHE_TTL_SECONDS = float(os.getenv("SESSION_STATS_CACHE_TTL_SECONDS", "30"))
+    # 提示词前缀缓存布局：固定前缀在前、变量内容在后，历史按块截断
+    PROMPT_PREFIX_CACHING = os.getenv("PROMPT_PREFIX_CACHING", "false").lower() == "true"
+    PROMPT_HISTORY_TRIM_STEP = int(os.getenv("PROMPT_HISTORY_TRIM_STEP", "6"))  # 历史超限时一次丢弃的消息数
     
     # RAG 配置
     RAG_TOP_K = 3  # 检索最相关的前K个文档
     RAG_SIMILARITY_THRESHOLD = 0.7  # 相似度阈值
+    # 检索模式：vector（纯向量）/ keyword（BM25）/ hybrid（RRF融合）
+    RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+    RAG_CANDIDATE_MULTIPLIER = 4  # 混合检索时每路召回 top_k 的倍数
+    RAG_RRF_K = 60  # RRF融合常数
+    # 重排（reranker.py）：召回 RAG_RERANK_POOL 篇候选，按向量/BM25/情绪类别/反馈/时间重新打分，
+    # 只保留 RAG_RERANK_TOP_K 篇；超过时间预算时跳过剩余信号
+    RAG_RERANK = os.getenv("RAG_RERANK", "false").lower() == "true"
+    RAG_RERANK_POOL = int(os.getenv("RAG_RERANK_POOL", "12"))
+    RAG_RERANK_TOP_K = int(os.getenv("RAG_RERANK_TOP_K", "2"))
+    RAG_RERANK_BUDGET_MS = float(os.getenv("RAG_RERANK_BUDGET_MS", "5"))
+    RAG_RERANK_RECENCY_HALF_LIFE_DAYS = float(os.getenv("RAG_RERANK_RECENCY_HALF_LIFE_DAYS", "90"))
+    # 并发查询合并：窗口内到达的查询一次批量编码并一次检索
+    RAG_COALESCE_QUERIES = os.getenv("RAG_COALESCE_QUERIES", "false").lower() == "true"
+    RAG_COALESCE_WINDOW_MS = float(os.getenv("RAG_COALESCE_WINDOW_MS", "3"))
+    RAG_COALESCE_MAX_BATCH = 32
+    QUERY_EMBEDDING_CACHE_SIZE = 256  # 查询向量LRU缓存条数
+    
+    # 危机筛查配置（本地快速筛查，命中后才调用LLM安全检查）
+    CRISIS_SCREEN_ENABLED = os.getenv("CRISIS_SCREEN_ENABLED", "true").lower() == "true"
+    CRISIS_SIMILARITY_THRESHOLD = float(os.getenv("CRISIS_SIMILARITY_THRESHOLD", "0.75"))
     
     # 情绪分析配置
     EMOTION_CATEGORIES = [
@@ -37,6 +115,36 @@ class Config:
         "疲惫", "积极", "中性"
     ]
     
+    # 数据保留策略（retention.py）：归档旧对话、汇总旧情绪记录，然后分批删除原始行
+    RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "false").lower() == "true"
+    RETENTION_CONVERSATION_DAYS = int(os.getenv("RETENTION_CONVERSATION_DAYS", "180"))
+    RETENTION_EMOTION_TREND_DAYS = int(os.getenv("RETENTION_EMOTION_TREND_DAYS", "30"))
+    RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "./archive")
+    RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+    RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+    RETENTION_VACUUM_FREE_RATIO = float(os.getenv("RETENTION_VACUUM_FREE_RATIO", "0.2"))  # 空闲页占比超过该值时VACUUM
+    
+    # 情绪趋势分析（analytics.py）：已完成日期的每日计数缓存在 ANALYTICS_CACHE_DIR，只增量读取新的日期
+    ANALYTICS_CACHE_DIR = os.getenv("ANALYTICS_CACHE_DIR", "./analytics_cache")
+    ANALYTICS_ROLLING_DAYS = int(os.getenv("ANALYTICS_ROLLING_DAYS", "7"))
+    ANALYTICS_ALERT_DELTA = float(os.getenv("ANALYTICS_ALERT_DELTA", "0.15"))  # 负面情绪占比周环比上升超过该值时预警
+    ANALYTICS_ALERT_MIN_COUNT = int(os.getenv("ANALYTICS_ALERT_MIN_COUNT", "5"))  # 本周负面情绪记录少于该数时不预警
+    
+    # 延迟指标配置（各阶段计时，Prometheus格式输出）；/metrics 端点不做认证，需要时再开启
+    ENABLE_LATENCY_METRICS = os.getenv("ENABLE_LATENCY_METRICS", "false").lower() == "true"
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+    
+    # Web服务配置（多进程部署时由 serve.py 为每个工作进程分配端口）
+    APP_HOST = os.getenv("APP_HOST", "0.0.0.0")
+    APP_PORT = int(os.getenv("APP_PORT", "7860"))
+    APP_CONCURRENCY_LIMIT = int(os.getenv("APP_CONCURRENCY_LIMIT", "8"))  # 每个工作进程同时处理的请求数
+    
+    # HTTP/JSON 接口配置（api.py，与Web界面共用 APP_HOST 和 APP_CONCURRENCY_LIMIT）
+    API_PORT = int(os.getenv("API_PORT", "8000"))
+    API_KEEPALIVE_SECONDS = int(os.getenv("API_KEEPALIVE_SECONDS", "30"))  # 空闲连接保持时间
+    API_GZIP_MIN_SIZE = int(os.getenv("API_GZIP_MIN_SIZE", "500"))  # 响应超过该字节数时gzip压缩
+    API_MAX_MESSAGE_LENGTH = int(os.getenv("API_MAX_MESSAGE_LENGTH", "4000"))
+    
     @classmethod
     def validate(cls):
         """验证配置是否完整"""
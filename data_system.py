@@ -2,12 +2,16 @@
 数据收集和学习系统
 记录对话历史、分析用户反馈、实现持续学习
 """
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, JSON, Boolean
+from sqlalchemy import event, func, inspect, select, text, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from sqlalchemy.orm import scoped_session, sessionmaker
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import json
+import os
 from config import Config
 
 Base = declarative_base()
@@ -16,18 +20,36 @@ Base = declarative_base()
 class Conversation(Base):
     """对话记录表"""
     __tablename__ = 'conversations'
+    __table_args__ = (
+        # 按会话取历史（session_id 过滤 + timestamp 排序），同时覆盖单独按 session_id 的查询
+        Index('ix_conversations_session_timestamp', 'session_id', 'timestamp'),
+        # 高质量对话（feedback_score 范围过滤 + timestamp 排序）
+        Index('ix_conversations_feedback_timestamp', 'feedback_score', 'timestamp'),
+        # 日志增量导出（按 (updated_at, id) 键集分页）
+        Index('ix_conversations_updated_at_id', 'updated_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    session_id = Column(String(100), index=True)  # 会话ID
+    session_id = Column(String(100), ForeignKey('user_sessions.session_id'))  # 会话ID
     user_id = Column(String(100), index=True, nullable=True)  # 用户ID（可选）
     timestamp = Column(DateTime, default=datetime.now)
+    # 最后修改时间：写入后再补充反馈时更新，日志导出以它为增量水位
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     user_message = Column(Text)  # 用户消息
     ai_response = Column(Text)  # AI回复
     detected_emotions = Column(JSON)  # 检测到的情绪
     rag_docs_used = Column(JSON)  # 使用的RAG文档
     feedback_score = Column(Float, nullable=True)  # 用户反馈评分(1-5)
     feedback_text = Column(Text, nullable=True)  # 用户反馈文本
-    
+    # token用量与模型延迟
+    model = Column(String(50), nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    cached_tokens = Column(Integer, nullable=True)  # 命中提示词前缀缓存的token
+    rag_context_tokens = Column(Integer, nullable=True)  # 知识库参考内容占用的token（估算）
+    history_tokens = Column(Integer, nullable=True)  # 对话历史占用的token（估算）
+    llm_latency_ms = Column(Float, nullable=True)
+
 
 class UserSession(Base):
     """用户会话表"""
@@ -40,6 +62,11 @@ class UserSession(Base):
     last_active = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     message_count = Column(Integer, default=0)
     avg_feedback_score = Column(Float, nullable=True)
+    # token用量累计
+    total_prompt_tokens = Column(Integer, default=0)
+    total_completion_tokens = Column(Integer, default=0)
+    total_cached_tokens = Column(Integer, default=0)
+    total_llm_latency_ms = Column(Float, default=0.0)
 
 
 class EmotionTrend(Base):
@@ -48,70 +75,468 @@ class EmotionTrend(Base):
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     session_id = Column(String(100), index=True)
-    timestamp = Column(DateTime, default=datetime.now)
+    timestamp = Column(DateTime, default=datetime.now, index=True)  # 保留策略与情绪分析按时间范围读取
     emotion = Column(String(50))
     intensity = Column(String(20))  # 低/中/高
 
 
-class DataCollector:
+class EmotionTrendDaily(Base):
+    """情绪趋势日汇总表（旧的 emotion_trends 原始行汇总后删除）"""
+    __tablename__ = 'emotion_trend_daily'
+    __table_args__ = (UniqueConstraint('session_id', 'day', 'emotion'),)
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String(100), index=True)
+    day = Column(String(10), index=True)  # YYYY-MM-DD
+    emotion = Column(String(50))
+    count = Column(Integer, default=0)
+
+
+class SafetyCheck(Base):
+    """安全筛查记录表（仅记录被本地筛查命中的消息）"""
+    __tablename__ = 'safety_checks'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String(100), index=True)
+    conversation_id = Column(Integer, nullable=True)
+    timestamp = Column(DateTime, default=datetime.now)
+    method = Column(String(20))  # phrase / embedding
+    matched_phrases = Column(JSON)
+    similarity = Column(Float, nullable=True)
+    escalated = Column(Boolean, default=False)  # 是否调用了LLM安全检查
+    is_critical = Column(Boolean, nullable=True)  # LLM判定结果
+    reason = Column(Text, nullable=True)
+
+
+def create_db_engine(database_url: str = None):
+    """创建数据库引擎；SQLite 连接默认开启外键约束检查，文件数据库使用配置的日志模式"""
+    engine = create_engine(database_url or Config.DATABASE_URL)
+    if engine.dialect.name == "sqlite":
+        file_backed = engine.url.database not in (None, "", ":memory:")
+        
+        @event.listens_for(engine, "connect")
+        def _configure_sqlite(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            if file_backed and Config.SQLITE_JOURNAL_MODE:
+                cursor.execute(f"PRAGMA journal_mode={Config.SQLITE_JOURNAL_MODE}")
+            cursor.close()
+    return engine
+
+
+def create_readonly_engine(database_url: str = None):
+    """只读引擎，供导出、分析等离线任务读取线上数据库（不迁移、不修改日志模式）
+
+    SQLite 以 mode=ro 的 URI 打开，任何写入都会失败，文件不存在时报错而不是新建；
+    PostgreSQL 把会话设为只读事务（建议直接指向只读副本）
+    """
+    url = make_url(database_url or Config.DATABASE_URL)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            raise ValueError("只读模式需要文件数据库")
+        path = os.path.abspath(url.database)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"数据库文件不存在: {path}")
+        url = url.set(drivername="sqlite", database=f"file:{path}", query={"mode": "ro", "uri": "true"})
+        return create_engine(url)
+    
+    if url.drivername == "postgresql+asyncpg":
+        url = url.set(drivername="postgresql")
+    engine = create_engine(url)
+    if backend == "postgresql":
+        @event.listens_for(engine, "connect")
+        def _read_only(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+            cursor.close()
+    return engine
+
+
+def ensure_columns(conn):
+    """为已存在的表补齐模型中新增的列（create_all 不会修改已有表）"""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} " \
+                  f"{column.type.compile(dialect=conn.dialect)}"
+            # 累计类字段给出默认值，旧数据不会变成NULL
+            if column.default is not None and column.default.is_scalar:
+                ddl += f" DEFAULT {column.default.arg!r}"
+            conn.execute(text(ddl))
+
+
+# 异步驱动；postgresql:// 未指定驱动时同样使用异步实现（asyncpg）
+ASYNC_DRIVERS = {"postgresql+asyncpg", "sqlite+aiosqlite"}
+
+
+def create_data_collector(database_url: str = None):
+    """按数据库地址的 scheme 选择数据收集器实现
+    
+    postgresql / postgresql+asyncpg / sqlite+aiosqlite 使用异步实现（BlockingDataCollector），
+    其他（默认的 sqlite://）使用同步 DataCollector；两者接口相同
+    """
+    url = make_url(database_url or Config.DATABASE_URL)
+    if url.drivername in ASYNC_DRIVERS or url.drivername == "postgresql":
+        from async_data_system import BlockingDataCollector
+        return BlockingDataCollector(url.render_as_string(hide_password=False))
+    return DataCollector(database_url)
+
+
+class CollectorQueries:
+    """同步与异步数据收集器共用的语句构造与结果整理
+
+    两种实现遵循同一约定：
+    - create_session 对已存在的会话ID不报错，保持原会话不变并返回它
+    - record_conversation 遇到未知会话时以本轮为首条消息创建会话（不会因外键失败）
+    """
+    
+    @staticmethod
+    def conversation_values(session_id: str, user_message: str, ai_response: str,
+                            detected_emotions: List[str] = None, rag_docs: List[Dict] = None,
+                            usage: Dict = None) -> Dict:
+        usage = usage or {}
+        return {
+            "session_id": session_id,
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "detected_emotions": detected_emotions or [],
+            "rag_docs_used": rag_docs or [],
+            "model": usage.get("model"),
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "cached_tokens": usage.get("cached_tokens"),
+            "rag_context_tokens": usage.get("rag_context_tokens"),
+            "history_tokens": usage.get("history_tokens"),
+            "llm_latency_ms": usage.get("latency_ms")
+        }
+    
+    @staticmethod
+    def safety_check_values(session_id: str, screen_result: Dict,
+                            conversation_id: int = None) -> Dict:
+        return {
+            "session_id": session_id,
+            "conversation_id": conversation_id,
+            "method": screen_result.get("method"),
+            "matched_phrases": screen_result.get("matched_phrases") or [],
+            "similarity": screen_result.get("similarity"),
+            "escalated": screen_result.get("escalated", False),
+            "is_critical": screen_result.get("is_critical"),
+            "reason": screen_result.get("reason")
+        }
+    
+    @staticmethod
+    def conversation_query(conversation_id: int):
+        return select(
+            Conversation.id, Conversation.session_id, Conversation.user_message,
+            Conversation.ai_response, Conversation.feedback_score
+        ).where(Conversation.id == conversation_id)
+    
+    @staticmethod
+    def history_query(session_id: str, limit: int):
+        return select(
+            Conversation.user_message, Conversation.ai_response, Conversation.timestamp
+        ).where(
+            Conversation.session_id == session_id
+        ).order_by(Conversation.timestamp.desc()).limit(limit)
+    
+    @staticmethod
+    def history_from_rows(rows) -> List[Dict]:
+        """把按时间倒序的对话行整理为按时间正序的消息列表"""
+        history = []
+        for row in reversed(rows):
+            history.append({
+                "role": "user",
+                "content": row.user_message,
+                "timestamp": row.timestamp.isoformat()
+            })
+            history.append({
+                "role": "assistant",
+                "content": row.ai_response,
+                "timestamp": row.timestamp.isoformat()
+            })
+        return history
+    
+    @staticmethod
+    def message_count_query(session_id: str):
+        return select(UserSession.message_count).where(UserSession.session_id == session_id)
+    
+    @staticmethod
+    def user_session_query(session_id: str):
+        return select(UserSession.__table__).where(UserSession.session_id == session_id)
+    
+    @staticmethod
+    def emotion_count_queries(session_id: str):
+        """情绪分布：原始记录与已被保留策略汇总的历史记录"""
+        return (
+            select(EmotionTrend.emotion, func.count(EmotionTrend.id)).where(
+                EmotionTrend.session_id == session_id
+            ).group_by(EmotionTrend.emotion),
+            select(EmotionTrendDaily.emotion, func.sum(EmotionTrendDaily.count)).where(
+                EmotionTrendDaily.session_id == session_id
+            ).group_by(EmotionTrendDaily.emotion)
+        )
+    
+    @staticmethod
+    def feedback_count_query(session_id: str):
+        return select(func.count(Conversation.feedback_score)).where(
+            Conversation.session_id == session_id
+        )
+    
+    def session_statistics(self, user_session, emotion_rows, feedback_count: int = 0) -> Dict:
+        emotion_counts = {}
+        for emotion, count in emotion_rows:
+            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + int(count)
+        
+        return {
+            "session_id": user_session.session_id,
+            "message_count": user_session.message_count,
+            "avg_feedback_score": user_session.avg_feedback_score,
+            "feedback_count": int(feedback_count or 0),
+            "start_time": user_session.start_time.isoformat(),
+            "last_active": user_session.last_active.isoformat(),
+            "emotion_distribution": emotion_counts,
+            "total_prompt_tokens": user_session.total_prompt_tokens or 0,
+            "total_completion_tokens": user_session.total_completion_tokens or 0,
+            "total_cached_tokens": user_session.total_cached_tokens or 0,
+            "estimated_cost_usd": self.estimate_cost(
+                user_session.total_prompt_tokens or 0,
+                user_session.total_completion_tokens or 0,
+                user_session.total_cached_tokens or 0
+            )
+        }
+    
+    @staticmethod
+    def high_quality_query(min_score: float, limit: int):
+        return select(
+            Conversation.user_message, Conversation.ai_response,
+            Conversation.feedback_score, Conversation.detected_emotions
+        ).where(
+            Conversation.feedback_score >= min_score
+        ).order_by(Conversation.timestamp.desc()).limit(limit)
+    
+    @staticmethod
+    def high_quality_from_rows(rows) -> List[Dict]:
+        return [{
+            "user_message": row.user_message,
+            "ai_response": row.ai_response,
+            "feedback_score": row.feedback_score,
+            "emotions": row.detected_emotions
+        } for row in rows]
+    
+    def estimate_cost(self, prompt_tokens: int, completion_tokens: int,
+                      cached_tokens: int = 0) -> float:
+        """按配置的单价估算费用（美元）"""
+        uncached = max(0, prompt_tokens - cached_tokens)
+        return (
+            uncached * self.config.LLM_PRICE_INPUT_PER_1M
+            + cached_tokens * self.config.LLM_PRICE_CACHED_INPUT_PER_1M
+            + completion_tokens * self.config.LLM_PRICE_OUTPUT_PER_1M
+        ) / 1_000_000
+    
+    def cost_report_queries(self, days: int, top_n: int):
+        """成本报表用到的聚合查询，返回 (起始时间, {名称: 语句})"""
+        since = datetime.now() - timedelta(days=days)
+        cached = func.coalesce(Conversation.cached_tokens, 0)
+        completion = func.coalesce(Conversation.completion_tokens, 0)
+        cost = func.sum(
+            (Conversation.prompt_tokens - cached) * self.config.LLM_PRICE_INPUT_PER_1M
+            + cached * self.config.LLM_PRICE_CACHED_INPUT_PER_1M
+            + completion * self.config.LLM_PRICE_OUTPUT_PER_1M
+        ) / 1_000_000
+        aggregates = (
+            func.count(Conversation.id),
+            func.sum(Conversation.prompt_tokens),
+            func.sum(completion),
+            func.sum(cached),
+            cost
+        )
+        filters = (
+            Conversation.timestamp >= since,
+            Conversation.prompt_tokens.isnot(None)
+        )
+        day = func.date(Conversation.timestamp)
+        
+        return since, {
+            # 每日汇总
+            "daily": select(
+                day, *aggregates, func.avg(Conversation.llm_latency_ms)
+            ).where(*filters).group_by(day).order_by(day),
+            # 费用最高的会话
+            "top_sessions": select(
+                Conversation.session_id, *aggregates
+            ).where(*filters).group_by(Conversation.session_id).order_by(
+                cost.desc()
+            ).limit(top_n),
+            "totals": select(*aggregates).where(*filters),
+            # 提示词构成
+            "composition": select(
+                func.sum(Conversation.rag_context_tokens),
+                func.sum(Conversation.history_tokens)
+            ).where(*filters)
+        }
+    
+    @staticmethod
+    def build_cost_report(since: datetime, rows: Dict) -> Dict:
+        """rows: 与 cost_report_queries 同名的查询结果行列表"""
+        def as_row(values) -> Dict:
+            count, prompt_sum, completion_sum, cached_sum, cost_sum = values
+            return {
+                "conversations": count,
+                "prompt_tokens": int(prompt_sum or 0),
+                "completion_tokens": int(completion_sum or 0),
+                "cached_tokens": int(cached_sum or 0),
+                "cost_usd": float(cost_sum or 0.0)
+            }
+        
+        daily = []
+        for row in rows["daily"]:
+            entry = {"date": str(row[0])}
+            entry.update(as_row(row[1:6]))
+            entry["avg_llm_latency_ms"] = float(row[6]) if row[6] is not None else None
+            daily.append(entry)
+        
+        top_sessions = []
+        for row in rows["top_sessions"]:
+            entry = {"session_id": row[0]}
+            entry.update(as_row(row[1:]))
+            top_sessions.append(entry)
+        
+        totals = as_row(rows["totals"][0])
+        rag_sum, history_sum = rows["composition"][0]
+        prompt_total = totals["prompt_tokens"]
+        rag_sum, history_sum = int(rag_sum or 0), int(history_sum or 0)
+        
+        return {
+            "since": since.isoformat(timespec="seconds"),
+            "totals": totals,
+            "daily": daily,
+            "top_sessions": top_sessions,
+            "prompt_composition": {
+                "rag_context_tokens": rag_sum,
+                "history_tokens": history_sum,
+                "other_tokens": max(0, prompt_total - rag_sum - history_sum),
+                "rag_context_share": rag_sum / prompt_total if prompt_total else 0.0,
+                "history_share": history_sum / prompt_total if prompt_total else 0.0
+            }
+        }
+
+
+class DataCollector(CollectorQueries):
     """数据收集器"""
     
-    def __init__(self):
+    def __init__(self, database_url: str = None):
+        from migrations import migrate
         self.config = Config()
         
-        # 创建数据库引擎
-        self.engine = create_engine(self.config.DATABASE_URL)
-        Base.metadata.create_all(self.engine)
+        # 创建数据库引擎，并把表结构迁移到最新版本
+        self.engine = create_db_engine(database_url or self.config.DATABASE_URL)
+        migrate(self.engine)
         
-        # 创建会话
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        # 创建会话（每个线程一个ORM会话，可在多线程间共用同一个数据收集器）
+        self.session = scoped_session(sessionmaker(bind=self.engine))
     
     def create_session(self, session_id: str, user_id: str = None) -> UserSession:
-        """创建新会话"""
+        """创建新会话（已存在时保持不变，返回已有会话）"""
+        existing = self.session.query(UserSession).filter_by(session_id=session_id).first()
+        if existing is not None:
+            return existing
+        
         user_session = UserSession(
             session_id=session_id,
             user_id=user_id
         )
         self.session.add(user_session)
-        self.session.commit()
+        try:
+            self.session.commit()
+        except IntegrityError:
+            # 其他线程或进程同时创建了同一会话
+            self.session.rollback()
+            return self.session.query(UserSession).filter_by(session_id=session_id).one()
         return user_session
     
     def record_conversation(self, session_id: str, user_message: str, 
                           ai_response: str, detected_emotions: List[str] = None,
-                          rag_docs: List[Dict] = None) -> Conversation:
-        """记录对话"""
-        conversation = Conversation(
-            session_id=session_id,
-            user_message=user_message,
-            ai_response=ai_response,
-            detected_emotions=detected_emotions or [],
-            rag_docs_used=rag_docs or []
-        )
-        self.session.add(conversation)
+                          rag_docs: List[Dict] = None,
+                          usage: Dict = None) -> Conversation:
+        """记录对话
         
-        # 更新会话信息
-        user_session = self.session.query(UserSession).filter_by(
-            session_id=session_id
-        ).first()
+        usage: token用量与模型延迟（prompt_tokens、completion_tokens、cached_tokens、
+               rag_context_tokens、history_tokens、latency_ms、model）
+        """
+        usage = usage or {}
         
-        if user_session:
-            user_session.message_count += 1
-            user_session.last_active = datetime.now()
+        # 先更新会话信息（外键）：在SQL中累加，多个进程同时写入同一会话时不会丢失计数
+        if not self._count_turn(session_id, usage):
+            # 未知会话：以本轮为首条消息创建；并发创建时改为累加
+            now = datetime.now()
+            try:
+                with self.session.begin_nested():
+                    self.session.add(UserSession(
+                        session_id=session_id,
+                        start_time=now,
+                        last_active=now,
+                        message_count=1,
+                        total_prompt_tokens=usage.get("prompt_tokens") or 0,
+                        total_completion_tokens=usage.get("completion_tokens") or 0,
+                        total_cached_tokens=usage.get("cached_tokens") or 0,
+                        total_llm_latency_ms=usage.get("latency_ms") or 0.0
+                    ))
+            except IntegrityError:
+                self._count_turn(session_id, usage)
         
+        conversation = Conversation(**self.conversation_values(
+            session_id, user_message, ai_response, detected_emotions, rag_docs, usage
+        ))
+        self.session.add(conversation)
         self.session.commit()
         return conversation
     
+    def _count_turn(self, session_id: str, usage: Dict) -> int:
+        """把一轮对话累加到会话统计，返回更新的行数（0 表示会话不存在）"""
+        return self.session.query(UserSession).filter_by(session_id=session_id).update({
+            UserSession.message_count: func.coalesce(UserSession.message_count, 0) + 1,
+            UserSession.last_active: datetime.now(),
+            UserSession.total_prompt_tokens:
+                func.coalesce(UserSession.total_prompt_tokens, 0) + (usage.get("prompt_tokens") or 0),
+            UserSession.total_completion_tokens:
+                func.coalesce(UserSession.total_completion_tokens, 0) + (usage.get("completion_tokens") or 0),
+            UserSession.total_cached_tokens:
+                func.coalesce(UserSession.total_cached_tokens, 0) + (usage.get("cached_tokens") or 0),
+            UserSession.total_llm_latency_ms:
+                func.coalesce(UserSession.total_llm_latency_ms, 0.0) + (usage.get("latency_ms") or 0.0)
+        }, synchronize_session=False)
+    
     def record_emotion_trend(self, session_id: str, emotion: str, 
                             intensity: str = "中"):
         """记录情绪趋势"""
-        trend = EmotionTrend(
-            session_id=session_id,
-            emotion=emotion,
-            intensity=intensity
-        )
-        self.session.add(trend)
+        self.record_emotion_trends(session_id, [emotion], intensity)
+    
+    def record_emotion_trends(self, session_id: str, emotions: List[str],
+                              intensity: str = "中"):
+        """批量记录一条消息中检测到的多个情绪（一次提交）"""
+        if not emotions:
+            return
+        self.session.add_all([
+            EmotionTrend(session_id=session_id, emotion=emotion, intensity=intensity)
+            for emotion in emotions
+        ])
+        self.session.commit()
+    
+    def record_safety_check(self, session_id: str, screen_result: Dict,
+                            conversation_id: int = None) -> SafetyCheck:
+        """记录安全筛查决策"""
+        check = SafetyCheck(**self.safety_check_values(session_id, screen_result, conversation_id))
+        self.session.add(check)
         self.session.commit()
+        return check
     
     def add_feedback(self, conversation_id: int, score: float, 
                     feedback_text: str = None):
@@ -143,77 +568,51 @@ class DataCollector:
             return True
         return False
     
+    def get_conversation(self, conversation_id: int) -> Optional[Dict]:
+        """按ID获取单条对话"""
+        row = self.session.execute(self.conversation_query(conversation_id)).first()
+        return dict(row._mapping) if row else None
+    
     def get_conversation_history(self, session_id: str, 
                                 limit: int = 10) -> List[Dict]:
         """获取对话历史"""
-        conversations = self.session.query(Conversation).filter_by(
-            session_id=session_id
-        ).order_by(Conversation.timestamp.desc()).limit(limit).all()
-        
-        history = []
-        for conv in reversed(conversations):
-            history.append({
-                "role": "user",
-                "content": conv.user_message,
-                "timestamp": conv.timestamp.isoformat()
-            })
-            history.append({
-                "role": "assistant",
-                "content": conv.ai_response,
-                "timestamp": conv.timestamp.isoformat()
-            })
-        
-        return history
+        rows = self.session.execute(self.history_query(session_id, limit)).all()
+        return self.history_from_rows(rows)
+    
+    def get_message_count(self, session_id: str) -> Optional[int]:
+        """会话已记录的对话轮数；会话不存在时返回 None"""
+        row = self.session.execute(self.message_count_query(session_id)).first()
+        return None if row is None else (row[0] or 0)
     
     def get_session_statistics(self, session_id: str) -> Dict:
         """获取会话统计信息"""
-        user_session = self.session.query(UserSession).filter_by(
-            session_id=session_id
-        ).first()
+        user_session = self.session.execute(self.user_session_query(session_id)).first()
         
         if not user_session:
             return {}
         
-        # 获取情绪分布
-        emotions = self.session.query(EmotionTrend).filter_by(
-            session_id=session_id
-        ).all()
-        
-        emotion_counts = {}
-        for emotion_record in emotions:
-            emotion = emotion_record.emotion
-            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + 1
-        
-        return {
-            "session_id": session_id,
-            "message_count": user_session.message_count,
-            "avg_feedback_score": user_session.avg_feedback_score,
-            "start_time": user_session.start_time.isoformat(),
-            "last_active": user_session.last_active.isoformat(),
-            "emotion_distribution": emotion_counts
-        }
+        emotion_rows = []
+        for query in self.emotion_count_queries(session_id):
+            emotion_rows.extend(self.session.execute(query).all())
+        feedback_count = self.session.execute(self.feedback_count_query(session_id)).scalar()
+        return self.session_statistics(user_session, emotion_rows, feedback_count)
     
     def get_high_quality_conversations(self, min_score: float = 4.0, 
                                       limit: int = 50) -> List[Dict]:
         """获取高质量对话（用于学习）"""
-        conversations = self.session.query(Conversation).filter(
-            Conversation.feedback_score >= min_score
-        ).order_by(Conversation.timestamp.desc()).limit(limit).all()
-        
-        results = []
-        for conv in conversations:
-            results.append({
-                "user_message": conv.user_message,
-                "ai_response": conv.ai_response,
-                "feedback_score": conv.feedback_score,
-                "emotions": conv.detected_emotions
-            })
-        
-        return results
+        rows = self.session.execute(self.high_quality_query(min_score, limit)).all()
+        return self.high_quality_from_rows(rows)
+    
+    def get_cost_report(self, days: int = 7, top_n: int = 10) -> Dict:
+        """成本报表：每日汇总、费用最高的会话、提示词中知识库参考与历史的token占比"""
+        since, queries = self.cost_report_queries(days, top_n)
+        rows = {name: self.session.execute(query).all() for name, query in queries.items()}
+        return self.build_cost_report(since, rows)
     
     def close(self):
         """关闭数据库连接"""
-        self.session.close()
+        self.session.remove()
+        self.engine.dispose()
 
 
 class LearningSystem:
@@ -0,0 +1,190 @@
+"""
+嵌入模型后端
+提供 PyTorch（sentence-transformers）与 ONNX Runtime 两种编码实现
+"""
+from typing import Dict, List, Union
+from urllib.parse import urlparse
+import base64
+import http.client
+import json
+import os
+import threading
+import numpy as np
+from config import Config
+
+
+def encode_array(array: np.ndarray) -> Dict:
+    """把 float32 矩阵编码为可JSON传输的字典"""
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {
+        "dtype": "float32",
+        "shape": list(array.shape),
+        "data": base64.b64encode(array.tobytes()).decode("ascii")
+    }
+
+
+def decode_array(payload: Dict) -> np.ndarray:
+    """还原 encode_array 编码的矩阵"""
+    data = base64.b64decode(payload["data"])
+    return np.frombuffer(data, dtype=payload["dtype"]).reshape(payload["shape"])
+
+
+class OnnxEncoder:
+    """ONNX Runtime 编码器 - 无需加载 torch，接口与 SentenceTransformer.encode 一致"""
+    
+    def __init__(self, model_dir: str, model_file: str = "model.onnx",
+                 max_length: int = 256, normalize: bool = True,
+                 num_threads: int = 0):
+        # 延迟导入，未使用ONNX后端时不要求安装 onnxruntime
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"未找到ONNX模型: {model_path}，请先运行 export_onnx.py 导出"
+            )
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {inp.name for inp in self.session.get_inputs()}
+        
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.normalize = normalize
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.session.get_outputs()[0].shape[-1]
+    
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array(
+                [e.type_ids for e in encodings], dtype=np.int64
+            )
+        token_embeddings = self.session.run(None, feeds)[0]
+        
+        # 平均池化（忽略padding位置），与 sentence-transformers 的 Pooling 层一致
+        mask = attention_mask[:, :, None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        
+        if self.normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings.astype(np.float32)
+    
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               **kwargs) -> np.ndarray:
+        """编码文本；传入字符串返回一维向量，传入列表返回矩阵"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        
+        # 按长度排序后分批，减少padding开销
+        order = np.argsort([len(t) for t in texts])
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            batch_idx = order[start:start + batch_size]
+            batches.append((batch_idx, self._encode_batch([texts[i] for i in batch_idx])))
+        
+        embeddings = np.empty((len(texts), batches[0][1].shape[1]), dtype=np.float32)
+        for batch_idx, batch_embeddings in batches:
+            embeddings[batch_idx] = batch_embeddings
+        
+        return embeddings[0] if single else embeddings
+
+
+class RemoteEncoder:
+    """远程编码器 - 调用共享嵌入服务（embedding_server.py），本进程不加载模型"""
+    
+    def __init__(self, url: str, timeout: float = 30.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        # 每个线程复用一条keep-alive连接
+        self._local = threading.local()
+        self._dimension = None
+    
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+    
+    def _request(self, method: str, path: str, body: Dict = None) -> Dict:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data else {}
+        
+        # 连接可能已被服务端关闭，失败时重连重试一次
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                response = conn.getresponse()
+                payload = json.loads(response.read())
+                break
+            except (http.client.HTTPException, ConnectionError, OSError):
+                conn.close()
+                self._local.conn = None
+                if attempt == 1:
+                    raise
+        
+        if response.status != 200:
+            raise RuntimeError(f"嵌入服务错误 ({response.status}): {payload.get('error')}")
+        return payload
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self._request("GET", "/health")["dimension"]
+        return self._dimension
+    
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               **kwargs) -> np.ndarray:
+        """编码文本；传入字符串返回一维向量，传入列表返回矩阵"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        payload = self._request("POST", "/encode", {"texts": texts})
+        embeddings = decode_array(payload["embeddings"])
+        return embeddings[0] if single else embeddings
+
+
+def create_encoder(config: Config = None, backend: str = None, model: str = None):
+    """按配置创建嵌入编码器
+
+    model: 嵌入模型（默认 EMBEDDING_MODEL）；ONNX 与远程后端只能使用导出或服务端加载的配置模型
+    """
+    config = config or Config()
+    backend = backend or config.EMBEDDING_BACKEND
+    model = model or config.EMBEDDING_MODEL
+    if backend in ("remote", "onnx") and model != config.EMBEDDING_MODEL:
+        raise ValueError(f"{backend} 后端只能使用配置的嵌入模型 {config.EMBEDDING_MODEL}，不能加载 {model}")
+    
+    if backend == "remote":
+        return RemoteEncoder(config.EMBEDDING_SERVER_URL)
+    
+    if backend == "onnx":
+        return OnnxEncoder(
+            config.EMBEDDING_ONNX_PATH,
+            model_file=config.EMBEDDING_ONNX_FILE
+        )
+    
+    if backend == "sentence-transformers":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model)
+    
+    raise ValueError(f"未知的嵌入后端: {backend}")
@@ -0,0 +1,169 @@
+"""
+文档嵌入持久化缓存
+以 (模型, 文本SHA-256) 为键把文档向量存入本地 SQLite 文件。更换 Chroma 目录、清空后重建、
+重复运行 init_knowledge.py 时，已编码过的文本直接取回向量，只有新文本才经过模型：
+- 模型键区分后端与模型（不同模型的向量不会混用）
+- 只缓存知识库文档；用户查询不落盘（查询使用 RAGSystem 的内存LRU缓存）
+
+用法：
+    python embedding_cache.py status    # 各模型的缓存条数和文件大小
+    python embedding_cache.py clear --model sentence-transformers:all-MiniLM-L6-v2
+"""
+from typing import Dict, List, Optional
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import numpy as np
+from config import Config
+
+
+def model_key(config: Config = None, backend: str = None, model: str = None) -> str:
+    """缓存中的模型标识：后端 + 模型（远程后端按嵌入服务使用的后端计）"""
+    config = config or Config()
+    backend = backend or config.EMBEDDING_BACKEND
+    model = model or config.EMBEDDING_MODEL
+    if backend == "remote":
+        return model_key(config, config.EMBEDDING_SERVER_BACKEND, model)
+    if backend == "onnx":
+        return f"onnx:{model}:{config.EMBEDDING_ONNX_FILE}"
+    return f"{backend}:{model}"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite 向量缓存（线程安全）"""
+    
+    # SQLite 单条语句的参数个数上限为 999
+    LOOKUP_CHUNK = 500
+    
+    def __init__(self, path: str = None, model: str = None):
+        self.path = path or Config.EMBEDDING_CACHE_PATH
+        self.model = model or model_key()  # 模型键（见 model_key）
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, content_hash TEXT NOT NULL, dimension INTEGER NOT NULL,"
+            " vector BLOB NOT NULL, PRIMARY KEY (model, content_hash))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get_many(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        """取回已缓存的向量：{文本: 向量}"""
+        hashes = {content_hash(text): text for text in texts}
+        found = {}
+        keys = list(hashes)
+        with self._lock:
+            for start in range(0, len(keys), self.LOOKUP_CHUNK):
+                chunk = keys[start:start + self.LOOKUP_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND content_hash IN ({', '.join('?' * len(chunk))})",
+                    [self.model, *chunk]
+                ).fetchall()
+                for digest, blob in rows:
+                    found[hashes[digest]] = np.frombuffer(blob, dtype=np.float32)
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+    
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = [
+            (self.model, content_hash(text), int(vector.shape[0]), vector.tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, content_hash, dimension, vector) "
+                "VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+    
+    def count(self, model: Optional[str] = None) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (model or self.model,)
+            ).fetchone()[0]
+    
+    def models(self) -> Dict[str, int]:
+        """缓存中每个模型的条数"""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT model, COUNT(*) FROM embeddings GROUP BY model ORDER BY model"
+            ).fetchall())
+    
+    def clear(self, model: Optional[str] = None) -> int:
+        """删除某个模型（默认当前模型）的全部缓存，返回删除条数"""
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM embeddings WHERE model = ?", (model or self.model,)
+            ).rowcount
+            self._conn.commit()
+        return deleted
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEncoder:
+    """带持久化缓存的编码器包装，接口与 SentenceTransformer.encode 一致（输入为文本列表）"""
+    
+    def __init__(self, encoder, cache: EmbeddingCache):
+        self.encoder = encoder
+        self.cache = cache
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.encoder.get_sentence_embedding_dimension()
+    
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        found = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in found))
+        if missing:
+            vectors = np.asarray(self.encoder.encode(missing, batch_size=batch_size, **kwargs),
+                                 dtype=np.float32)
+            self.cache.put_many(missing, vectors)
+            found.update(zip(missing, vectors))
+        return np.stack([found[text] for text in texts])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看或清理文档嵌入缓存")
+    parser.add_argument("command", choices=["status", "clear"])
+    parser.add_argument("--path", default=Config.EMBEDDING_CACHE_PATH, help="缓存文件")
+    parser.add_argument("--model", default=None, help="模型键（默认当前配置的模型）")
+    args = parser.parse_args()
+    
+    if not os.path.exists(args.path):
+        print(f"{args.path} 不存在")
+        return
+    cache = EmbeddingCache(args.path, args.model)
+    try:
+        if args.command == "clear":
+            print(f"✓ 已删除 {cache.clear()} 条 {cache.model} 的缓存")
+            return
+        size_mb = os.path.getsize(args.path) / 1024 / 1024
+        print(f"{args.path}（{size_mb:.1f} MB）")
+        for model, count in cache.models().items():
+            flag = "*" if model == cache.model else " "
+            print(f"{flag} {model}: {count} 条")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+嵌入模型注册表与在线重建索引
+每个嵌入模型对应 Chroma 中一个独立的集合，注册表（CHROMA_PERSIST_DIRECTORY/embedding_registry.json）
+记录各集合使用的模型、向量存储方式（quantization）、构建状态，以及当前服务的集合（active）和上一个集合（previous）：
+- 重建：旧集合继续服务，后台用新模型分批编码全部文档写入新集合
+- 切换：先把构建期间的写入同步到新集合，再原子替换注册表；各进程检测到后加载新模型并切换
+- 回滚：切回上一个集合（同样先同步切换后的写入）
+
+没有注册表的旧部署视为只有一个集合 emotional_support_kb，使用 EMBEDDING_MODEL。
+
+quantization 为 none 的集合把 float32 向量保存在 Chroma 中；int8 / float16 的集合把向量保存在
+量化存储（vector_store.py）中，Chroma 只保存文档和元数据。新集合按 EMBEDDING_QUANTIZATION 创建，
+已有集合改用量化存储：python embedding_registry.py reindex --model <当前模型> --activate
+
+同一目录只能有一个进程写入：writer 进程持有目录下 writer.lock 的共享锁。命令行工具先尝试
+排他锁，服务未运行时直接执行；服务运行时把命令写入 embedding_command.json，由 writer
+在下一次检索或写入时执行（最多每 CHROMA_REFRESH_SECONDS 秒检查一次），重建在 writer 的后台线程进行。
+kb_maintenance.py dedup 和 kb_snapshot.py export 同样通过命令文件交给运行中的 writer 执行。
+
+用法：
+    python embedding_registry.py status
+    python embedding_registry.py reindex --model paraphrase-multilingual-MiniLM-L12-v2 --activate
+    python embedding_registry.py activate --model paraphrase-multilingual-MiniLM-L12-v2
+    python embedding_registry.py rollback
+"""
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows：不加进程间锁
+    fcntl = None
+from config import Config
+
+
+LEGACY_COLLECTION = "emotional_support_kb"
+REGISTRY_FILE = "embedding_registry.json"
+COMMAND_FILE = "embedding_command.json"
+WRITER_LOCK_FILE = "writer.lock"
+STATUSES = ("building", "ready", "failed")
+COMMANDS = ("reindex", "activate", "rollback", "dedup", "export_snapshot")
+
+# 目录 -> [锁文件, 本进程持有数]；同一进程内的多个实例共用一把锁
+_writer_locks = {}
+_writer_locks_lock = threading.Lock()
+
+
+def collection_name_for(model: str, quantization: str = "none") -> str:
+    """新模型的集合名（Chroma 集合名限 3~63 个字母数字、下划线或连字符）
+    
+    量化存储的集合名带 __int8 / __float16 后缀，与同一模型的 float32 集合区分
+    """
+    suffix = "" if quantization == "none" else f"__{quantization}"
+    slug = re.sub(r"[^a-z0-9]+", "-", model.lower()).strip("-")[:40 - len(suffix)].strip("-")
+    return f"{LEGACY_COLLECTION}__{slug or 'model'}{suffix}"
+
+
+def acquire_writer_lock(directory: str, exclusive: bool = False) -> bool:
+    """获取目录的 writer 锁，被其他进程占用时返回 False
+    
+    writer 进程持共享锁，命令行工具直接修改集合时持排他锁，两者互斥
+    """
+    key = os.path.abspath(directory)
+    with _writer_locks_lock:
+        held = _writer_locks.get(key)
+        if held is not None:
+            held[1] += 1
+            return True
+        lock_file = None
+        if fcntl is not None:
+            os.makedirs(key, exist_ok=True)
+            lock_file = open(os.path.join(key, WRITER_LOCK_FILE), "a")
+            try:
+                fcntl.flock(lock_file, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return False
+        _writer_locks[key] = [lock_file, 1]
+        return True
+
+
+def release_writer_lock(directory: str):
+    key = os.path.abspath(directory)
+    with _writer_locks_lock:
+        held = _writer_locks.get(key)
+        if held is None:
+            return
+        held[1] -= 1
+        if held[1] == 0:
+            del _writer_locks[key]
+            if held[0] is not None:
+                held[0].close()
+
+
+class EmbeddingRegistry:
+    """集合注册表（JSON 文件，先写临时文件再替换，读者不会读到半个文件）"""
+    
+    def __init__(self, directory: str = None):
+        self.directory = directory or Config.CHROMA_PERSIST_DIRECTORY
+        self.path = os.path.join(self.directory, REGISTRY_FILE)
+        self.command_path = os.path.join(self.directory, COMMAND_FILE)
+        self._lock = threading.Lock()
+    
+    def load(self) -> Dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {
+                "active": LEGACY_COLLECTION,
+                "previous": None,
+                "collections": {
+                    LEGACY_COLLECTION: {"model": Config.EMBEDDING_MODEL, "status": "ready"}
+                }
+            }
+    
+    def ensure(self, quantization: str = "none"):
+        """注册表不存在时按当前配置写入（之后修改 EMBEDDING_MODEL 不会改变已有集合登记的模型）
+        
+        quantization: 原有集合的向量存储方式（已有 float32 向量的旧部署为 none）
+        """
+        with self._lock:
+            if not os.path.exists(self.path):
+                state = self.load()
+                state["collections"][LEGACY_COLLECTION]["quantization"] = quantization
+                self._save(state)
+    
+    def _save(self, state: Dict):
+        self._write_json(self.path, state)
+    
+    def _write_json(self, path: str, data: Dict):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+    
+    def active(self) -> Tuple[str, str]:
+        """当前服务的 (集合名, 模型)"""
+        state = self.load()
+        return state["active"], state["collections"][state["active"]]["model"]
+    
+    def entry(self, name: str) -> Optional[Dict]:
+        return self.load()["collections"].get(name)
+    
+    def quantization(self, name: str) -> str:
+        """集合的向量存储方式（未登记的旧集合为 none）"""
+        return (self.entry(name) or {}).get("quantization", "none")
+    
+    def collection_for(self, model: str, quantization: str = None) -> str:
+        """模型和存储方式对应的集合名（已登记的沿用原名），quantization 默认取 EMBEDDING_QUANTIZATION"""
+        quantization = quantization or Config.EMBEDDING_QUANTIZATION
+        for name, entry in self.load()["collections"].items():
+            if entry["model"] == model and entry.get("quantization", "none") == quantization:
+                return name
+        return collection_name_for(model, quantization)
+    
+    def update(self, name: str, **fields) -> Dict:
+        """登记或更新集合的模型、状态、文档数等"""
+        with self._lock:
+            state = self.load()
+            entry = state["collections"].setdefault(name, {})
+            entry.update(fields, updated_at=datetime.now().isoformat())
+            self._save(state)
+            return entry
+    
+    def activate(self, name: str) -> str:
+        """把 name 设为当前集合，返回之前的集合名"""
+        with self._lock:
+            state = self.load()
+            entry = state["collections"].get(name)
+            if entry is None or entry.get("status") != "ready":
+                raise ValueError(f"集合 {name} 未构建完成，不能切换")
+            previous = state["active"]
+            if previous != name:
+                state["previous"] = previous
+                state["active"] = name
+                self._save(state)
+            return previous
+    
+    def pending_command(self) -> Optional[Dict]:
+        try:
+            with open(self.command_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def submit_command(self, command: str, **args) -> Dict:
+        """提交命令给运行中的 writer 执行；已有未执行的命令时拒绝"""
+        if command not in COMMANDS:
+            raise ValueError(f"未知命令: {command}")
+        with self._lock:
+            pending = self.pending_command()
+            if pending is not None:
+                raise RuntimeError(f"已有未执行的命令 {pending['command']}（{pending['submitted_at']}）")
+            request = dict(args, command=command, submitted_at=datetime.now().isoformat())
+            self._write_json(self.command_path, request)
+            return request
+    
+    def take_command(self) -> Optional[Dict]:
+        """writer 取走待执行的命令（先改名认领，多个 writer 实例只有一个取到）"""
+        claimed = f"{self.command_path}.{os.getpid()}-{threading.get_ident()}"
+        try:
+            os.replace(self.command_path, claimed)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(claimed, encoding="utf-8") as f:
+                return json.load(f)
+        finally:
+            os.remove(claimed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="管理嵌入模型集合：重建索引、切换和回滚")
+    parser.add_argument("command", choices=["status", "reindex", "activate", "rollback"])
+    parser.add_argument("--model", help="嵌入模型（sentence-transformers 模型名或路径）")
+    parser.add_argument("--batch-size", type=int, default=Config.EMBEDDING_REINDEX_BATCH_SIZE,
+                        help="每批编码的文档数")
+    parser.add_argument("--activate", action="store_true", help="reindex 完成后立即切换")
+    args = parser.parse_args()
+    
+    if args.command == "status":
+        state = EmbeddingRegistry().load()
+        for name, entry in state["collections"].items():
+            flag = "*" if name == state["active"] else ("<" if name == state.get("previous") else " ")
+            print(f"{flag} {name}  {entry['model']}  {entry.get('quantization', 'none')}  {entry.get('status', '-')}  "
+                  f"{entry.get('count', '-')} 条文档  {entry.get('updated_at', '')}")
+        pending = EmbeddingRegistry().pending_command()
+        if pending:
+            print(f"待 writer 执行: {pending['command']} {pending.get('model') or ''}（{pending['submitted_at']}）")
+        return
+    if args.command in ("reindex", "activate") and not args.model:
+        parser.error(f"{args.command} 需要 --model")
+    
+    # 服务的 writer 正在运行：不再打开第二个 writer，把命令交给它执行
+    directory = Config.CHROMA_PERSIST_DIRECTORY
+    if not acquire_writer_lock(directory, exclusive=True):
+        try:
+            EmbeddingRegistry(directory).submit_command(
+                args.command, model=args.model, batch_size=args.batch_size, activate=args.activate
+            )
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✓ writer 正在运行，已提交 {args.command}，writer 在下一次检索或写入时执行；用 status 查看进度")
+        return
+    
+    from rag_system import RAGSystem
+    try:
+        rag = RAGSystem()
+    except Exception:
+        release_writer_lock(directory)
+        raise
+    try:
+        if args.command == "reindex":
+            name = rag.reindex(args.model, batch_size=args.batch_size)
+            print(f"✓ 已用 {args.model} 重建集合 {name}（{rag.registry.entry(name)['count']} 条文档）")
+            if not args.activate:
+                return
+        if args.command == "rollback":
+            previous = rag.rollback()
+        else:
+            previous = rag.activate_collection(rag.registry.collection_for(args.model))
+        print(f"✓ 已切换到 {rag.collection_name}（{rag.embedding_model_name}），上一个集合：{previous}")
+        if rag.config.KB_SNAPSHOT_EXPORT:
+            print(f"📦 已导出知识库快照：{rag.export_snapshot()}")
+    finally:
+        rag.close()
+        release_writer_lock(directory)
+
+
+if __name__ == "__main__":
+    main()
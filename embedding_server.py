@@ -0,0 +1,146 @@
+"""
+共享嵌入服务
+单进程持有一份嵌入模型，通过本地HTTP为多个工作进程提供编码，并对并发请求做微批处理
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+import argparse
+import json
+import threading
+import numpy as np
+from config import Config
+from batching import MicroBatcher
+from embedding_backends import create_encoder, encode_array
+
+
+class EmbeddingServer:
+    """嵌入服务 - POST /encode 编码文本，GET /health 返回模型信息"""
+    
+    def __init__(self, encoder, host: str = "127.0.0.1", port: int = 8765,
+                 max_batch_size: int = 64, max_wait_ms: float = 5.0,
+                 model_name: str = None):
+        self.encoder = encoder
+        self.model_name = model_name or Config.EMBEDDING_MODEL
+        self.dimension = int(encoder.get_sentence_embedding_dimension())
+        # 每个HTTP请求作为一项提交，批处理时把多个请求的文本拼成一次前向计算
+        self.batcher = MicroBatcher(
+            self._encode_requests,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            name="embedding-batcher"
+        )
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def address(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def _encode_requests(self, requests: List[List[str]]) -> List[np.ndarray]:
+        texts = [text for request in requests for text in request]
+        embeddings = np.asarray(self.encoder.encode(texts, batch_size=64), dtype=np.float32)
+        
+        results = []
+        offset = 0
+        for request in requests:
+            results.append(embeddings[offset:offset + len(request)])
+            offset += len(request)
+        return results
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 支持keep-alive
+            
+            def _send_json(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def do_GET(self):
+                if self.path == "/health":
+                    self._send_json(200, {
+                        "status": "ok",
+                        "model": server.model_name,
+                        "dimension": server.dimension,
+                        "batches": server.batcher.batch_count,
+                        "avg_batch_size": server.batcher.avg_batch_size
+                    })
+                else:
+                    self._send_json(404, {"error": "not found"})
+            
+            def do_POST(self):
+                if self.path != "/encode":
+                    self._send_json(404, {"error": "not found"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    texts = json.loads(self.rfile.read(length))["texts"]
+                    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                        raise ValueError("texts 必须是字符串列表")
+                except Exception as e:
+                    self._send_json(400, {"error": str(e)})
+                    return
+                
+                try:
+                    embeddings = server.batcher.submit(texts) if texts else \
+                        np.zeros((0, server.dimension), dtype=np.float32)
+                except Exception as e:
+                    self._send_json(500, {"error": str(e)})
+                    return
+                self._send_json(200, {"embeddings": encode_array(embeddings)})
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name="embedding-server", daemon=True
+        )
+        self._thread.start()
+        return self
+    
+    def serve_forever(self):
+        self.httpd.serve_forever()
+    
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.batcher.close()
+
+
+if __name__ == "__main__":
+    config = Config()
+    parser = argparse.ArgumentParser(description="共享嵌入服务")
+    parser.add_argument("--host", default=config.EMBEDDING_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.EMBEDDING_SERVER_PORT)
+    parser.add_argument("--backend", default=config.EMBEDDING_SERVER_BACKEND,
+                        help="服务端使用的编码后端（sentence-transformers / onnx）")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=config.EMBEDDING_SERVER_BATCH_WAIT_MS)
+    args = parser.parse_args()
+    if args.backend == "remote":
+        parser.error("服务端不能使用 remote 后端")
+    
+    encoder = create_encoder(config, backend=args.backend)
+    server = EmbeddingServer(
+        encoder,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms
+    )
+    print(f"✅ 嵌入服务已启动: {server.address}（模型: {server.model_name}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
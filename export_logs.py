@@ -0,0 +1,330 @@
+"""
+对话日志导出
+按日期分区把 conversations / user_sessions / emotion_trends 流式导出为 JSONL 或 Parquet，
+供离线分析使用，避免分析查询直接读取线上数据库
+
+- 分块读取：按 (水位列, id) 键集分页，每块一个短事务，不长时间占用数据库读锁
+- 增量导出：每张表的水位记录在输出目录的 _watermark.json，下次只导出新增/更新的行
+  （对话和会话在写入后仍会更新，按修改时间导出，同一行可能出现在多次导出中，分析时按 id 取最新一条）
+- 原子落盘：先写 .tmp 文件，整张表导出完成后再重命名并推进水位
+- 只读：源数据库以只读方式打开，不做迁移；缺少的列不导出并在结果中报告，
+  缺少水位/分区列的表整张跳过（先在线上运行 python migrations.py）
+
+用法：
+    python export_logs.py --output exports --format parquet
+    python export_logs.py --output exports --tables conversations --full
+"""
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+import argparse
+import glob
+import json
+import os
+from sqlalchemy import inspect, select, and_, or_, Boolean, DateTime, Float, Integer, JSON
+from config import Config
+from data_system import Conversation, UserSession, EmotionTrend, create_readonly_engine
+
+
+# 表名 -> (模型, 水位列, 分区日期列)
+# conversations 写入后还会补充反馈（updated_at 随之更新），user_sessions 的行持续更新（last_active），
+# 两者按修改时间增量导出，同一行可能出现在多次导出中（仍写入原日期分区），
+# 分析时按 id / session_id 取最新一条即可
+EXPORT_TABLES = {
+    "conversations": (Conversation, "updated_at", "timestamp"),
+    "user_sessions": (UserSession, "last_active", "last_active"),
+    "emotion_trends": (EmotionTrend, "id", "timestamp"),
+}
+
+WATERMARK_FILE = "_watermark.json"
+
+
+def watermark_matches(watermark: Dict, model, watermark_column: str) -> bool:
+    """已保存的水位是否属于当前水位列（水位列变更后需要全量重新导出）"""
+    if "column" in watermark:
+        return watermark["column"] == watermark_column
+    # 早期的水位文件没有记录列名：按值的类型判断（id 为整数，时间列为ISO字符串）
+    is_datetime = isinstance(model.__table__.c[watermark_column].type, DateTime)
+    return isinstance(watermark.get("value"), str) == is_datetime
+
+
+def source_columns(engine, model) -> Optional[List[str]]:
+    """源数据库中该表实际存在的列名（表不存在时返回 None）"""
+    inspector = inspect(engine)
+    if not inspector.has_table(model.__tablename__):
+        return None
+    return [column["name"] for column in inspector.get_columns(model.__tablename__)]
+
+
+def iter_chunks(engine, model, watermark_column: str, watermark: Dict = None,
+                chunk_size: int = 5000, columns: List[str] = None) -> Iterator[List[Dict]]:
+    """按 (水位列, id) 键集分页读取，每次返回一块行字典
+
+    columns: 只读取这些列（源数据库缺少模型中的某些列时），默认全部列
+    """
+    table = model.__table__
+    column = table.c[watermark_column]
+    id_column = table.c.id
+    last_value = watermark.get("value") if watermark else None
+    last_id = watermark.get("id") if watermark else None
+    if last_value is not None and isinstance(column.type, DateTime):
+        last_value = datetime.fromisoformat(last_value)
+    
+    while True:
+        query = select(*(table.c[name] for name in columns)) if columns else select(table)
+        if last_value is not None:
+            if column is id_column:
+                query = query.where(id_column > last_value)
+            else:
+                query = query.where(or_(
+                    column > last_value,
+                    and_(column == last_value, id_column > last_id)
+                ))
+        query = query.order_by(column, id_column).limit(chunk_size)
+        
+        # 每块单独连接：块之间释放连接和读锁，服务端游标按 chunk_size 流式取回
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+            rows = [dict(row._mapping) for row in result]
+        
+        if not rows:
+            return
+        yield rows
+        last_value = rows[-1][watermark_column]
+        last_id = rows[-1]["id"]
+        if len(rows) < chunk_size:
+            return
+
+
+def _partition_key(value) -> str:
+    return value.strftime("%Y-%m-%d") if value else "unknown"
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class JsonlPartitionWriter:
+    """JSONL分区写入器（每个日期分区一个文件）"""
+    
+    extension = "jsonl"
+    
+    def __init__(self, table):
+        self.files = {}
+    
+    def write(self, path: str, rows: List[Dict]):
+        handle = self.files.get(path)
+        if handle is None:
+            handle = self.files[path] = open(path, "w", encoding="utf-8")
+        for row in rows:
+            handle.write(json.dumps(
+                {key: _json_value(value) for key, value in row.items()},
+                ensure_ascii=False
+            ))
+            handle.write("\n")
+    
+    def close(self):
+        for handle in self.files.values():
+            handle.close()
+        self.files = {}
+
+
+class ParquetPartitionWriter:
+    """Parquet分区写入器（每块作为一个 row group 追加，JSON列以字符串保存）"""
+    
+    extension = "parquet"
+    
+    def __init__(self, table):
+        import pyarrow as pa  # 可选依赖
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.pq = pq
+        self.json_columns = {c.name for c in table.columns if isinstance(c.type, JSON)}
+        self.schema = pa.schema([(c.name, self._arrow_type(c.type)) for c in table.columns])
+        self.writers = {}
+    
+    def _arrow_type(self, column_type):
+        pa = self.pa
+        if isinstance(column_type, Boolean):
+            return pa.bool_()
+        if isinstance(column_type, Integer):
+            return pa.int64()
+        if isinstance(column_type, Float):
+            return pa.float64()
+        if isinstance(column_type, DateTime):
+            return pa.timestamp("us")
+        return pa.string()
+    
+    def write(self, path: str, rows: List[Dict]):
+        columns = {}
+        for name in self.schema.names:
+            values = [row.get(name) for row in rows]
+            if name in self.json_columns:
+                values = [None if v is None else json.dumps(v, ensure_ascii=False) for v in values]
+            columns[name] = values
+        batch = self.pa.Table.from_pydict(columns, schema=self.schema)
+        
+        writer = self.writers.get(path)
+        if writer is None:
+            writer = self.writers[path] = self.pq.ParquetWriter(path, self.schema, compression="zstd")
+        writer.write_table(batch)
+    
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+WRITERS = {"jsonl": JsonlPartitionWriter, "parquet": ParquetPartitionWriter}
+
+
+def load_watermarks(output_dir: str) -> Dict:
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_watermarks(output_dir: str, watermarks: Dict):
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(watermarks, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def export_table(engine, name: str, output_dir: str, fmt: str = "jsonl",
+                 watermark: Dict = None, chunk_size: int = 5000, run_id: str = None,
+                 columns: List[str] = None) -> Dict:
+    """导出一张表，返回 {"rows": 行数, "files": 文件列表, "watermark": 新水位}"""
+    model, watermark_column, partition_column = EXPORT_TABLES[name]
+    run_id = run_id or datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    writer = WRITERS[fmt](model.__table__)
+    table_dir = os.path.join(output_dir, name)
+    
+    # 清理上次中断留下的临时文件
+    for stale in glob.glob(os.path.join(table_dir, "*", "*.tmp")):
+        os.remove(stale)
+    
+    row_count = 0
+    tmp_paths = set()
+    new_watermark = watermark
+    try:
+        for rows in iter_chunks(engine, model, watermark_column, watermark, chunk_size, columns):
+            partitions = {}
+            for row in rows:
+                partitions.setdefault(_partition_key(row[partition_column]), []).append(row)
+            for day, partition_rows in partitions.items():
+                partition_dir = os.path.join(table_dir, f"date={day}")
+                os.makedirs(partition_dir, exist_ok=True)
+                path = os.path.join(partition_dir, f"part-{run_id}.{writer.extension}.tmp")
+                writer.write(path, partition_rows)
+                tmp_paths.add(path)
+            
+            row_count += len(rows)
+            last = rows[-1]
+            new_watermark = {
+                "column": watermark_column,
+                "value": _json_value(last[watermark_column]),
+                "id": last["id"]
+            }
+    finally:
+        writer.close()
+    
+    files = []
+    for tmp_path in sorted(tmp_paths):
+        final_path = tmp_path[:-len(".tmp")]
+        os.replace(tmp_path, final_path)
+        files.append(final_path)
+    
+    return {"rows": row_count, "files": files, "watermark": new_watermark}
+
+
+def _skipped(reason: str, missing_columns: List[str] = None) -> Dict:
+    return {"rows": 0, "files": [], "watermark": None,
+            "missing_columns": missing_columns or [], "skipped": reason}
+
+
+def export_logs(output_dir: str, fmt: str = "jsonl", tables: List[str] = None,
+                database_url: str = None, chunk_size: int = 5000, full: bool = False) -> Dict:
+    """增量导出多张表，每张表完成后推进其水位
+
+    返回每张表的结果；skipped 为跳过的原因，missing_columns 为数据库中缺少、未导出的列
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    tables = tables or list(EXPORT_TABLES)
+    unknown = set(tables) - set(EXPORT_TABLES)
+    if unknown:
+        raise ValueError(f"未知的表: {', '.join(sorted(unknown))}")
+    
+    os.makedirs(output_dir, exist_ok=True)
+    # 只读打开：导出任务不迁移、不加写锁（旧数据库缺少的表和列只报告，不补齐）
+    engine = create_readonly_engine(database_url or Config.DATABASE_URL)
+    
+    watermarks = load_watermarks(output_dir)
+    run_id = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    summary = {}
+    try:
+        for name in tables:
+            model, watermark_column, partition_column = EXPORT_TABLES[name]
+            existing = source_columns(engine, model)
+            if existing is None:
+                summary[name] = _skipped("数据库中没有该表")
+                continue
+            missing = [c.name for c in model.__table__.columns if c.name not in existing]
+            required = [c for c in ("id", watermark_column, partition_column) if c in missing]
+            if required:
+                summary[name] = _skipped(
+                    f"缺少列 {', '.join(required)}，请先运行 python migrations.py", missing
+                )
+                continue
+            
+            watermark = None if full else watermarks.get(name)
+            if watermark and not watermark_matches(watermark, model, watermark_column):
+                print(f"⚠️ {name} 的增量水位列已改为 {watermark_column}，本次全量重新导出")
+                watermark = None
+            result = export_table(
+                engine, name, output_dir, fmt,
+                watermark=watermark,
+                chunk_size=chunk_size,
+                run_id=run_id,
+                columns=[c.name for c in model.__table__.columns if c.name in existing]
+            )
+            result.update(missing_columns=missing, skipped=None)
+            if result["watermark"] is not None:
+                watermarks[name] = dict(result["watermark"], exported_at=run_id)
+                save_watermarks(output_dir, watermarks)
+            summary[name] = result
+    finally:
+        engine.dispose()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按日期分区增量导出对话日志")
+    parser.add_argument("--output", default="./exports", help="输出目录")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl", help="导出格式")
+    parser.add_argument("--tables", nargs="*", choices=sorted(EXPORT_TABLES), help="要导出的表（默认全部）")
+    parser.add_argument("--database-url", default=Config.DATABASE_URL, help="数据库地址（建议指向只读副本）")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="每次读取的行数")
+    parser.add_argument("--full", action="store_true", help="忽略水位，全量导出")
+    args = parser.parse_args()
+    
+    summary = export_logs(
+        args.output, args.format, args.tables,
+        database_url=args.database_url,
+        chunk_size=args.chunk_size,
+        full=args.full
+    )
+    for name, result in summary.items():
+        if result["skipped"]:
+            print(f"⚠️ {name}: 跳过（{result['skipped']}）")
+            continue
+        print(f"✓ {name}: {result['rows']} 行，{len(result['files'])} 个文件")
+        if result["missing_columns"]:
+            print(f"  ⚠️ 数据库缺少列 {', '.join(result['missing_columns'])}，未导出（请先运行 python migrations.py）")
+
+
+if __name__ == "__main__":
+    main()
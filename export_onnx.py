@@ -0,0 +1,58 @@
+"""
+导出ONNX嵌入模型
+将 sentence-transformers 模型导出为 ONNX（可选 int8 动态量化），供 ONNX 后端加载
+"""
+import argparse
+import os
+from config import Config
+
+
+def export_onnx_model(model_name: str, output_dir: str, quantize: bool = False):
+    """导出模型和分词器到 output_dir"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    
+    os.makedirs(output_dir, exist_ok=True)
+    
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    
+    # 保存分词器（生成 tokenizer.json，供 tokenizers 库直接加载）
+    tokenizer.save_pretrained(output_dir)
+    
+    sample = tokenizer(["导出示例文本"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids")
+                   if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    
+    model_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17
+        )
+    print(f"✅ 已导出 {model_path}")
+    
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        quantized_path = os.path.join(output_dir, "model_quantized.onnx")
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"✅ 已导出int8量化模型 {quantized_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出ONNX嵌入模型")
+    parser.add_argument("--model", default=Config.EMBEDDING_MODEL, help="sentence-transformers 模型名或路径")
+    parser.add_argument("--output", default=Config.EMBEDDING_ONNX_PATH, help="输出目录")
+    parser.add_argument("--quantize", action="store_true", help="同时导出int8动态量化模型")
+    args = parser.parse_args()
+    
+    export_onnx_model(args.model, args.output, args.quantize)
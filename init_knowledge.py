@@ -68,6 +68,9 @@ def initialize_knowledge_base():
     rag.add_knowledge_batch(extended_knowledge)
     print(f"✅ 成功添加 {len(extended_knowledge)} 条知识")
     print(f"📚 知识库总计：{rag.get_knowledge_count()} 条文档")
+    
+    if rag.config.KB_SNAPSHOT_EXPORT:
+        print(f"📦 已导出知识库快照：{rag.export_snapshot()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+"""
+知识库维护：近似重复去重
+持续学习不断把"用户问题/有效回复"成功案例加入知识库，大量几乎相同的案例会挤占 top-k、拖慢检索：
+- 分页读取全部向量并归一化，按块计算余弦相似度（每块 block_size × N，内存有上界）
+- 相似度不低于阈值的文档用并查集合并成簇
+- 每簇保留一个代表：人工整理的知识优先，其次反馈评分最高、内容最完整的案例
+- 只删除学习得到的案例（人工整理的知识始终保留），分批删除；--dry-run 只输出报告
+
+服务的 writer 正在运行时不再打开第二个 writer：dedup 提交给 writer 在后台执行（报告输出在 writer 的日志中），
+--dry-run 以只读方式打开知识库
+
+用法：
+    python kb_maintenance.py dedup --dry-run
+    python kb_maintenance.py dedup --threshold 0.95
+"""
+from typing import Dict, Iterator, List, Tuple
+import argparse
+import sys
+import numpy as np
+from config import Config
+
+
+LEARNED_TYPES = ("成功案例",)  # 持续学习写入的文档类型，去重时可以删除
+
+
+class UnionFind:
+    """并查集（路径减半）"""
+    
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+    
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def similar_pairs(embeddings: np.ndarray, threshold: float,
+                  block_size: int = 256) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """按块找出余弦相似度不低于 threshold 的文档对 (i, j)，i < j
+
+    每块只与自身及之后的行比较，相似度矩阵最多 block_size × N
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.maximum(norms, 1e-12)
+    n = len(vectors)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        similarity = vectors[start:stop] @ vectors[start:].T
+        rows, cols = np.nonzero(similarity >= threshold)
+        upper = cols > rows  # 块内行号与列号都从 start 起算
+        yield rows[upper] + start, cols[upper] + start
+
+
+def find_duplicate_clusters(embeddings: np.ndarray, threshold: float,
+                            block_size: int = 256) -> List[List[int]]:
+    """近似重复簇（每簇至少两篇文档，簇内按下标排序）"""
+    union_find = UnionFind(len(embeddings))
+    for rows, cols in similar_pairs(embeddings, threshold, block_size):
+        for a, b in zip(rows.tolist(), cols.tolist()):
+            union_find.union(a, b)
+    
+    clusters = {}
+    for index in range(len(embeddings)):
+        clusters.setdefault(union_find.find(index), []).append(index)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def is_learned(metadata: Dict) -> bool:
+    return (metadata or {}).get("type") in LEARNED_TYPES
+
+
+def _rank(metadata: Dict, document: str) -> Tuple:
+    """代表优先级：人工整理的知识 > 反馈评分高 > 内容长"""
+    metadata = metadata or {}
+    return (not is_learned(metadata), float(metadata.get("feedback_score") or 0), len(document or ""))
+
+
+class KnowledgeDeduplicator:
+    """知识库近似重复去重（只能在 writer 进程中删除）"""
+    
+    def __init__(self, rag_system, threshold: float = None, block_size: int = None,
+                 batch_size: int = None, page_size: int = 1000):
+        self.rag_system = rag_system
+        self.threshold = threshold or Config.KB_DEDUP_THRESHOLD
+        self.block_size = block_size or Config.KB_DEDUP_BLOCK_SIZE
+        self.batch_size = batch_size or Config.KB_DEDUP_BATCH_SIZE
+        self.page_size = page_size
+    
+    def _load(self) -> Tuple[List[str], List[str], List[Dict], np.ndarray]:
+        """分页读取全部文档和向量（量化集合的向量从量化存储读取）"""
+        ids, documents, metadatas, embeddings = [], [], [], []
+        offset = 0
+        while True:
+            page = self.rag_system.collection.get(
+                include=["documents", "metadatas"],
+                limit=self.page_size,
+                offset=offset
+            )
+            if not page["ids"]:
+                break
+            ids.extend(page["ids"])
+            documents.extend(page["documents"])
+            metadatas.extend(meta or {} for meta in page["metadatas"])
+            embeddings.extend(self.rag_system.get_embeddings(page["ids"]))
+            offset += len(page["ids"])
+        return ids, documents, metadatas, np.asarray(embeddings, dtype=np.float32)
+    
+    def plan(self) -> Dict:
+        """找出重复簇和要删除的文档（不做任何修改）"""
+        ids, documents, metadatas, embeddings = self._load()
+        clusters = find_duplicate_clusters(embeddings, self.threshold, self.block_size) if ids else []
+        
+        remove, details = [], []
+        for members in clusters:
+            keeper = max(members, key=lambda i: _rank(metadatas[i], documents[i]))
+            duplicates = [i for i in members if i != keeper and is_learned(metadatas[i])]
+            if not duplicates:
+                continue
+            remove.extend(ids[i] for i in duplicates)
+            details.append({
+                "keep": ids[keeper],
+                "keep_preview": (documents[keeper] or "")[:60],
+                "keep_score": metadatas[keeper].get("feedback_score"),
+                "remove": [ids[i] for i in duplicates]
+            })
+        details.sort(key=lambda cluster: len(cluster["remove"]), reverse=True)
+        return {
+            "scanned": len(ids),
+            "threshold": self.threshold,
+            "clusters": details,
+            "remove_ids": remove
+        }
+    
+    def run(self, dry_run: bool = False) -> Dict:
+        """执行去重，返回报告（deleted 为实际删除的文档数）"""
+        report = self.plan()
+        report["dry_run"] = dry_run
+        report["deleted"] = 0
+        if not dry_run and report["remove_ids"]:
+            report["deleted"] = self.rag_system.delete_documents(report["remove_ids"], self.batch_size)
+        return report
+
+
+def print_report(report: Dict, limit: int = 10):
+    clusters = report["clusters"]
+    print(f"扫描 {report['scanned']} 篇文档（余弦相似度 ≥ {report['threshold']}），"
+          f"{len(clusters)} 个重复簇，{len(report['remove_ids'])} 篇可删除")
+    for cluster in clusters[:limit]:
+        score = cluster["keep_score"]
+        print(f"  保留 {cluster['keep']}（评分 {score if score is not None else '-'}）"
+              f"，删除 {len(cluster['remove'])} 篇：{cluster['keep_preview']}")
+    if len(clusters) > limit:
+        print(f"  ……另有 {len(clusters) - limit} 个簇")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库维护")
+    parser.add_argument("command", choices=["dedup"])
+    parser.add_argument("--threshold", type=float, default=Config.KB_DEDUP_THRESHOLD,
+                        help="视为重复的余弦相似度")
+    parser.add_argument("--block-size", type=int, default=Config.KB_DEDUP_BLOCK_SIZE,
+                        help="每次计算相似度的行数（控制内存）")
+    parser.add_argument("--dry-run", action="store_true", help="只输出报告，不删除")
+    args = parser.parse_args()
+    
+    from embedding_registry import EmbeddingRegistry, acquire_writer_lock, release_writer_lock
+    directory = Config.CHROMA_PERSIST_DIRECTORY
+    if args.dry_run:
+        # 试运行不修改知识库，以 reader 打开，不与 writer 冲突
+        Config.CHROMA_ROLE = "reader"
+    elif not acquire_writer_lock(directory, exclusive=True):
+        # 服务的 writer 正在运行：交给它删除，它的关键词索引和量化存储同步更新
+        try:
+            EmbeddingRegistry(directory).submit_command(
+                "dedup", threshold=args.threshold, block_size=args.block_size
+            )
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print("✓ writer 正在运行，已提交 dedup，writer 在下一次检索或写入时于后台执行，报告输出在 writer 的日志中")
+        return
+    
+    from rag_system import RAGSystem
+    try:
+        rag = RAGSystem()
+    except Exception:
+        if not args.dry_run:
+            release_writer_lock(directory)
+        raise
+    try:
+        deduplicator = KnowledgeDeduplicator(rag, threshold=args.threshold, block_size=args.block_size)
+        report = deduplicator.run(dry_run=args.dry_run)
+        print_report(report)
+        if report["deleted"]:
+            print(f"✓ 已删除 {report['deleted']} 篇重复文档，剩余 {rag.get_knowledge_count()} 篇")
+            if rag.config.KB_SNAPSHOT_EXPORT:
+                print(f"📦 已导出知识库快照：{rag.export_snapshot()}")
+    finally:
+        rag.close()
+        if not args.dry_run:
+            release_writer_lock(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+知识库快照
+writer（入库脚本、学习任务）把 Chroma 集合导出为不可变的版本化快照，
+服务进程（CHROMA_ROLE=snapshot）把快照整体加载到内存中检索，完全不打开 Chroma 目录：
+- 每个版本一个目录 v<纳秒时间戳>/，包含 manifest.json、documents.json 和 embeddings.npy
+- 先写入临时目录再改名，最后原子替换 CURRENT 文件指向新版本，读者只会看到完整的快照
+- 只保留最近 KB_SNAPSHOT_KEEP 个版本（当前版本始终保留）
+
+服务的 writer 正在运行时 export 提交给 writer 执行，不再打开第二个 writer。
+
+用法：
+    python kb_snapshot.py export    # 从 Chroma 集合导出新快照
+    python kb_snapshot.py status    # 查看快照版本
+"""
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+from config import Config
+
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+DOCUMENTS_FILE = "documents.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+
+
+class SnapshotCollection:
+    """内存中的只读快照，提供 RAGSystem 用到的 Chroma 集合只读接口（count / get / query）
+
+    距离与 Chroma 默认的 l2 空间一致（平方欧氏距离）
+    """
+    
+    def __init__(self, version: str, manifest: Dict, ids: List[str], documents: List[str],
+                 metadatas: List[Dict], embeddings: np.ndarray):
+        self.version = version
+        self.manifest = manifest
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self._sq_norms = np.einsum("ij,ij->i", self.embeddings, self.embeddings)
+        self._positions = {doc_id: i for i, doc_id in enumerate(ids)}
+    
+    def count(self) -> int:
+        return len(self.ids)
+    
+    def _rows(self, positions: List[int], include: List[str]) -> Dict:
+        return {
+            "ids": [self.ids[i] for i in positions],
+            "documents": [self.documents[i] for i in positions] if "documents" in include else None,
+            "metadatas": [self.metadatas[i] for i in positions] if "metadatas" in include else None,
+            "embeddings": [self.embeddings[i] for i in positions] if "embeddings" in include else None
+        }
+    
+    def get(self, ids: List[str] = None, include: List[str] = ("documents", "metadatas"),
+            limit: int = None, offset: int = None) -> Dict:
+        if ids is not None:
+            positions = [self._positions[doc_id] for doc_id in ids if doc_id in self._positions]
+        else:
+            start = offset or 0
+            stop = len(self.ids) if limit is None else start + limit
+            positions = list(range(start, min(stop, len(self.ids))))
+        return self._rows(positions, include)
+    
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10,
+              include: List[str] = ("documents", "metadatas", "distances")) -> Dict:
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        k = min(n_results, len(self.ids))
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": None}
+        if k == 0:
+            for key in ("ids", "documents", "metadatas", "distances"):
+                results[key] = [[] for _ in queries]
+            return results
+        
+        distances = (
+            np.einsum("ij,ij->i", queries, queries)[:, None]
+            - 2.0 * queries @ self.embeddings.T
+            + self._sq_norms[None, :]
+        )
+        for row in distances:
+            top = np.argpartition(row, k - 1)[:k]
+            top = top[np.argsort(row[top])]
+            rows = self._rows(top.tolist(), include)
+            results["ids"].append(rows["ids"])
+            results["documents"].append(rows["documents"])
+            results["metadatas"].append(rows["metadatas"])
+            results["distances"].append(np.maximum(row[top], 0.0).tolist())
+        return results
+
+
+def current_version(directory: str) -> Optional[str]:
+    """CURRENT 指向的快照版本；尚未导出时返回 None"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(directory: str) -> List[str]:
+    """已完成导出的版本（从旧到新）"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name for name in os.listdir(directory)
+        if name.startswith("v") and os.path.isfile(os.path.join(directory, name, MANIFEST_FILE))
+    )
+
+
+def export_snapshot(collection, directory: str, model: str, kb_version: str = "",
+                    keep: int = None, page_size: int = 1000, vectors: Callable = None) -> str:
+    """把集合导出为新版本快照并切换 CURRENT，返回版本号
+    
+    vectors: 按ID列表返回 float32 向量的函数（量化集合的向量不在 Chroma 中），为空时读取集合中的向量
+    """
+    keep = keep or Config.KB_SNAPSHOT_KEEP
+    include = ["documents", "metadatas"] if vectors is not None else ["documents", "metadatas", "embeddings"]
+    ids, documents, metadatas, embeddings = [], [], [], []
+    offset = 0
+    while True:
+        page = collection.get(
+            include=include,
+            limit=page_size,
+            offset=offset
+        )
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        documents.extend(doc or "" for doc in page["documents"])
+        metadatas.extend(meta or {} for meta in page["metadatas"])
+        embeddings.extend(vectors(page["ids"]) if vectors is not None else page["embeddings"])
+        offset += len(page["ids"])
+    
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    version = f"v{time.time_ns()}"
+    manifest = {
+        "version": version,
+        "created_at": datetime.now().isoformat(),
+        "count": len(ids),
+        "dimension": int(matrix.shape[1]) if len(ids) else 0,
+        "model": model,
+        "kb_version": kb_version
+    }
+    
+    os.makedirs(directory, exist_ok=True)
+    staging = os.path.join(directory, f".tmp-{version}")
+    os.makedirs(staging)
+    try:
+        np.save(os.path.join(staging, EMBEDDINGS_FILE), matrix)
+        with open(os.path.join(staging, DOCUMENTS_FILE), "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, f, ensure_ascii=False)
+        # manifest 最后写入，list_versions 以它判断版本是否完整
+        with open(os.path.join(staging, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.rename(staging, os.path.join(directory, version))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    
+    pointer = os.path.join(directory, CURRENT_FILE)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+    
+    prune_snapshots(directory, keep)
+    return version
+
+
+def load_snapshot(directory: str, version: str = None) -> SnapshotCollection:
+    """把指定版本（默认 CURRENT）加载到内存"""
+    version = version or current_version(directory)
+    if version is None:
+        raise FileNotFoundError(f"{directory} 中没有知识库快照，请先在 writer 上运行 python kb_snapshot.py export")
+    path = os.path.join(directory, version)
+    with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(os.path.join(path, DOCUMENTS_FILE), encoding="utf-8") as f:
+        documents = json.load(f)
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE))
+    if len(documents["ids"]) == 0:
+        embeddings = np.zeros((0, manifest.get("dimension", 0)), dtype=np.float32)
+    return SnapshotCollection(version, manifest, documents["ids"], documents["documents"],
+                              documents["metadatas"], embeddings)
+
+
+def prune_snapshots(directory: str, keep: int):
+    """删除较旧的版本，保留最近 keep 个和 CURRENT 指向的版本"""
+    versions = list_versions(directory)
+    current = current_version(directory)
+    for version in versions[:-keep] if keep > 0 else versions:
+        if version != current:
+            shutil.rmtree(os.path.join(directory, version), ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出或查看知识库快照")
+    parser.add_argument("command", choices=["export", "status"])
+    parser.add_argument("--directory", default=Config.KB_SNAPSHOT_DIR, help="快照目录")
+    args = parser.parse_args()
+    
+    if args.command == "export":
+        from embedding_registry import EmbeddingRegistry, acquire_writer_lock, release_writer_lock
+        directory = Config.CHROMA_PERSIST_DIRECTORY
+        if not acquire_writer_lock(directory, exclusive=True):
+            try:
+                EmbeddingRegistry(directory).submit_command("export_snapshot", directory=os.path.abspath(args.directory))
+            except RuntimeError as e:
+                print(f"❌ {e}")
+                sys.exit(1)
+            print("✓ writer 正在运行，已提交 export，writer 在下一次检索或写入时导出；用 status 查看")
+            return
+        
+        from rag_system import RAGSystem
+        try:
+            rag = RAGSystem()
+            try:
+                version = rag.export_snapshot(args.directory)
+                count = rag.get_knowledge_count()
+            finally:
+                rag.close()
+        finally:
+            release_writer_lock(directory)
+        print(f"✓ 已导出快照 {version}（{count} 条文档）")
+        return
+    
+    current = current_version(args.directory)
+    versions = list_versions(args.directory)
+    if not versions:
+        print(f"{args.directory} 中没有快照")
+        return
+    for version in versions:
+        with open(os.path.join(args.directory, version, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+        flag = "*" if version == current else " "
+        print(f"{flag} {version}  {manifest['created_at']}  {manifest['count']} 条文档  {manifest['model']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+延迟指标
+对聊天流程各阶段计时，汇总为滚动窗口分位数，并以 Prometheus 文本格式输出
+"""
+from collections import deque
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+import threading
+import time
+
+
+class LatencyHistogram:
+    """滚动窗口延迟统计（保留最近 window 个样本计算分位数）"""
+    
+    def __init__(self, window: int = 2048):
+        self.samples = deque(maxlen=window)
+        self.count = 0  # 累计样本数
+        self.total = 0.0  # 累计耗时（秒）
+        self._lock = threading.Lock()
+    
+    def observe(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+    
+    def percentiles(self, quantiles: List[float]) -> Dict[float, float]:
+        """计算窗口内的分位数（最近秩法）"""
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in quantiles}
+        last = len(ordered) - 1
+        return {q: ordered[min(last, int(q * len(ordered)))] for q in quantiles}
+
+
+class MetricsRegistry:
+    """指标注册表 - 按阶段名称保存延迟统计"""
+    
+    QUANTILES = (0.5, 0.95, 0.99)
+    
+    def __init__(self, window: int = 2048):
+        self.window = window
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, stage: str, seconds: float):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, LatencyHistogram(self.window))
+        histogram.observe(seconds)
+    
+    def _snapshot(self):
+        with self._lock:
+            return sorted(self.histograms.items())
+    
+    def summary(self) -> Dict[str, Dict]:
+        """各阶段的样本数与 p50/p95/p99（毫秒）"""
+        result = {}
+        for stage, histogram in self._snapshot():
+            p50, p95, p99 = (histogram.percentiles(self.QUANTILES)[q] for q in self.QUANTILES)
+            result[stage] = {
+                "count": histogram.count,
+                "p50_ms": p50 * 1000,
+                "p95_ms": p95 * 1000,
+                "p99_ms": p99 * 1000
+            }
+        return result
+    
+    def render_prometheus(self, name: str = "chat_stage_latency_seconds") -> str:
+        """以 Prometheus summary 格式输出"""
+        lines = [
+            f"# HELP {name} Latency of chat pipeline stages in seconds.",
+            f"# TYPE {name} summary"
+        ]
+        for stage, histogram in self._snapshot():
+            for q, value in histogram.percentiles(self.QUANTILES).items():
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+    
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+
+# 进程级默认注册表
+REGISTRY = MetricsRegistry()
+
+
+class _Span:
+    __slots__ = ("timer", "stage", "start")
+    
+    def __init__(self, timer: "StageTimer", stage: str):
+        self.timer = timer
+        self.stage = stage
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.timer.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+_NULL_SPAN = nullcontext()
+
+
+class StageTimer:
+    """单次请求的阶段计时器；禁用时 span() 返回共享的空上下文，几乎无开销"""
+    
+    def __init__(self, registry: MetricsRegistry = None, enabled: bool = True):
+        self.registry = registry
+        self.enabled = enabled
+        self.timings: Dict[str, float] = {}  # 阶段 -> 毫秒
+    
+    def span(self, stage: str):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage)
+    
+    def record(self, stage: str, seconds: float):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds * 1000
+        if self.registry is not None:
+            self.registry.observe(stage, seconds)
+
+
+def start_metrics_server(registry: MetricsRegistry = None, host: str = "127.0.0.1",
+                         port: int = 9464) -> ThreadingHTTPServer:
+    """在后台线程启动 /metrics 端点（端点不做认证，默认只监听本机）"""
+    registry = registry or REGISTRY
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,238 @@
+"""
+数据库结构迁移
+schema_version 表记录已应用的版本，启动时按顺序执行尚未应用的迁移
+
+- 新数据库：直接按最新模型建表，并标记为最新版本
+- 旧数据库（无 schema_version）：从版本1开始依次执行
+- 每个迁移在单独的事务中执行（SQLite 下 DDL 同样在事务内，失败时整体回滚）
+
+用法：
+    python migrations.py            # 迁移到最新版本
+    python migrations.py --status   # 查看当前版本
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+import argparse
+import threading
+from sqlalchemy import (
+    create_engine, event, inspect, text, Column, DateTime, Integer, MetaData, String, Table
+)
+from config import Config
+from data_system import Base, Conversation, EmotionTrend, create_db_engine, ensure_columns
+
+
+_version_metadata = MetaData()
+
+schema_version = Table(
+    "schema_version", _version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200)),
+    Column("applied_at", DateTime, default=datetime.now)
+)
+
+
+def _baseline(conn):
+    """创建缺失的表，补齐缺失的列"""
+    Base.metadata.create_all(conn)
+    ensure_columns(conn)
+
+
+def _composite_indexes(conn):
+    """会话历史与高质量对话查询的复合索引；(session_id, timestamp) 覆盖原单列索引"""
+    conn.execute(text("DROP INDEX IF EXISTS ix_conversations_session_id"))
+    for index in Conversation.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _conversation_session_foreign_key(conn):
+    """conversations.session_id 引用 user_sessions.session_id"""
+    # 被引用列必须有唯一索引（早期手工建的表可能没有）
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_user_sessions_session_id ON user_sessions (session_id)"
+    ))
+    # 先为没有会话记录的历史对话补建会话，保证已有数据满足约束
+    conn.execute(text("""
+        INSERT INTO user_sessions (session_id, start_time, last_active, message_count)
+        SELECT session_id, MIN(timestamp), MAX(timestamp), COUNT(*)
+        FROM conversations
+        WHERE session_id IS NOT NULL
+          AND session_id NOT IN (SELECT session_id FROM user_sessions WHERE session_id IS NOT NULL)
+        GROUP BY session_id
+    """))
+    
+    if conn.dialect.name == "sqlite":
+        # SQLite 不支持 ALTER TABLE 添加约束，按模型定义重建表
+        _rebuild_sqlite_table(conn, Conversation.__table__)
+    else:
+        conn.execute(text(
+            "ALTER TABLE conversations ADD CONSTRAINT fk_conversations_session_id "
+            "FOREIGN KEY (session_id) REFERENCES user_sessions (session_id)"
+        ))
+
+
+def _emotion_trend_timestamp_index(conn):
+    """情绪记录按时间范围读取（保留策略、情绪分析的增量加载）"""
+    for index in EmotionTrend.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _conversation_updated_at(conn):
+    """对话表 updated_at 列（写入反馈时更新），旧数据取对话时间；日志导出按它增量导出"""
+    columns = {column["name"] for column in inspect(conn).get_columns("conversations")}
+    if "updated_at" not in columns:
+        # 从版本3之前升级时，重建对话表已按最新模型带上该列
+        column_type = Conversation.__table__.c.updated_at.type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE conversations ADD COLUMN updated_at {column_type}"))
+    conn.execute(text("UPDATE conversations SET updated_at = timestamp WHERE updated_at IS NULL"))
+    for index in Conversation.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _rebuild_sqlite_table(conn, table):
+    """重命名旧表 -> 按模型建新表 -> 复制共有列 -> 删除旧表"""
+    old_name = f"{table.name}__old"
+    old_columns = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table.name})"))}
+    columns = ", ".join(c.name for c in table.columns if c.name in old_columns)
+    
+    # 旧表上的索引随表一起改名，名字仍被占用，先删除
+    old_indexes = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL"
+    ), {"table": table.name}).scalars().all()
+    for index_name in old_indexes:
+        conn.execute(text(f"DROP INDEX {index_name}"))
+    
+    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old_name}"))
+    table.create(conn)
+    conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}"))
+    conn.execute(text(f"DROP TABLE {old_name}"))
+    
+    violations = conn.execute(text(f"PRAGMA foreign_key_check({table.name})")).fetchall()
+    if violations:
+        raise RuntimeError(f"{table.name} 重建后存在 {len(violations)} 条外键冲突")
+
+
+# (版本, 说明, 迁移函数)；只能追加，不要修改已发布的迁移
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "基线：创建表并补齐列", _baseline),
+    (2, "对话表复合索引 (session_id, timestamp) 与 (feedback_score, timestamp)", _composite_indexes),
+    (3, "对话表外键 session_id -> user_sessions", _conversation_session_foreign_key),
+    (4, "情绪趋势表 timestamp 索引", _emotion_trend_timestamp_index),
+    (5, "对话表 updated_at 列与 (updated_at, id) 索引", _conversation_updated_at),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_migrate_lock = threading.Lock()
+
+
+def _migration_engine(engine):
+    """迁移专用引擎；SQLite 下由我们显式 BEGIN，使 DDL 也在事务内执行"""
+    if engine.dialect.name != "sqlite" or engine.url.database in (None, "", ":memory:"):
+        return engine
+    
+    migration_engine = create_engine(engine.url)
+    
+    @event.listens_for(migration_engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None  # 关闭 pysqlite 的隐式事务管理
+        # 重建表期间关闭外键检查（该PRAGMA在事务内无效），完成后用 foreign_key_check 校验
+        dbapi_connection.execute("PRAGMA foreign_keys=OFF")
+    
+    @event.listens_for(migration_engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
+    
+    return migration_engine
+
+
+def current_version(conn) -> int:
+    """当前数据库的结构版本（0 表示未纳入迁移管理）"""
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def require_latest(engine):
+    """只读任务（分析、导出）不迁移数据库，结构不是最新版本时报错，提示先运行迁移"""
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version != LATEST_VERSION:
+        raise RuntimeError(
+            f"数据库结构版本为 {version}，需要 {LATEST_VERSION}；请先运行 python migrations.py 迁移"
+        )
+
+
+def _is_up_to_date(engine) -> bool:
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        return all(inspector.has_table(t.name) for t in Base.metadata.sorted_tables) \
+            and current_version(conn) == LATEST_VERSION
+
+
+def migrate(engine=None) -> int:
+    """把数据库迁移到最新版本，返回迁移后的版本"""
+    engine = engine or create_db_engine()
+    with _migrate_lock:
+        # 常见情况：已是最新版本，只做一次轻量检查
+        if _is_up_to_date(engine):
+            return LATEST_VERSION
+        
+        migration_engine = _migration_engine(engine)
+        try:
+            with migration_engine.begin() as conn:
+                is_new = not any(
+                    inspect(conn).has_table(table.name) for table in Base.metadata.sorted_tables
+                )
+                _version_metadata.create_all(conn)
+                version = current_version(conn)
+                if is_new:
+                    # 新数据库按最新模型建表，无需逐个执行迁移
+                    Base.metadata.create_all(conn)
+                    for number, description, _ in MIGRATIONS:
+                        conn.execute(schema_version.insert().values(
+                            version=number, description=description
+                        ))
+                    version = LATEST_VERSION
+            
+            for number, description, upgrade in MIGRATIONS:
+                if number <= version:
+                    continue
+                with migration_engine.begin() as conn:
+                    upgrade(conn)
+                    conn.execute(schema_version.insert().values(
+                        version=number, description=description
+                    ))
+                version = number
+            
+            # 模型新增的列/表（尚未编写迁移时）也补齐
+            with migration_engine.begin() as conn:
+                _baseline(conn)
+        finally:
+            if migration_engine is not engine:
+                migration_engine.dispose()
+        
+        return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库结构迁移")
+    parser.add_argument("--database-url", default=Config.DATABASE_URL, help="数据库地址")
+    parser.add_argument("--status", action="store_true", help="只显示当前版本")
+    args = parser.parse_args()
+    
+    engine = create_db_engine(args.database_url)
+    try:
+        if args.status:
+            with engine.connect() as conn:
+                version = current_version(conn)
+            print(f"当前版本: {version}，最新版本: {LATEST_VERSION}")
+            return
+        
+        version = migrate(engine)
+        print(f"✓ 数据库已迁移到版本 {version}")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -31,7 +31,16 @@ class PromptTemplate:
 - 对于自杀、自残等严重问题，务必建议立即寻求专业帮助
 - 保护用户隐私，不评判用户
 """
-
+    
+    # 危机支持提示词（安全检查判定为高风险时追加）
+    CRISIS_SUPPORT_PROMPT = """【安全提醒】用户当前消息可能涉及自杀、自残或其他紧急风险。
+请优先关注用户的安全：
+- 先表达关心和理解，认真对待用户的感受，不要评判或说教
+- 温和地询问用户现在是否安全
+- 明确建议立即联系身边信任的人、学校心理咨询中心，或拨打心理援助热线（如 12356、400-161-9995）
+- 如有紧急危险，建议立即拨打 110 / 120 或前往最近的医院
+"""
+    
     # 情绪识别提示词
     EMOTION_DETECTION_PROMPT = """基于以下用户消息，识别主要情绪类别（从以下选项中选择1-2个）：
 焦虑、压力、困惑、沮丧、孤独、疲惫、积极、中性
@@ -40,7 +49,7 @@ class PromptTemplate:
 
 请以JSON格式返回：{{"emotions": ["情绪1", "情绪2"], "intensity": "低/中/高"}}
 """
-
+    
     # RAG增强提示词
     RAG_ENHANCED_PROMPT = """参考以下相关知识库内容，回复用户的问题：
 
@@ -51,7 +60,7 @@ class PromptTemplate:
 
 请结合知识库内容和你的理解，给出温暖、有帮助的回复。如果知识库内容不够相关，你也可以基于你的知识给出建议。
 """
-
+    
     # 对话历史整合提示词
     CONVERSATION_CONTEXT_PROMPT = """对话历史：
 {conversation_history}
@@ -91,19 +100,40 @@ class EmotionAnalyzer:
 class PromptBuilder:
     """提示词构建器"""
     
-    def __init__(self):
+    def __init__(self, prefix_caching: bool = None):
         self.config = Config()
-    
-    def build_system_message(self) -> Dict:
-        """构建系统消息"""
-        return {
+        # 前缀缓存布局：保持消息前缀字节稳定，便于服务商复用已缓存的提示词前缀
+        if prefix_caching is None:
+            prefix_caching = self.config.PROMPT_PREFIX_CACHING
+        self.prefix_caching = prefix_caching
+        
+        # 预渲染固定的模板片段，每轮只拼接变量部分
+        self._system_message = {
             "role": "system",
             "content": PromptTemplate.SYSTEM_PROMPT
         }
+        self._crisis_message = {
+            "role": "system",
+            "content": PromptTemplate.CRISIS_SUPPORT_PROMPT
+        }
+        rag_head, _, rest = PromptTemplate.RAG_ENHANCED_PROMPT.partition("{knowledge_context}")
+        rag_middle, _, rag_tail = rest.partition("{user_message}")
+        self._rag_fragments = (rag_head, rag_middle, rag_tail)
+    
+    def build_system_message(self) -> Dict:
+        """构建系统消息"""
+        return self._system_message
     
     def build_rag_enhanced_prompt(self, user_message: str, 
                                   knowledge_docs: List[Dict]) -> str:
         """构建RAG增强的提示词"""
+        # 前缀缓存模式下按文档ID排序，相同的检索结果总是渲染出相同的字节
+        if self.prefix_caching:
+            knowledge_docs = sorted(
+                knowledge_docs,
+                key=lambda doc: str(doc.get('id') or doc.get('content', ''))
+            )
+        
         # 整理知识库内容
         knowledge_context = ""
         for idx, doc in enumerate(knowledge_docs, 1):
@@ -115,10 +145,8 @@ class PromptBuilder:
         if not knowledge_context.strip():
             knowledge_context = "暂无相关知识库内容"
         
-        return PromptTemplate.RAG_ENHANCED_PROMPT.format(
-            knowledge_context=knowledge_context.strip(),
-            user_message=user_message
-        )
+        rag_head, rag_middle, rag_tail = self._rag_fragments
+        return rag_head + knowledge_context.strip() + rag_middle + user_message + rag_tail
     
     def build_conversation_prompt(self, user_message: str, 
                                   history: List[Dict]) -> str:
@@ -136,14 +164,33 @@ class PromptBuilder:
     
     def build_messages(self, user_message: str, 
                       conversation_history: List[Dict] = None,
-                      rag_docs: List[Dict] = None) -> List[Dict]:
-        """构建完整的消息列表"""
+                      rag_docs: List[Dict] = None,
+                      safety_alert: bool = False) -> List[Dict]:
+        """构建完整的消息列表
+        
+        前缀缓存模式的顺序：系统提示词 → 按块截断的历史 → 危机指引 → 知识库参考与用户问题。
+        知识库参考没有放进系统提示词之后的固定前缀：每轮检索结果不同，会话累计的文档集合
+        几乎每轮都会增加新文档，放在历史之前会使其后整段历史的前缀缓存失效；
+        参考内容只有 top-k 篇短文，放在末尾（按文档ID排序，相同结果渲染出相同字节）
+        损失的缓存远小于历史部分，因此稳定前缀只包含系统提示词和历史
+        """
         messages = [self.build_system_message()]
         
-        # 添加对话历史（限制长度）
-        if conversation_history:
-            recent_history = conversation_history[-self.config.MAX_CONVERSATION_HISTORY:]
-            messages.extend(recent_history)
+        if self.prefix_caching:
+            # 固定前缀：系统提示词 + 按块截断的历史；变量内容全部放在末尾
+            if conversation_history:
+                messages.extend(self.trim_history(conversation_history))
+            if safety_alert:
+                messages.append(self._crisis_message)
+        else:
+            # 高风险消息追加危机支持指引
+            if safety_alert:
+                messages.append(self._crisis_message)
+            
+            # 添加对话历史（限制长度）
+            if conversation_history:
+                recent_history = conversation_history[-self.config.MAX_CONVERSATION_HISTORY:]
+                messages.extend(recent_history)
         
         # 如果有RAG文档，使用增强提示词
         if rag_docs and len(rag_docs) > 0:
@@ -160,6 +207,36 @@ class PromptBuilder:
         
         return messages
     
+    def prompt_composition(self, messages: List[Dict], user_message: str) -> Dict[str, int]:
+        """统计 build_messages 结果中各部分的字符数：系统指令、对话历史、知识库参考、用户消息"""
+        composition = {"system": 0, "history": 0, "rag_context": 0, "user": len(user_message)}
+        for message in messages[:-1]:
+            key = "system" if message["role"] == "system" else "history"
+            composition[key] += len(message["content"])
+        
+        final_content = messages[-1]["content"]
+        if final_content != user_message:
+            # RAG增强提示词：扣除固定模板片段和用户消息，剩余部分即知识库参考内容
+            template_chars = sum(len(fragment) for fragment in self._rag_fragments)
+            composition["system"] += template_chars
+            composition["rag_context"] = len(final_content) - len(user_message) - template_chars
+        return composition
+    
+    def trim_history(self, history: List[Dict]) -> List[Dict]:
+        """按块截断历史记录
+        
+        超出上限时一次丢弃整块最早的消息，而不是每轮滑动一条，
+        这样在两次截断之间历史前缀保持不变，可以命中提示词前缀缓存。
+        """
+        max_messages = self.config.MAX_CONVERSATION_HISTORY
+        if len(history) <= max_messages:
+            return history
+        
+        step = self.config.PROMPT_HISTORY_TRIM_STEP
+        overflow = len(history) - max_messages
+        drop = -(-overflow // step) * step
+        return history[drop:]
+    
     @staticmethod
     def create_safety_check_prompt(user_message: str) -> str:
         """创建安全检查提示词"""
@@ -2,40 +2,239 @@
 RAG系统 - 检索增强生成
 实现知识库管理、向量存储和相似度检索
 """
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
+from collections import OrderedDict
+import math
+import re
+import threading
+import time
+import uuid
 import chromadb
+from chromadb.api.client import SharedSystemClient
 from chromadb.config import Settings
 try:
     from langchain.text_splitter import RecursiveCharacterTextSplitter
 except ImportError:
     from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
+import numpy as np
 import json
 import os
 from config import Config
+from vector_store import QuantizedVectorStore
+from embedding_backends import create_encoder
+from embedding_cache import CachedEncoder, EmbeddingCache, model_key
+from embedding_registry import (
+    LEGACY_COLLECTION, EmbeddingRegistry, acquire_writer_lock, release_writer_lock
+)
+from batching import MicroBatcher
+from reranker import Reranker
+from kb_maintenance import KnowledgeDeduplicator, print_report
+import kb_snapshot
+
+# 打开客户端与清空 Chroma 进程级缓存之间不能有其他线程打开同一目录
+_client_lock = threading.Lock()
+
+
+def open_chroma_client(path: str):
+    """打开只属于调用方的 Chroma 客户端，返回 (客户端, System)
+    
+    Chroma 按持久化目录在进程内缓存并共享 System（SQLite 连接池、HNSW 索引），
+    这里打开后立即清空缓存，每个 RAGSystem 持有自己的 System，重新加载和关闭时自行停止，
+    不会停掉其他实例仍在使用的 System
+    """
+    with _client_lock:
+        client = chromadb.PersistentClient(path=path)
+        system = client._system
+        SharedSystemClient.clear_system_cache()
+    return client, system
+
+
+def stop_chroma_system(system):
+    """停止 System，释放 SQLite 连接和索引"""
+    if system is not None:
+        system.stop()
+
+
+class KeywordIndex:
+    """关键词倒排索引 - 中文按字符n-gram切分，使用BM25打分"""
+    
+    # 中文字符连续片段 / 英文数字单词
+    _CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]+")
+    _WORD_PATTERN = re.compile(r"[a-z0-9]+")
+    
+    def __init__(self, ngram_sizes: Tuple[int, ...] = (1, 2),
+                 k1: float = 1.5, b: float = 0.75):
+        self.ngram_sizes = ngram_sizes
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {doc_id: 词频}
+        self.doc_terms = {}  # doc_id -> {term: 词频}
+        self.doc_lengths = {}  # doc_id -> 词条总数
+        self.total_length = 0
+        self._lock = threading.Lock()
+    
+    def tokenize(self, text: str) -> List[str]:
+        """分词：中文生成字符n-gram，英文按单词切分"""
+        text = text.lower()
+        tokens = []
+        for run in self._CJK_PATTERN.findall(text):
+            for n in self.ngram_sizes:
+                tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+        tokens.extend(self._WORD_PATTERN.findall(text))
+        return tokens
+    
+    def add(self, doc_id: str, text: str):
+        """添加（或替换）一篇文档"""
+        term_freqs = {}
+        for term in self.tokenize(text):
+            term_freqs[term] = term_freqs.get(term, 0) + 1
+        
+        with self._lock:
+            self._remove_locked(doc_id)
+            self.doc_terms[doc_id] = term_freqs
+            self.doc_lengths[doc_id] = sum(term_freqs.values())
+            self.total_length += self.doc_lengths[doc_id]
+            for term, freq in term_freqs.items():
+                self.postings.setdefault(term, {})[doc_id] = freq
+    
+    def remove(self, doc_id: str):
+        """删除一篇文档"""
+        with self._lock:
+            self._remove_locked(doc_id)
+    
+    def _remove_locked(self, doc_id: str):
+        term_freqs = self.doc_terms.pop(doc_id, None)
+        if term_freqs is None:
+            return
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in term_freqs:
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+    
+    def clear(self):
+        """清空索引"""
+        with self._lock:
+            self.postings = {}
+            self.doc_terms = {}
+            self.doc_lengths = {}
+            self.total_length = 0
+    
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+    
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """BM25检索，返回 [(doc_id, 分数)]，按分数降序"""
+        query_terms = set(self.tokenize(query))
+        
+        with self._lock:
+            doc_count = len(self.doc_terms)
+            if doc_count == 0 or not query_terms:
+                return []
+            avg_length = self.total_length / doc_count
+            
+            scores = {}
+            for term in query_terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, freq in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + \
+                        idf * freq * (self.k1 + 1) / (freq + norm)
+        
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        return ranked[:top_k]
+    
+    def score(self, query: str, doc_ids: List[str]) -> List[float]:
+        """指定文档的BM25分数（不在索引中的文档为0）"""
+        query_terms = set(self.tokenize(query))
+        
+        with self._lock:
+            doc_count = len(self.doc_terms)
+            if doc_count == 0 or not query_terms:
+                return [0.0] * len(doc_ids)
+            avg_length = self.total_length / doc_count
+            
+            idfs = {}
+            for term in query_terms:
+                docs = self.postings.get(term)
+                if docs:
+                    idfs[term] = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            
+            scores = []
+            for doc_id in doc_ids:
+                term_freqs = self.doc_terms.get(doc_id)
+                total = 0.0
+                if term_freqs:
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    for term, idf in idfs.items():
+                        freq = term_freqs.get(term)
+                        if freq:
+                            total += idf * freq * (self.k1 + 1) / (freq + norm)
+                scores.append(total)
+        return scores
 
 
 class RAGSystem:
     """RAG系统类 - 管理知识库和检索"""
     
-    def __init__(self):
-        """初始化RAG系统"""
+    RETRIEVAL_MODES = ("vector", "keyword", "hybrid")
+    ROLES = ("writer", "reader", "snapshot")
+    VERSION_FILE = "kb_version"  # writer 每次写入后更新，reader 据此判断是否需要重新打开集合
+    
+    def __init__(self, embedding_model=None):
+        """初始化RAG系统
+        
+        embedding_model: 可选的编码器实例（需提供 encode 方法），为空时按配置创建
+        """
         self.config = Config()
+        if self.config.CHROMA_ROLE not in self.ROLES:
+            raise ValueError(f"未知的知识库角色: {self.config.CHROMA_ROLE}")
+        self.read_only = self.config.CHROMA_ROLE != "writer"
+        # 快照模式：不打开 Chroma，检索只读的内存快照，由后台线程切换到新版本
+        self.snapshot_mode = self.config.CHROMA_ROLE == "snapshot"
         
-        # 初始化向量数据库
-        self.client = chromadb.PersistentClient(
-            path=self.config.CHROMA_PERSIST_DIRECTORY
-        )
+        # 嵌入模型注册表：每个模型一个集合，记录当前服务的集合（见 embedding_registry.py）
+        self.registry = EmbeddingRegistry(self.config.CHROMA_PERSIST_DIRECTORY)
+        # writer 持有目录的共享锁，embedding_registry.py 据此判断是否由本进程代为执行命令
+        self._holds_writer_lock = False
+        if not self.read_only:
+            if not acquire_writer_lock(self.registry.directory):
+                raise RuntimeError(f"embedding_registry.py 正在修改 {self.registry.directory}，请等待命令完成后再启动")
+            self._holds_writer_lock = True
+        # 集合、编码器、量化存储在切换模型时一起替换，检索在锁内一次取出
+        self._swap_lock = threading.Lock()
+        # 写入与切换集合互斥（切换前同步的写入不会遗漏）
+        self._write_lock = threading.RLock()
         
-        # 获取或创建集合
-        self.collection = self.client.get_or_create_collection(
-            name="emotional_support_kb",
-            metadata={"description": "大学生情绪支持知识库"}
-        )
+        # 初始化向量数据库并获取或创建集合
+        # 重新加载后被替换的 System，下次重新加载或关闭时停止（此时旧集合上的检索早已结束）
+        self._chroma_system = self._retired_system = None
+        self._open_collection()
+        self._kb_version = self._read_kb_version()
+        self._last_refresh_check = time.monotonic()
+        self._refresh_lock = threading.Lock()
+        self._snapshot_stop = threading.Event()
+        self._snapshot_watcher = None
+        # 文档数缓存，知识库变化（写入、重新加载、切换快照）时失效
+        self._knowledge_count = None
         
-        # 初始化嵌入模型（使用多语言模型）
-        self.embedding_model = SentenceTransformer(
-            self.config.EMBEDDING_MODEL
+        # 初始化嵌入模型（PyTorch 或 ONNX 后端），模型由当前集合决定
+        self._encoders = {}
+        if embedding_model is not None:
+            self._encoders[self.embedding_model_name] = embedding_model
+        self.embedding_model = self._encoder_for(self.embedding_model_name)
+        if self.embedding_model_name != self.config.EMBEDDING_MODEL:
+            print(f"⚠️ 知识库当前使用嵌入模型 {self.embedding_model_name}，与 EMBEDDING_MODEL="
+                  f"{self.config.EMBEDDING_MODEL} 不一致；更换模型请用 embedding_registry.py 重建并切换")
+        # 文档编码器：writer 启用持久化缓存时，已编码过的文本不再经过模型（查询不落盘）
+        self._embedding_caches = {}
+        self.embedding_cache, self.document_encoder = self._document_encoder_for(
+            self.embedding_model_name, self.embedding_model
         )
         
         # 文本分割器
@@ -45,9 +244,416 @@ class RAGSystem:
             separators=["\n\n", "\n", "。", "！", "？", ".", "!", "?", " ", ""]
         )
         
-        # 如果知识库为空，加载初始知识
-        if self.collection.count() == 0:
+        # 查询向量LRU缓存（安全筛查与检索共用同一次编码）
+        self._query_embedding_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        
+        # 关键词索引（与向量集合同步维护）
+        self.keyword_index = self._build_keyword_index()
+        
+        # 量化向量存储：量化集合的主向量存储（快照模式下按配置在内存中构建，用于首轮近似检索）
+        self.quantized_store = self._open_quantized_store(self.collection_name, self.collection)
+        quantization = self._quantization(self.collection_name)
+        if quantization != self.config.EMBEDDING_QUANTIZATION and not self.snapshot_mode:
+            print(f"⚠️ 知识库当前集合的向量存储为 {quantization}，与 EMBEDDING_QUANTIZATION="
+                  f"{self.config.EMBEDDING_QUANTIZATION} 不一致；转换请运行 embedding_registry.py reindex "
+                  f"--model {self.embedding_model_name} --activate")
+        
+        # 重排器（可选）：扩大候选池后按多种信号重新排序
+        self.reranker = Reranker() if self.config.RAG_RERANK else None
+        
+        # 并发查询合并器（可选）
+        self.query_coalescer = None
+        if self.config.RAG_COALESCE_QUERIES:
+            self.query_coalescer = MicroBatcher(
+                self._vector_search_batch,
+                max_batch_size=self.config.RAG_COALESCE_MAX_BATCH,
+                max_wait_ms=self.config.RAG_COALESCE_WINDOW_MS,
+                name="rag-query-coalescer"
+            )
+        
+        # 如果知识库为空，加载初始知识（只读进程等待 writer 加载）
+        if self.collection.count() == 0 and not self.read_only:
             self._load_initial_knowledge()
+        
+        if self.snapshot_mode:
+            self._snapshot_watcher = threading.Thread(
+                target=self._watch_snapshots, name="kb-snapshot-watcher", daemon=True
+            )
+            self._snapshot_watcher.start()
+        elif not self.read_only and self.config.KB_SNAPSHOT_EXPORT and \
+                self._snapshot_kb_version() != self._kb_version:
+            # 上次导出之后知识库有变化（包括刚加载的初始知识），导出给快照模式的服务进程
+            self.export_snapshot()
+    
+    def _open_collection(self):
+        if self.snapshot_mode:
+            self.client = None
+            self.collection = self._load_snapshot()
+            # 快照记录导出时的嵌入模型
+            self.collection_name = None
+            self.embedding_model_name = self.collection.manifest.get("model") or self.config.EMBEDDING_MODEL
+            return
+        self.client, self._chroma_system = open_chroma_client(self.config.CHROMA_PERSIST_DIRECTORY)
+        if not self.read_only and not os.path.exists(self.registry.path):
+            # 新部署的原有集合按配置使用量化存储；已有 float32 向量的旧部署保持不变
+            empty = self._get_collection(LEGACY_COLLECTION).count() == 0
+            self.registry.ensure(self.config.EMBEDDING_QUANTIZATION if empty else "none")
+        self.collection_name, self.embedding_model_name = self.registry.active()
+        self.collection = self._get_collection(self.collection_name)
+    
+    def _get_collection(self, name: str, client=None):
+        return (client or self.client).get_or_create_collection(
+            name=name,
+            metadata={"description": "大学生情绪支持知识库"}
+        )
+    
+    def _encoder_for(self, model: str):
+        """模型对应的编码器（首次使用时加载，之后复用，回滚时无需重新加载）"""
+        encoder = self._encoders.get(model)
+        if encoder is None:
+            encoder = self._encoders[model] = create_encoder(self.config, model=model)
+        return encoder
+    
+    def _document_encoder_for(self, model: str, encoder) -> Tuple[Optional[EmbeddingCache], object]:
+        """文档编码器：writer 启用持久化缓存时包装为 CachedEncoder（缓存按模型隔离）"""
+        if not self.config.EMBEDDING_CACHE_ENABLED or self.read_only:
+            return None, encoder
+        cache = self._embedding_caches.get(model)
+        if cache is None:
+            cache = self._embedding_caches[model] = EmbeddingCache(model=model_key(self.config, model=model))
+        return cache, CachedEncoder(encoder, cache)
+    
+    def _install_collection(self, name: Optional[str], model: str, collection, encoder, quantized_store):
+        """替换检索使用的集合、编码器和量化存储（检索线程看到的总是同一模型的一组）"""
+        cache, document_encoder = self._document_encoder_for(model, encoder)
+        # 被替换的量化存储只关闭写入文件，正在其上执行的检索不受影响
+        if self.quantized_store is not None and self.quantized_store is not quantized_store:
+            self.quantized_store.close()
+        with self._swap_lock:
+            self.collection = collection
+            self.collection_name = name
+            self.embedding_model = encoder
+            self.embedding_model_name = model
+            self.quantized_store = quantized_store
+            self.embedding_cache = cache
+            self.document_encoder = document_encoder
+        self._knowledge_count = None
+    
+    def _search_state(self) -> Tuple:
+        """(集合, 编码器, 模型, 量化存储)"""
+        with self._swap_lock:
+            return self.collection, self.embedding_model, self.embedding_model_name, self.quantized_store
+    
+    def _build_keyword_index(self, collection=None, page_size: int = 1000) -> KeywordIndex:
+        """从向量集合构建关键词索引"""
+        collection = collection or self.collection
+        keyword_index = KeywordIndex()
+        offset = 0
+        while True:
+            page = collection.get(
+                include=["documents"],
+                limit=page_size,
+                offset=offset
+            )
+            if not page['ids']:
+                break
+            for doc_id, doc in zip(page['ids'], page['documents']):
+                keyword_index.add(doc_id, doc or "")
+            offset += len(page['ids'])
+        return keyword_index
+    
+    def _version_path(self) -> str:
+        return os.path.join(self.config.CHROMA_PERSIST_DIRECTORY, self.VERSION_FILE)
+    
+    def _read_kb_version(self) -> str:
+        if self.snapshot_mode:
+            return kb_snapshot.current_version(self.config.KB_SNAPSHOT_DIR) or ""
+        try:
+            with open(self._version_path(), encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ""
+    
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(
+                f"当前进程的知识库为只读（CHROMA_ROLE={self.config.CHROMA_ROLE}），请在 writer 进程中写入"
+            )
+    
+    def _mark_updated(self):
+        """写入后更新版本标记（先写临时文件再替换，reader 不会读到半个文件）"""
+        self._knowledge_count = None
+        self._kb_version = str(time.time_ns())
+        path = self._version_path()
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self._kb_version)
+        os.replace(path + ".tmp", path)
+    
+    def refresh_if_stale(self) -> bool:
+        """reader：距上次检查超过 CHROMA_REFRESH_SECONDS 且 writer 已更新时重新加载，返回是否重新加载
+        
+        writer 同样按间隔检查注册表：执行 embedding_registry.py 提交的命令，其他进程切换集合后跟随切换；
+        快照模式由后台线程切换版本，检索路径上不做检查
+        """
+        if self.snapshot_mode:
+            return False
+        now = time.monotonic()
+        if now - self._last_refresh_check < self.config.CHROMA_REFRESH_SECONDS:
+            return False
+        
+        with self._refresh_lock:
+            if now - self._last_refresh_check < self.config.CHROMA_REFRESH_SECONDS:
+                return False
+            self._last_refresh_check = now
+            if not self.read_only:
+                switched = self._run_registry_command()
+                return self._follow_registry() or switched
+            version = self._read_kb_version()
+            if version == self._kb_version:
+                return False
+            self.refresh()
+            self._kb_version = version
+            return True
+    
+    def refresh(self, active: Tuple[str, str] = None):
+        """重新打开集合并重建内存中的索引，使 writer 进程的写入可见
+        
+        其他进程的写入不会出现在已加载的HNSW索引中，因此打开新的客户端；注册表切换到新模型时
+        先加载新模型；新索引构建完成后才替换，检索不会看到中间状态。
+        被替换的 System 延后到下一次重新加载时停止，正在旧集合上执行的检索不受影响
+        active: 要打开的 (集合名, 模型)，默认读取注册表
+        """
+        name, model = active or self.registry.active()
+        encoder = self._encoder_for(model)
+        client, system = open_chroma_client(self.config.CHROMA_PERSIST_DIRECTORY)
+        collection = self._get_collection(name, client)
+        keyword_index = self._build_keyword_index(collection)
+        _, document_encoder = self._document_encoder_for(model, encoder)
+        quantized_store = self._open_quantized_store(name, collection, document_encoder)
+        
+        stop_chroma_system(self._retired_system)
+        self._retired_system = self._chroma_system
+        self.client, self._chroma_system = client, system
+        self.keyword_index = keyword_index
+        self._install_collection(name, model, collection, encoder, quantized_store)
+    
+    def _run_registry_command(self) -> bool:
+        """writer：执行 embedding_registry.py 提交的命令，返回是否切换了集合（重建在后台线程执行）"""
+        command = self.registry.take_command()
+        if command is None:
+            return False
+        try:
+            if command["command"] == "reindex":
+                self.start_reindex(command["model"], command.get("batch_size"), command.get("activate", False))
+                return False
+            if command["command"] == "dedup":
+                self.start_dedup(command.get("threshold"), command.get("block_size"))
+                return False
+            if command["command"] == "export_snapshot":
+                print(f"📦 已导出知识库快照：{self.export_snapshot(command.get('directory'))}")
+                return False
+            if command["command"] == "rollback":
+                self.rollback()
+            else:
+                self.activate_collection(
+                    self.registry.collection_for(command["model"], self.config.EMBEDDING_QUANTIZATION)
+                )
+            print(f"✓ 已执行 {command['command']}，当前集合 {self.collection_name}（{self.embedding_model_name}）")
+            if self.config.KB_SNAPSHOT_EXPORT:
+                self.export_snapshot()
+            return True
+        except Exception as e:
+            print(f"⚠️ 执行 {command['command']} 失败: {e}")
+            return False
+    
+    def _follow_registry(self) -> bool:
+        """writer：注册表的当前集合与本进程不同（其他进程切换或回滚）时跟随切换，返回是否切换"""
+        active = self.registry.active()
+        if active == (self.collection_name, self.embedding_model_name):
+            return False
+        with self._write_lock:
+            self.refresh(active)
+            self._kb_version = self._read_kb_version()
+        print(f"✓ 已跟随切换到集合 {active[0]}（{active[1]}）")
+        return True
+    
+    def refresh_snapshot(self) -> bool:
+        """快照模式：CURRENT 指向新版本时加载并切换，返回是否切换
+        
+        新快照及其关键词索引、量化存储全部在当前线程构建完成后才替换引用，
+        检索线程不等待加载，始终使用某个完整版本的数据
+        """
+        with self._refresh_lock:
+            version = self._read_kb_version()
+            if not version or version == self._kb_version:
+                return False
+            collection = self._load_snapshot(version)
+            # 新快照换了嵌入模型（writer 切换了集合）时先加载新模型
+            model = collection.manifest.get("model") or self.config.EMBEDDING_MODEL
+            encoder = self._encoder_for(model)
+            keyword_index = self._build_keyword_index(collection)
+            quantized_store = self._open_quantized_store(None, collection)
+            
+            self.keyword_index = keyword_index
+            self._install_collection(None, model, collection, encoder, quantized_store)
+            self._kb_version = version
+            return True
+    
+    def _load_snapshot(self, version: str = None):
+        return kb_snapshot.load_snapshot(self.config.KB_SNAPSHOT_DIR, version)
+    
+    def _watch_snapshots(self):
+        while not self._snapshot_stop.wait(self.config.CHROMA_REFRESH_SECONDS):
+            try:
+                if self.refresh_snapshot():
+                    print(f"✓ 已切换到知识库快照 {self._kb_version}（{self.collection.count()} 条文档）")
+            except Exception as e:
+                # 快照损坏或被清理时继续使用当前版本，下次检查再试
+                print(f"⚠️ 加载知识库快照失败: {e}")
+    
+    def _snapshot_kb_version(self) -> Optional[str]:
+        """最新快照导出时 writer 的版本标记"""
+        version = kb_snapshot.current_version(self.config.KB_SNAPSHOT_DIR)
+        if version is None:
+            return None
+        try:
+            with open(os.path.join(self.config.KB_SNAPSHOT_DIR, version, kb_snapshot.MANIFEST_FILE),
+                      encoding="utf-8") as f:
+                return json.load(f).get("kb_version")
+        except (OSError, ValueError):
+            return None
+    
+    def export_snapshot(self, directory: str = None) -> str:
+        """把当前集合导出为新的只读快照（供 CHROMA_ROLE=snapshot 的服务进程加载），返回版本号"""
+        if self.snapshot_mode:
+            raise RuntimeError("快照模式的进程不能导出快照")
+        return kb_snapshot.export_snapshot(
+            self.collection,
+            directory or self.config.KB_SNAPSHOT_DIR,
+            model=self.embedding_model_name,
+            kb_version=self._kb_version,
+            vectors=self.get_embeddings if self.quantized_store is not None else None
+        )
+    
+    def _quantization(self, name: Optional[str]) -> str:
+        """集合的向量存储方式；快照模式按 EMBEDDING_QUANTIZATION 在内存中构建量化存储"""
+        if self.snapshot_mode:
+            return self.config.EMBEDDING_QUANTIZATION
+        return self.registry.quantization(name)
+    
+    def _quantized_store_directory(self, name: str) -> str:
+        return os.path.join(self.config.CHROMA_PERSIST_DIRECTORY, f"vectors_{name}")
+    
+    def _open_quantized_store(self, name: Optional[str], collection,
+                              document_encoder=None) -> Optional[QuantizedVectorStore]:
+        """打开量化集合的向量存储（float32 集合返回 None）
+        
+        存储中的ID与集合不一致时（writer 写入 Chroma 后、写入存储前退出），writer 补齐缺少的向量、
+        删除多出的向量，只读进程给出警告；document_encoder 默认为当前的文档编码器
+        """
+        quantization = self._quantization(name)
+        if quantization == "none":
+            return None
+        if self.snapshot_mode:
+            return self._build_quantized_store(collection, quantization)
+        
+        store = QuantizedVectorStore.open(
+            self._quantized_store_directory(name), dtype=quantization, read_only=self.read_only
+        )
+        collection_ids = self._collection_ids(collection)
+        store_ids = set(store.ids)
+        missing = [doc_id for doc_id in collection_ids if doc_id not in store_ids]
+        extra = list(store_ids.difference(collection_ids))
+        if not missing and not extra:
+            return store
+        if self.read_only:
+            print(f"⚠️ 集合 {name} 的量化存储缺少 {len(missing)} 条、多出 {len(extra)} 条向量，"
+                  f"缺少的文档检索不到，writer 重新打开时修复")
+            return store
+        
+        document_encoder = document_encoder or self.document_encoder
+        batch_size = self.config.EMBEDDING_REINDEX_BATCH_SIZE
+        for start in range(0, len(missing), batch_size):
+            page = collection.get(ids=missing[start:start + batch_size], include=["documents"])
+            store.add(page['ids'], self._encode(page['documents'], document_encoder))
+        store.remove(extra)
+        # 让已打开不一致存储的 reader 重新加载
+        self._mark_updated()
+        print(f"✓ 已修复集合 {name} 的量化存储：补齐 {len(missing)} 条、删除 {len(extra)} 条向量")
+        return store
+    
+    def _build_quantized_store(self, collection, quantization: str,
+                               page_size: int = 1000) -> QuantizedVectorStore:
+        """快照模式：从内存快照的向量构建量化存储（不写文件，重排使用快照中的向量）"""
+        store = QuantizedVectorStore(dtype=quantization)
+        offset = 0
+        while True:
+            page = collection.get(
+                include=["embeddings"],
+                limit=page_size,
+                offset=offset
+            )
+            if not page['ids']:
+                break
+            store.add(page['ids'], page['embeddings'])
+            offset += len(page['ids'])
+        return store
+    
+    @staticmethod
+    def _chroma_embeddings(embeddings: np.ndarray, quantized: bool) -> List[List[float]]:
+        """写入 Chroma 的向量：量化集合的向量在量化存储中，Chroma 只保存 1 维占位向量"""
+        if quantized:
+            return [[0.0]] * len(embeddings)
+        return embeddings.tolist()
+    
+    def get_embeddings(self, doc_ids: List[str]) -> np.ndarray:
+        """按 doc_ids 顺序取回 float32 文档向量（量化集合从量化存储读取）"""
+        collection, _, _, quantized_store = self._search_state()
+        if quantized_store is not None and quantized_store.directory is not None:
+            return quantized_store.originals(doc_ids)
+        results = collection.get(ids=doc_ids, include=["embeddings"])
+        found = dict(zip(results['ids'], results['embeddings']))
+        return np.asarray([found[doc_id] for doc_id in doc_ids], dtype=np.float32)
+    
+    def _encode(self, texts: List[str], encoder=None) -> np.ndarray:
+        """批量编码文本，返回 float32 矩阵"""
+        return np.asarray(
+            (encoder or self.embedding_model).encode(texts, batch_size=32),
+            dtype=np.float32
+        )
+    
+    def _encode_documents(self, texts: List[str]) -> np.ndarray:
+        """编码知识库文档（经过持久化缓存，只有新文本才调用模型）"""
+        return self._encode(texts, self.document_encoder)
+    
+    def encode_query(self, query: str) -> np.ndarray:
+        """编码单条查询（带LRU缓存，同一消息的后续检索不会重复编码）"""
+        return self._encode_queries([query])[0]
+    
+    def _encode_queries(self, queries: List[str], encoder=None, model: str = None) -> np.ndarray:
+        """批量编码查询，命中缓存的查询跳过模型计算（缓存按模型区分，切换模型后不会取到旧向量）"""
+        if encoder is None:
+            _, encoder, model, _ = self._search_state()
+        cache = self._query_embedding_cache
+        cached = {}
+        with self._query_cache_lock:
+            for query in queries:
+                if (model, query) in cache:
+                    cache.move_to_end((model, query))
+                    cached[query] = cache[(model, query)]
+        
+        missing = list(dict.fromkeys(q for q in queries if q not in cached))
+        if missing:
+            for query, embedding in zip(missing, self._encode(missing, encoder)):
+                cached[query] = embedding
+            with self._query_cache_lock:
+                for query in missing:
+                    cache[(model, query)] = cached[query]
+                while len(cache) > self.config.QUERY_EMBEDDING_CACHE_SIZE:
+                    cache.popitem(last=False)
+        
+        return np.stack([cached[query] for query in queries])
     
     def _load_initial_knowledge(self):
         """加载初始知识库"""
@@ -96,86 +702,463 @@ class RAGSystem:
         
         self.add_knowledge_batch(initial_knowledge)
     
+    @staticmethod
+    def _new_doc_ids(n: int) -> List[str]:
+        """生成文档ID（随机，删除文档后按数量编号会与已有ID冲突）"""
+        return [f"doc_{uuid.uuid4().hex}" for _ in range(n)]
+    
     def add_knowledge(self, content: str, metadata: Dict = None) -> str:
         """添加单条知识到知识库"""
-        # 生成嵌入向量
-        embedding = self.embedding_model.encode(content).tolist()
-        
-        # 生成ID
-        doc_id = f"doc_{self.collection.count() + 1}"
-        
-        # 添加到集合
-        self.collection.add(
-            documents=[content],
-            embeddings=[embedding],
-            metadatas=[metadata or {}],
-            ids=[doc_id]
-        )
-        
-        return doc_id
+        self._check_writable()
+        with self._write_lock:
+            self._follow_registry()
+            # 生成嵌入向量
+            embedding = self._encode_documents([content])[0]
+            
+            doc_id = self._new_doc_ids(1)[0]
+            metadata = dict(metadata or {})
+            metadata.setdefault("created_at", time.time())
+            
+            # 添加到集合（量化集合的向量写入量化存储）
+            self.collection.add(
+                documents=[content],
+                embeddings=self._chroma_embeddings(embedding[None, :], self.quantized_store is not None),
+                metadatas=[metadata],
+                ids=[doc_id]
+            )
+            self.keyword_index.add(doc_id, content)
+            if self.quantized_store is not None:
+                self.quantized_store.add([doc_id], embedding)
+            self._mark_updated()
+            
+            return doc_id
     
     def add_knowledge_batch(self, knowledge_list: List[Dict]):
         """批量添加知识"""
-        documents = []
-        embeddings = []
-        metadatas = []
-        ids = []
-        
-        start_id = self.collection.count() + 1
-        
-        for idx, item in enumerate(knowledge_list):
-            content = item["content"]
-            metadata = {k: v for k, v in item.items() if k != "content"}
+        self._check_writable()
+        with self._write_lock:
+            self._follow_registry()
+            documents = []
+            metadatas = []
+            ids = self._new_doc_ids(len(knowledge_list))
+            created_at = time.time()
             
-            documents.append(content)
-            embeddings.append(self.embedding_model.encode(content).tolist())
-            metadatas.append(metadata)
-            ids.append(f"doc_{start_id + idx}")
-        
-        self.collection.add(
-            documents=documents,
-            embeddings=embeddings,
-            metadatas=metadatas,
-            ids=ids
-        )
+            for item in knowledge_list:
+                content = item["content"]
+                metadata = {k: v for k, v in item.items() if k != "content"}
+                metadata.setdefault("created_at", created_at)
+                
+                documents.append(content)
+                metadatas.append(metadata)
+            
+            # 一次前向计算编码整批文本
+            embeddings = self._encode_documents(documents)
+            
+            self.collection.add(
+                documents=documents,
+                embeddings=self._chroma_embeddings(embeddings, self.quantized_store is not None),
+                metadatas=metadatas,
+                ids=ids
+            )
+            for doc_id, content in zip(ids, documents):
+                self.keyword_index.add(doc_id, content)
+            if self.quantized_store is not None:
+                # 只追加本批的向量，不重写已有数据
+                self.quantized_store.add(ids, embeddings)
+            self._mark_updated()
+    
+    def delete_documents(self, doc_ids: List[str], batch_size: int = 500) -> int:
+        """按ID分批删除文档（同步维护关键词索引和量化存储），返回请求删除的数量"""
+        self._check_writable()
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return 0
+        with self._write_lock:
+            self._follow_registry()
+            for start in range(0, len(doc_ids), batch_size):
+                batch = doc_ids[start:start + batch_size]
+                self.collection.delete(ids=batch)
+                for doc_id in batch:
+                    self.keyword_index.remove(doc_id)
+                if self.quantized_store is not None:
+                    self.quantized_store.remove(batch)
+            self._mark_updated()
+        return len(doc_ids)
     
-    def retrieve(self, query: str, top_k: int = None) -> List[Dict]:
-        """检索相关知识"""
+    def retrieve(self, query: str, top_k: int = None,
+                 mode: str = None, emotions: List[str] = None) -> List[Dict]:
+        """检索相关知识
+        
+        mode: "vector" 纯向量检索，"keyword" 纯BM25检索，
+              "hybrid" 两者按倒数排名融合（RRF）
+        emotions: 本轮检测到的情绪，启用重排时用于类别匹配
+        """
+        if mode is None:
+            mode = self.config.RAG_RETRIEVAL_MODE
+        if mode not in self.RETRIEVAL_MODES:
+            raise ValueError(f"未知的检索模式: {mode}")
+        self.refresh_if_stale()
+        
+        if self.reranker is None:
+            return self._retrieve(query, self.config.RAG_TOP_K if top_k is None else top_k, mode)
+        
+        # 召回较大的候选池，重排后只保留最好的几篇
         if top_k is None:
-            top_k = self.config.RAG_TOP_K
+            top_k = self.config.RAG_RERANK_TOP_K
+        candidates = self._retrieve(query, max(self.config.RAG_RERANK_POOL, top_k), mode)
+        return self.reranker.rerank(query, candidates, top_k, emotions, self.keyword_index)
+    
+    def _retrieve(self, query: str, top_k: int, mode: str) -> List[Dict]:
+        """按检索模式召回 top_k 篇"""
+        if mode == "vector":
+            return self._vector_search(query, top_k)
+        
+        if mode == "keyword":
+            keyword_hits = self.keyword_index.search(query, top_k)
+            docs = self._fetch_documents([doc_id for doc_id, _ in keyword_hits])
+            for doc, (_, score) in zip(docs, keyword_hits):
+                doc['score'] = score
+            return docs
+        
+        # 混合检索：扩大候选池，再用RRF融合两路排名
+        candidate_k = top_k * self.config.RAG_CANDIDATE_MULTIPLIER
+        vector_docs = self._vector_search(query, candidate_k)
+        keyword_hits = self.keyword_index.search(query, candidate_k)
+        
+        rrf_k = self.config.RAG_RRF_K
+        fused_scores = {}
+        for rank, doc in enumerate(vector_docs, 1):
+            fused_scores[doc['id']] = fused_scores.get(doc['id'], 0.0) + 1.0 / (rrf_k + rank)
+        for rank, (doc_id, _) in enumerate(keyword_hits, 1):
+            fused_scores[doc_id] = fused_scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+        
+        ranked_ids = sorted(fused_scores, key=fused_scores.get, reverse=True)[:top_k]
+        
+        # 仅被关键词命中的文档需要补取内容
+        docs_by_id = {doc['id']: doc for doc in vector_docs}
+        missing_ids = [doc_id for doc_id in ranked_ids if doc_id not in docs_by_id]
+        for doc in self._fetch_documents(missing_ids):
+            docs_by_id[doc['id']] = doc
+        
+        retrieved_docs = []
+        for doc_id in ranked_ids:
+            if doc_id not in docs_by_id:
+                # 检索期间知识库切换到新版本，旧版本的命中在新版本中已不存在
+                continue
+            doc = docs_by_id[doc_id]
+            doc['score'] = fused_scores[doc_id]
+            retrieved_docs.append(doc)
+        
+        return retrieved_docs
+    
+    def _vector_search(self, query: str, top_k: int) -> List[Dict]:
+        """向量相似度检索"""
+        if self.query_coalescer is not None:
+            # 与其他线程的并发查询合并为一次批量编码和检索
+            return self.query_coalescer.submit((query, top_k))
+        return self._vector_search_batch([(query, top_k)])[0]
+    
+    def _vector_search_batch(self, requests: List[Tuple[str, int]]) -> List[List[Dict]]:
+        """批量向量检索：一次前向计算编码全部查询，一次集合查询取回结果"""
+        queries = [query for query, _ in requests]
+        top_ks = [top_k for _, top_k in requests]
         
-        # 生成查询向量
-        query_embedding = self.embedding_model.encode(query).tolist()
+        # 生成查询向量（集合与编码器一次取出，切换模型期间不会混用）
+        collection, encoder, model, quantized_store = self._search_state()
+        query_embeddings = self._encode_queries(queries, encoder, model)
         
-        # 检索
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k
+        if quantized_store is not None:
+            return [self._quantized_search(embedding, top_k, collection, quantized_store)
+                    for embedding, top_k in zip(query_embeddings, top_ks)]
+        
+        # 检索（按最大的 top_k 取回，再按各自的 top_k 截断）
+        results = collection.query(
+            query_embeddings=query_embeddings.tolist(),
+            n_results=max(top_ks)
         )
         
         # 格式化结果
+        batch_docs = []
+        for q, top_k in enumerate(top_ks):
+            retrieved_docs = []
+            if results['documents'] and results['documents'][q]:
+                for idx, doc in enumerate(results['documents'][q][:top_k]):
+                    retrieved_docs.append({
+                        'id': results['ids'][q][idx],
+                        'content': doc,
+                        'metadata': results['metadatas'][q][idx] if results['metadatas'] else {},
+                        'distance': results['distances'][q][idx] if results['distances'] else 0
+                    })
+            batch_docs.append(retrieved_docs)
+        
+        return batch_docs
+    
+    def _quantized_search(self, query_embedding: np.ndarray, top_k: int,
+                          collection=None, quantized_store=None) -> List[Dict]:
+        """量化向量首轮检索，再用 float32 原始向量对候选重排
+        
+        原始向量从量化存储的内存映射文件读取，只读入候选行；快照模式从内存快照读取
+        """
+        collection = self.collection if collection is None else collection
+        quantized_store = self.quantized_store if quantized_store is None else quantized_store
+        candidates = quantized_store.search(
+            query_embedding,
+            top_k * self.config.QUANTIZED_RERANK_MULTIPLIER
+        )
+        if not candidates:
+            return []
+        
+        candidate_ids = [doc_id for doc_id, _ in candidates]
+        vectors = quantized_store.originals(candidate_ids)
+        include = ["documents", "metadatas"] if vectors is not None else ["documents", "metadatas", "embeddings"]
+        results = collection.get(ids=candidate_ids, include=include)
+        if not results['ids']:
+            return []
+        if vectors is None:
+            vectors = np.asarray(results['embeddings'], dtype=np.float32)
+        else:
+            # 集合按自己的顺序返回，且不含写入期间已删除的文档
+            rows = {doc_id: row for row, doc_id in enumerate(candidate_ids)}
+            vectors = vectors[[rows[doc_id] for doc_id in results['ids']]]
+        diffs = vectors - query_embedding
+        distances = np.einsum("ij,ij->i", diffs, diffs)
+        
         retrieved_docs = []
-        if results['documents'] and results['documents'][0]:
-            for idx, doc in enumerate(results['documents'][0]):
-                retrieved_docs.append({
-                    'content': doc,
-                    'metadata': results['metadatas'][0][idx] if results['metadatas'] else {},
-                    'distance': results['distances'][0][idx] if results['distances'] else 0
-                })
+        for idx in np.argsort(distances)[:top_k]:
+            retrieved_docs.append({
+                'id': results['ids'][idx],
+                'content': results['documents'][idx],
+                'metadata': results['metadatas'][idx] or {},
+                'distance': float(distances[idx])
+            })
         
         return retrieved_docs
     
+    def _fetch_documents(self, doc_ids: List[str]) -> List[Dict]:
+        """按ID批量取回文档（保持传入顺序）"""
+        if not doc_ids:
+            return []
+        
+        results = self.collection.get(
+            ids=doc_ids,
+            include=["documents", "metadatas"]
+        )
+        found = {
+            doc_id: (doc, meta)
+            for doc_id, doc, meta in zip(
+                results['ids'], results['documents'], results['metadatas']
+            )
+        }
+        
+        docs = []
+        for doc_id in doc_ids:
+            if doc_id in found:
+                doc, meta = found[doc_id]
+                docs.append({
+                    'id': doc_id,
+                    'content': doc,
+                    'metadata': meta or {},
+                    'distance': None
+                })
+        return docs
+    
     def get_knowledge_count(self) -> int:
-        """获取知识库中的文档数量"""
-        return self.collection.count()
+        """获取知识库中的文档数量（缓存，知识库变化时重新统计）"""
+        self.refresh_if_stale()
+        count = self._knowledge_count
+        if count is None:
+            count = self._knowledge_count = self.collection.count()
+        return count
     
     def clear_knowledge_base(self):
         """清空知识库"""
-        self.client.delete_collection("emotional_support_kb")
-        self.collection = self.client.get_or_create_collection(
-            name="emotional_support_kb",
-            metadata={"description": "大学生情绪支持知识库"}
-        )
+        self._check_writable()
+        with self._write_lock:
+            self._follow_registry()
+            self.client.delete_collection(self.collection_name)
+            collection = self._get_collection(self.collection_name)
+            with self._swap_lock:
+                self.collection = collection
+            self.keyword_index.clear()
+            if self.quantized_store is not None:
+                self.quantized_store.clear()
+            self._mark_updated()
+    
+    @staticmethod
+    def _collection_ids(collection, page_size: int = 1000) -> List[str]:
+        ids = []
+        while True:
+            page = collection.get(include=[], limit=page_size, offset=len(ids))
+            if not page['ids']:
+                return ids
+            ids.extend(page['ids'])
+    
+    def _sync_collection(self, source, target, document_encoder, batch_size: int = None,
+                         keyword_index: KeywordIndex = None,
+                         target_store: QuantizedVectorStore = None) -> Tuple[int, int]:
+        """让 target 与 source 的文档一致：缺少的文档用 target 的模型编码后写入（保持原ID），
+        多出的文档删除；返回 (写入数, 删除数)
+        
+        keyword_index: 同时更新的关键词索引（切换集合时使用）
+        target_store: target 为量化集合时的量化存储，向量写入其中
+        """
+        batch_size = batch_size or self.config.EMBEDDING_REINDEX_BATCH_SIZE
+        source_ids = self._collection_ids(source)
+        target_ids = set(self._collection_ids(target))
+        missing = [doc_id for doc_id in source_ids if doc_id not in target_ids]
+        extra = list(target_ids - set(source_ids))
+        
+        for start in range(0, len(missing), batch_size):
+            page = source.get(ids=missing[start:start + batch_size], include=["documents", "metadatas"])
+            if not page['ids']:
+                continue  # 读取期间已被删除
+            embeddings = self._encode(page['documents'], document_encoder)
+            target.add(
+                documents=page['documents'],
+                embeddings=self._chroma_embeddings(embeddings, target_store is not None),
+                metadatas=page['metadatas'],
+                ids=page['ids']
+            )
+            if target_store is not None:
+                target_store.add(page['ids'], embeddings)
+            if keyword_index is not None:
+                for doc_id, content in zip(page['ids'], page['documents']):
+                    keyword_index.add(doc_id, content or "")
+        for start in range(0, len(extra), batch_size):
+            target.delete(ids=extra[start:start + batch_size])
+        if target_store is not None:
+            target_store.remove(extra)
+        if keyword_index is not None:
+            for doc_id in extra:
+                keyword_index.remove(doc_id)
+        return len(missing), len(extra)
+    
+    def reindex(self, model: str, batch_size: int = None, encoder=None, activate: bool = False) -> str:
+        """用嵌入模型 model 把当前集合的全部文档重新编码到该模型的集合，返回集合名
+        
+        当前集合在此期间照常检索和写入，构建期间的写入在切换时同步；
+        encoder: 可选的编码器实例，为空时按配置创建；activate=True 时完成后立即切换
+        """
+        self._check_writable()
+        if encoder is not None:
+            self._encoders[model] = encoder
+        encoder = self._encoder_for(model)
+        quantization = self.config.EMBEDDING_QUANTIZATION
+        name = self.registry.collection_for(model, quantization)
+        if name == self.collection_name:
+            raise ValueError(f"集合 {name} 正在服务，不能重建")
+        
+        self.registry.update(name, model=model, quantization=quantization, status="building", count=0)
+        target_store = None
+        try:
+            try:
+                self.client.delete_collection(name)
+            except Exception:
+                pass  # 集合不存在
+            target = self._get_collection(name)
+            if quantization != "none":
+                target_store = QuantizedVectorStore.open(self._quantized_store_directory(name), dtype=quantization)
+                target_store.clear()
+            _, document_encoder = self._document_encoder_for(model, encoder)
+            self._sync_collection(self.collection, target, document_encoder, batch_size,
+                                  target_store=target_store)
+        except Exception:
+            self.registry.update(name, status="failed")
+            raise
+        finally:
+            if target_store is not None:
+                target_store.close()
+        self.registry.update(name, status="ready", count=target.count())
+        
+        if activate:
+            self.activate_collection(name)
+        return name
+    
+    def start_reindex(self, model: str, batch_size: int = None, activate: bool = True) -> threading.Thread:
+        """在后台线程中重建索引（完成后默认切换），返回线程"""
+        def run():
+            try:
+                name = self.reindex(model, batch_size=batch_size, activate=activate)
+                print(f"✓ 已用 {model} 重建集合 {name}")
+                if activate and self.config.KB_SNAPSHOT_EXPORT:
+                    self.export_snapshot()
+            except Exception as e:
+                print(f"⚠️ 用 {model} 重建索引失败: {e}")
+        
+        thread = threading.Thread(target=run, name="kb-reindex", daemon=True)
+        thread.start()
+        return thread
+    
+    def start_dedup(self, threshold: float = None, block_size: int = None) -> threading.Thread:
+        """在后台线程中对知识库去重（kb_maintenance.py 提交的命令），返回线程"""
+        def run():
+            try:
+                report = KnowledgeDeduplicator(self, threshold=threshold, block_size=block_size).run()
+                print_report(report)
+                print(f"✓ 已删除 {report['deleted']} 篇重复文档，剩余 {self.get_knowledge_count()} 篇")
+                if report["deleted"] and self.config.KB_SNAPSHOT_EXPORT:
+                    self.export_snapshot()
+            except Exception as e:
+                print(f"⚠️ 知识库去重失败: {e}")
+        
+        thread = threading.Thread(target=run, name="kb-dedup", daemon=True)
+        thread.start()
+        return thread
+    
+    def activate_collection(self, name: str) -> str:
+        """切换到已构建完成的集合，返回之前的集合名
+        
+        新模型在锁外加载；写锁内先把当前集合在构建期间的写入和删除同步过去，再原子替换注册表，
+        之后再同步一次（其他进程在此之前写入旧集合的文档），最后替换检索引用。
+        其他进程在下一次检查时跟随切换
+        """
+        self._check_writable()
+        entry = self.registry.entry(name)
+        if entry is None or entry.get("status") != "ready":
+            raise ValueError(f"集合 {name} 未构建完成，不能切换")
+        model = entry["model"]
+        encoder = self._encoder_for(model)
+        
+        with self._write_lock:
+            source = self.collection
+            target = self._get_collection(name)
+            _, document_encoder = self._document_encoder_for(model, encoder)
+            quantized_store = self._open_quantized_store(name, target, document_encoder)
+            self._sync_collection(source, target, document_encoder, keyword_index=self.keyword_index,
+                                  target_store=quantized_store)
+            previous = self.registry.activate(name)
+            self._sync_collection(source, target, document_encoder, keyword_index=self.keyword_index,
+                                  target_store=quantized_store)
+            self.registry.update(name, count=target.count())
+            
+            self._install_collection(name, model, target, encoder, quantized_store)
+            with self._query_cache_lock:
+                self._query_embedding_cache.clear()
+            self._mark_updated()
+        return previous
+    
+    def rollback(self) -> str:
+        """切回上一个集合（同样先同步切换后的写入），返回回滚前的集合名"""
+        previous = self.registry.load().get("previous")
+        if not previous:
+            raise ValueError("没有可回滚的集合")
+        return self.activate_collection(previous)
+    
+    def close(self):
+        """释放资源（量化存储每次写入时已追加到文件，这里只关闭文件）"""
+        self._snapshot_stop.set()
+        if self.query_coalescer is not None:
+            self.query_coalescer.close()
+        if self.quantized_store is not None:
+            self.quantized_store.close()
+        for cache in self._embedding_caches.values():
+            cache.close()
+        stop_chroma_system(self._retired_system)
+        stop_chroma_system(self._chroma_system)
+        self._retired_system = self._chroma_system = None
+        if self._holds_writer_lock:
+            release_writer_lock(self.registry.directory)
+            self._holds_writer_lock = False
 
 
 class KnowledgeEnricher:
@@ -0,0 +1,107 @@
+"""
+检索结果重排
+先召回较大的候选池，再用几种廉价信号的加权和重新排序，只把最好的几篇交给提示词：
+- vector：向量距离（候选池内归一化到 0~1）
+- keyword：与查询的 BM25 分数（按池内最大值归一化）
+- category：文档类别 / 情绪与本轮检测到的情绪是否一致
+- feedback：学习案例的反馈评分（人工整理的知识没有评分，按良好处理）
+- recency：写入时间的指数衰减（没有写入时间的文档取中间值）
+
+信号按开销从低到高计算，超过时间预算后跳过剩余信号，只用已计算的信号排序
+"""
+from typing import Dict, List
+import time
+import numpy as np
+from config import Config
+
+
+class Reranker:
+    """候选文档重排器"""
+    
+    WEIGHTS = {"vector": 0.45, "keyword": 0.2, "category": 0.15, "feedback": 0.1, "recency": 0.1}
+    DEFAULT_FEEDBACK_SCORE = 4.0
+    
+    def __init__(self, weights: Dict[str, float] = None, budget_ms: float = None,
+                 recency_half_life_days: float = None):
+        self.weights = dict(weights or self.WEIGHTS)
+        self.budget_ms = Config.RAG_RERANK_BUDGET_MS if budget_ms is None else budget_ms
+        self.recency_half_life_days = recency_half_life_days or Config.RAG_RERANK_RECENCY_HALF_LIFE_DAYS
+    
+    def _vector(self, docs: List[Dict], query: str, emotions: List[str], keyword_index) -> np.ndarray:
+        distances = np.array([np.nan if doc.get("distance") is None else doc["distance"] for doc in docs])
+        known = ~np.isnan(distances)
+        scores = np.zeros(len(docs))
+        if known.any():
+            low, high = distances[known].min(), distances[known].max()
+            scores[known] = 1.0 if high == low else (high - distances[known]) / (high - low)
+        return scores
+    
+    def _category(self, docs: List[Dict], query: str, emotions: List[str], keyword_index) -> np.ndarray:
+        wanted = set(emotions or ())
+        scores = np.zeros(len(docs))
+        if not wanted:
+            return scores
+        for i, doc in enumerate(docs):
+            metadata = doc.get("metadata") or {}
+            # 学习案例的 emotions 可能是列表或逗号分隔的字符串
+            tags = metadata.get("emotions") or []
+            if isinstance(tags, str):
+                tags = tags.replace("，", ",").split(",")
+            if metadata.get("category") in wanted or wanted & {tag.strip() for tag in tags}:
+                scores[i] = 1.0
+        return scores
+    
+    def _feedback(self, docs: List[Dict], query: str, emotions: List[str], keyword_index) -> np.ndarray:
+        scores = np.array([
+            float((doc.get("metadata") or {}).get("feedback_score") or self.DEFAULT_FEEDBACK_SCORE)
+            for doc in docs
+        ])
+        return np.clip((scores - 1.0) / 4.0, 0.0, 1.0)
+    
+    def _recency(self, docs: List[Dict], query: str, emotions: List[str], keyword_index) -> np.ndarray:
+        created = np.array([
+            np.nan if (doc.get("metadata") or {}).get("created_at") is None
+            else float(doc["metadata"]["created_at"])
+            for doc in docs
+        ])
+        age_days = np.maximum(time.time() - created, 0.0) / 86400.0
+        scores = np.power(0.5, age_days / self.recency_half_life_days)
+        return np.where(np.isnan(scores), 0.5, scores)
+    
+    def _keyword(self, docs: List[Dict], query: str, emotions: List[str], keyword_index) -> np.ndarray:
+        if keyword_index is None:
+            return np.zeros(len(docs))
+        scores = np.asarray(keyword_index.score(query, [doc["id"] for doc in docs]), dtype=np.float64)
+        top = scores.max() if len(scores) else 0.0
+        return scores / top if top > 0 else scores
+    
+    # 按开销从低到高：前四个只读元数据，BM25 需要对每篇候选查词频
+    SIGNALS = (("vector", _vector), ("category", _category), ("feedback", _feedback),
+               ("recency", _recency), ("keyword", _keyword))
+    
+    def rerank(self, query: str, docs: List[Dict], top_k: int, emotions: List[str] = None,
+               keyword_index=None) -> List[Dict]:
+        """对候选重新打分，返回前 top_k 篇（doc['score'] 为重排分数）"""
+        if not docs:
+            return []
+        deadline = time.perf_counter() + self.budget_ms / 1000.0
+        total = np.zeros(len(docs))
+        weight_sum = 0.0
+        for name, signal in self.SIGNALS:
+            weight = self.weights.get(name, 0.0)
+            if not weight:
+                continue
+            if weight_sum and time.perf_counter() > deadline:
+                break
+            total += weight * signal(self, docs, query, emotions, keyword_index)
+            weight_sum += weight
+        
+        total /= weight_sum or 1.0
+        # 稳定排序：分数相同时保持原召回顺序
+        order = np.argsort(-total, kind="stable")[:top_k]
+        ranked = []
+        for i in order:
+            doc = docs[i]
+            doc["score"] = float(total[i])
+            ranked.append(doc)
+        return ranked
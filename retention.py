@@ -0,0 +1,254 @@
+"""
+数据保留与压缩
+控制 conversations / emotion_trends 热表的规模：
+- 超过保留期的对话归档到 gzip 压缩的 JSONL 文件后删除
+- 超过保留期的情绪记录汇总到 emotion_trend_daily 日汇总表后删除
+- 删除按小批量进行，每批一个短事务，避免长时间锁表
+- 完成后执行 ANALYZE，空闲页占比较高时再执行 VACUUM 回收空间
+
+用法：
+    python retention.py --dry-run
+    python retention.py --conversation-days 180 --emotion-days 30
+"""
+from datetime import datetime, timedelta
+from typing import Dict
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from config import Config
+from data_system import Conversation, EmotionTrend, EmotionTrendDaily, create_db_engine
+from migrations import migrate
+
+
+def _serialize(row: Conversation) -> Dict:
+    record = {}
+    for column in Conversation.__table__.columns:
+        value = getattr(row, column.name)
+        record[column.name] = value.isoformat() if isinstance(value, datetime) else value
+    return record
+
+
+class RetentionManager:
+    """保留策略执行器"""
+    
+    def __init__(self, database_url: str = None, archive_dir: str = None,
+                 batch_size: int = None, pause_ms: float = 10.0):
+        self.config = Config()
+        self.engine = create_db_engine(database_url or self.config.DATABASE_URL)
+        migrate(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.archive_dir = archive_dir or self.config.RETENTION_ARCHIVE_DIR
+        self.batch_size = batch_size or self.config.RETENTION_BATCH_SIZE
+        self.pause_ms = pause_ms  # 批次之间让出数据库给线上写入
+    
+    def _pause(self):
+        if self.pause_ms:
+            time.sleep(self.pause_ms / 1000.0)
+    
+    def count_expired(self, conversation_days: int, emotion_days: int) -> Dict:
+        """统计超过保留期的行数（不做任何修改）"""
+        session = self.Session()
+        try:
+            return {
+                "conversations": session.query(Conversation).filter(
+                    Conversation.timestamp < datetime.now() - timedelta(days=conversation_days)
+                ).count(),
+                "emotion_trends": session.query(EmotionTrend).filter(
+                    EmotionTrend.timestamp < datetime.now() - timedelta(days=emotion_days)
+                ).count()
+            }
+        finally:
+            session.close()
+    
+    def archive_conversations(self, older_than_days: int) -> Dict:
+        """把旧对话写入 gzip 归档后分批删除
+
+        每批先写入并刷新归档文件再删除对应行；若在两步之间中断，下次运行会重复归档该批（至少一次）。
+        """
+        cutoff = datetime.now() - timedelta(days=older_than_days)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(
+            self.archive_dir,
+            f"conversations-{datetime.now().strftime('%Y%m%dT%H%M%S')}.jsonl.gz"
+        )
+        
+        archived = 0
+        archive = None
+        try:
+            while True:
+                session = self.Session()
+                try:
+                    rows = session.query(Conversation).filter(
+                        Conversation.timestamp < cutoff
+                    ).order_by(Conversation.id).limit(self.batch_size).all()
+                    if not rows:
+                        break
+                    
+                    if archive is None:
+                        archive = gzip.open(path, "at", encoding="utf-8")
+                    for row in rows:
+                        archive.write(json.dumps(_serialize(row), ensure_ascii=False))
+                        archive.write("\n")
+                    archive.flush()
+                    
+                    ids = [row.id for row in rows]
+                    session.query(Conversation).filter(
+                        Conversation.id.in_(ids)
+                    ).delete(synchronize_session=False)
+                    session.commit()
+                    archived += len(ids)
+                finally:
+                    session.close()
+                self._pause()
+        finally:
+            if archive is not None:
+                archive.close()
+        
+        return {"archived": archived, "archive_file": path if archived else None}
+    
+    def rollup_emotion_trends(self, older_than_days: int) -> Dict:
+        """把旧情绪记录按 (会话, 日期, 情绪) 累加到日汇总表，再删除原始行"""
+        cutoff = datetime.now() - timedelta(days=older_than_days)
+        rolled_up = 0
+        
+        while True:
+            session = self.Session()
+            try:
+                rows = session.query(EmotionTrend).filter(
+                    EmotionTrend.timestamp < cutoff
+                ).order_by(EmotionTrend.id).limit(self.batch_size).all()
+                if not rows:
+                    break
+                
+                counts = {}
+                for row in rows:
+                    key = (row.session_id, row.timestamp.strftime("%Y-%m-%d"), row.emotion)
+                    counts[key] = counts.get(key, 0) + 1
+                
+                # 汇总与删除在同一事务内完成
+                for (session_id, day, emotion), count in counts.items():
+                    daily = session.query(EmotionTrendDaily).filter_by(
+                        session_id=session_id, day=day, emotion=emotion
+                    ).first()
+                    if daily:
+                        daily.count += count
+                    else:
+                        session.add(EmotionTrendDaily(
+                            session_id=session_id, day=day, emotion=emotion, count=count
+                        ))
+                
+                ids = [row.id for row in rows]
+                session.query(EmotionTrend).filter(
+                    EmotionTrend.id.in_(ids)
+                ).delete(synchronize_session=False)
+                session.commit()
+                rolled_up += len(ids)
+            finally:
+                session.close()
+            self._pause()
+        
+        return {"rolled_up": rolled_up}
+    
+    def compact(self, vacuum_free_ratio: float = None, force_vacuum: bool = False) -> Dict:
+        """更新查询规划统计信息；SQLite空闲页占比超过阈值时执行VACUUM"""
+        if vacuum_free_ratio is None:
+            vacuum_free_ratio = self.config.RETENTION_VACUUM_FREE_RATIO
+        result = {"analyzed": False, "vacuumed": False, "free_ratio": None}
+        
+        # VACUUM 不能在事务内执行
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if self.engine.dialect.name == "sqlite":
+                page_count = conn.execute(text("PRAGMA page_count")).scalar() or 0
+                free_pages = conn.execute(text("PRAGMA freelist_count")).scalar() or 0
+                free_ratio = free_pages / page_count if page_count else 0.0
+                result["free_ratio"] = free_ratio
+                
+                conn.execute(text("ANALYZE"))
+                result["analyzed"] = True
+                if force_vacuum or free_ratio >= vacuum_free_ratio:
+                    conn.execute(text("VACUUM"))
+                    result["vacuumed"] = True
+            elif self.engine.dialect.name == "postgresql":
+                for table in (Conversation.__tablename__, EmotionTrend.__tablename__):
+                    conn.execute(text(f"VACUUM (ANALYZE) {table}"))
+                result["analyzed"] = result["vacuumed"] = True
+            else:
+                conn.execute(text("ANALYZE"))
+                result["analyzed"] = True
+        
+        return result
+    
+    def run(self, conversation_days: int = None, emotion_days: int = None) -> Dict:
+        """执行一次完整的保留策略"""
+        conversation_days = conversation_days or self.config.RETENTION_CONVERSATION_DAYS
+        emotion_days = emotion_days or self.config.RETENTION_EMOTION_TREND_DAYS
+        
+        summary = {
+            "conversations": self.archive_conversations(conversation_days),
+            "emotion_trends": self.rollup_emotion_trends(emotion_days)
+        }
+        summary["compaction"] = self.compact()
+        return summary
+    
+    def close(self):
+        self.engine.dispose()
+
+
+def start_retention_scheduler(interval_hours: float = None) -> threading.Thread:
+    """在后台线程按固定间隔执行保留策略"""
+    interval_hours = interval_hours or Config.RETENTION_INTERVAL_HOURS
+    
+    def loop():
+        while True:
+            manager = RetentionManager()
+            try:
+                summary = manager.run()
+                print(f"🧹 数据保留：归档 {summary['conversations']['archived']} 条对话，"
+                      f"汇总 {summary['emotion_trends']['rolled_up']} 条情绪记录")
+            except Exception as e:
+                print(f"数据保留任务失败: {e}")
+            finally:
+                manager.close()
+            time.sleep(interval_hours * 3600)
+    
+    thread = threading.Thread(target=loop, name="retention-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="归档并清理过期的聊天数据")
+    parser.add_argument("--conversation-days", type=int, default=Config.RETENTION_CONVERSATION_DAYS,
+                        help="对话保留天数")
+    parser.add_argument("--emotion-days", type=int, default=Config.RETENTION_EMOTION_TREND_DAYS,
+                        help="情绪原始记录保留天数")
+    parser.add_argument("--archive-dir", default=Config.RETENTION_ARCHIVE_DIR, help="归档目录")
+    parser.add_argument("--batch-size", type=int, default=Config.RETENTION_BATCH_SIZE, help="每批删除的行数")
+    parser.add_argument("--vacuum", action="store_true", help="无论空闲页占比如何都执行VACUUM")
+    parser.add_argument("--dry-run", action="store_true", help="只统计将被处理的行数")
+    args = parser.parse_args()
+    
+    manager = RetentionManager(archive_dir=args.archive_dir, batch_size=args.batch_size)
+    try:
+        if args.dry_run:
+            counts = manager.count_expired(args.conversation_days, args.emotion_days)
+            print(f"将归档 {counts['conversations']} 条对话，汇总 {counts['emotion_trends']} 条情绪记录")
+            return
+        
+        conversations = manager.archive_conversations(args.conversation_days)
+        print(f"✓ 归档 {conversations['archived']} 条对话 -> {conversations['archive_file'] or '无'}")
+        trends = manager.rollup_emotion_trends(args.emotion_days)
+        print(f"✓ 汇总 {trends['rolled_up']} 条情绪记录")
+        compaction = manager.compact(force_vacuum=args.vacuum)
+        print(f"✓ ANALYZE 完成，VACUUM: {'是' if compaction['vacuumed'] else '否'}")
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+危机风险快速筛查
+本地预编译短语自动机 + 与危机示例句的嵌入相似度，仅对命中的消息再调用LLM安全检查
+"""
+from collections import deque
+from typing import Dict, List
+import threading
+import numpy as np
+
+
+class PhraseAutomaton:
+    """多模式短语匹配自动机（Aho-Corasick），单次扫描找出全部命中短语"""
+    
+    def __init__(self, phrases: List[str]):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        
+        for phrase in phrases:
+            phrase = phrase.lower()
+            if not phrase:
+                continue
+            state = 0
+            for char in phrase:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(phrase)
+        
+        # 广度优先构建失败指针
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + \
+                    self._output[self._fail[next_state]]
+    
+    def find_all(self, text: str) -> List[str]:
+        """返回文本中出现的全部短语（去重，按首次出现顺序）"""
+        matches = []
+        state = 0
+        for char in text.lower():
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for phrase in self._output[state]:
+                if phrase not in matches:
+                    matches.append(phrase)
+        return matches
+
+
+class CrisisScreener:
+    """危机风险筛查器"""
+    
+    # 高风险短语（命中即升级为LLM安全检查）
+    CRISIS_PHRASES = [
+        "自杀", "想死", "不想活", "活不下去", "活着没意思", "活着没有意义",
+        "轻生", "寻死", "去死", "死了算了", "一死了之", "结束生命", "结束自己",
+        "了结自己", "离开这个世界", "自残", "自伤", "伤害自己", "割腕", "划手臂",
+        "跳楼", "跳河", "上吊", "吃安眠药", "遗书", "没有活下去的理由",
+        "suicide", "kill myself", "end my life", "self-harm", "self harm",
+        "want to die",
+    ]
+    
+    # 危机示例句（用于嵌入相似度检查，覆盖未出现关键短语的表达）
+    CRISIS_EXEMPLARS = [
+        "我真的不想再活下去了",
+        "我觉得大家没有我会过得更好",
+        "我在想怎么结束这一切",
+        "我已经计划好要离开这个世界了",
+        "我忍不住想伤害自己",
+        "我把药都攒起来了",
+        "我站在楼顶不想下去",
+        "I don't want to live anymore",
+        "Everyone would be better off without me",
+        "I have been thinking about ending it all",
+        "I keep hurting myself to feel something",
+    ]
+    
+    def __init__(self, encoder=None, similarity_threshold: float = 0.75,
+                 phrases: List[str] = None, exemplars: List[str] = None):
+        """
+        encoder: 与检索共用的嵌入模型（需提供 encode 方法），为空时只做短语匹配
+        """
+        self.automaton = PhraseAutomaton(phrases or self.CRISIS_PHRASES)
+        self.encoder = encoder
+        self.similarity_threshold = similarity_threshold
+        self.exemplars = exemplars or self.CRISIS_EXEMPLARS
+        self._exemplar_embeddings = None
+        self._lock = threading.Lock()
+    
+    def set_encoder(self, encoder):
+        """更换嵌入模型（知识库切换模型后调用），示例句在下次使用时重新编码"""
+        with self._lock:
+            self.encoder = encoder
+            self._exemplar_embeddings = None
+    
+    def _get_exemplar_embeddings(self) -> np.ndarray:
+        """首次使用时编码示例句并归一化"""
+        exemplar_embeddings = self._exemplar_embeddings
+        if exemplar_embeddings is None:
+            with self._lock:
+                if self._exemplar_embeddings is None:
+                    embeddings = np.asarray(self.encoder.encode(self.exemplars), dtype=np.float32)
+                    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+                    self._exemplar_embeddings = embeddings / np.clip(norms, 1e-12, None)
+                exemplar_embeddings = self._exemplar_embeddings
+        return exemplar_embeddings
+    
+    def screen(self, message: str, query_embedding: np.ndarray = None) -> Dict:
+        """筛查单条消息
+
+        query_embedding: 检索已计算（或将要复用）的消息向量，避免重复编码
+        """
+        matched_phrases = self.automaton.find_all(message)
+        
+        similarity = None
+        if query_embedding is not None and self.encoder is not None:
+            query = np.asarray(query_embedding, dtype=np.float32).ravel()
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+            exemplars = self._get_exemplar_embeddings()
+            # 消息向量与示例句来自同一模型时才比较（切换模型的瞬间可能不一致）
+            if exemplars.shape[1] == query.shape[0]:
+                similarity = float((exemplars @ query).max())
+        
+        similar = similarity is not None and similarity >= self.similarity_threshold
+        if matched_phrases:
+            method = "phrase"
+        elif similar:
+            method = "embedding"
+        else:
+            method = None
+        
+        return {
+            "flagged": method is not None,
+            "method": method,
+            "matched_phrases": matched_phrases,
+            "similarity": similarity
+        }
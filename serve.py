@@ -0,0 +1,259 @@
+"""
+多进程部署
+启动 N 个 Web 工作进程（各自监听本地独立端口）和一个本地负载均衡器（监听 APP_PORT）：
+- 工作进程 0 是知识库 writer（同时执行数据保留任务），其余为只读 reader，writer 更新后自动重新加载；
+  --kb-snapshot 时其余进程改为快照模式，只加载 writer 导出的内存快照，不打开 Chroma 目录
+- 用户会话状态保存在浏览器端的 gr.State 和数据库中，工作进程内不保存用户状态
+- 负载均衡按客户端地址固定到同一工作进程（sticky，Gradio 的排队和流式连接需要同一进程处理），
+  也可以逐连接轮询（round-robin，适合无状态的HTTP接口）；连接失败的工作进程自动跳过
+- 可选启动共享嵌入服务，所有工作进程共用一份嵌入模型
+- 工作进程可以是 Web 界面（app.py）或 HTTP/JSON 接口（api.py，默认逐连接轮询）
+- 工作进程异常退出后自动重启
+
+用法：
+    python serve.py --workers 4
+    python serve.py --workers 4 --balance round-robin --shared-embedding
+    python serve.py --workers 4 --app api
+"""
+from typing import Dict, List, Tuple
+import argparse
+import asyncio
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import time
+import zlib
+from config import Config
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_SCRIPTS = {"web": "app.py", "api": "api.py"}
+
+
+class LoadBalancer:
+    """TCP层负载均衡器（按连接转发，支持 WebSocket / SSE 长连接）"""
+    
+    STRATEGIES = ("sticky", "round-robin")
+    
+    def __init__(self, backends: List[Tuple[str, int]], strategy: str = "sticky",
+                 connect_timeout: float = 2.0):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"未知的负载均衡策略: {strategy}")
+        self.backends = backends
+        self.strategy = strategy
+        self.connect_timeout = connect_timeout
+        self._counter = itertools.count()
+        self.connections = [0] * len(backends)  # 每个工作进程累计转发的连接数
+    
+    def candidates(self, client_host: str) -> List[int]:
+        """按优先顺序返回可选的工作进程下标"""
+        n = len(self.backends)
+        if self.strategy == "sticky":
+            # crc32 在各进程间稳定（内置 hash 对字符串随机化）
+            start = zlib.crc32(client_host.encode("utf-8")) % n
+        else:
+            start = next(self._counter) % n
+        return [(start + offset) % n for offset in range(n)]
+    
+    async def _pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except (ConnectionError, OSError):
+            pass
+    
+    async def handle(self, client_reader, client_writer):
+        peer = client_writer.get_extra_info("peername") or ("", 0)
+        upstream = None
+        for index in self.candidates(peer[0]):
+            host, port = self.backends[index]
+            try:
+                upstream = await asyncio.wait_for(
+                    asyncio.open_connection(host, port), self.connect_timeout
+                )
+                self.connections[index] += 1
+                break
+            except (OSError, asyncio.TimeoutError):
+                continue
+        
+        if upstream is None:
+            client_writer.close()
+            return
+        
+        upstream_reader, upstream_writer = upstream
+        try:
+            await asyncio.gather(
+                self._pipe(client_reader, upstream_writer),
+                self._pipe(upstream_reader, client_writer)
+            )
+        finally:
+            for writer in (upstream_writer, client_writer):
+                writer.close()
+    
+    async def start(self, host: str, port: int):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+class WorkerProcess:
+    """一个 app.py / api.py 工作进程"""
+    
+    def __init__(self, index: int, port: int, env: Dict[str, str], script: str = "app.py"):
+        self.index = index
+        self.port = port
+        self.env = env
+        self.script = script
+        self.process = None
+        self.restarts = 0
+    
+    @property
+    def role(self) -> str:
+        return self.env["CHROMA_ROLE"]
+    
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, self.script), "--host", "127.0.0.1", "--port", str(self.port)],
+            env=self.env,
+            cwd=HERE
+        )
+    
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+    
+    def stop(self, timeout: float = 10.0):
+        if not self.alive():
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float, host: str = "127.0.0.1"):
+    """等待进程开始监听端口；进程提前退出或超时则报错"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"端口 {port} 的进程启动失败（退出码 {process.returncode}）")
+        try:
+            with socket.create_connection((host, port), timeout=1.0):
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"等待端口 {port} 超时（{timeout:g}秒）")
+
+
+def worker_env(index: int, shared_embedding: bool, kb_snapshot: bool = False) -> Dict[str, str]:
+    env = dict(os.environ)
+    env["WORKER_ID"] = str(index)
+    env["CHROMA_ROLE"] = "writer" if index == 0 else ("snapshot" if kb_snapshot else "reader")
+    if index == 0 and kb_snapshot:
+        env["KB_SNAPSHOT_EXPORT"] = "true"
+    env["METRICS_PORT"] = str(Config.METRICS_PORT + index)
+    if index != 0:
+        # 数据保留任务只在 writer 进程执行一份
+        env["RETENTION_ENABLED"] = "false"
+    if shared_embedding:
+        env["EMBEDDING_BACKEND"] = "remote"
+    return env
+
+
+async def supervise(workers: List[WorkerProcess], interval: float = 1.0):
+    """工作进程退出后自动重启"""
+    while True:
+        await asyncio.sleep(interval)
+        for worker in workers:
+            if not worker.alive():
+                worker.restarts += 1
+                print(f"⚠️ 工作进程 {worker.index}（{worker.role}）已退出，第 {worker.restarts} 次重启")
+                worker.start()
+
+
+async def run(workers: List[WorkerProcess], balancer: LoadBalancer, host: str, port: int):
+    server = await balancer.start(host, port)
+    print(f"✅ 负载均衡器: http://{host}:{port}（{balancer.strategy}，{len(workers)} 个工作进程）")
+    async with server:
+        await asyncio.gather(server.serve_forever(), supervise(workers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程部署：N 个工作进程 + 本地负载均衡器")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="工作进程数")
+    parser.add_argument("--app", choices=sorted(APP_SCRIPTS), default="web",
+                        help="工作进程类型：web（Gradio界面）或 api（HTTP/JSON接口）")
+    parser.add_argument("--host", default=Config.APP_HOST, help="负载均衡器监听地址")
+    parser.add_argument("--port", type=int, default=None,
+                        help="负载均衡器监听端口（默认 web 为 APP_PORT，api 为 API_PORT）")
+    parser.add_argument("--worker-base-port", type=int, default=None,
+                        help="工作进程端口从该值开始依次分配（默认监听端口+1）")
+    parser.add_argument("--balance", choices=LoadBalancer.STRATEGIES, default=None,
+                        help="负载均衡策略（默认 web 为 sticky，无状态的 api 为 round-robin）")
+    parser.add_argument("--shared-embedding", action="store_true",
+                        help="启动共享嵌入服务，工作进程使用 remote 嵌入后端")
+    parser.add_argument("--kb-snapshot", action="store_true",
+                        help="除 writer 外的工作进程使用只读内存快照（writer 负责导出）")
+    parser.add_argument("--startup-timeout", type=float, default=600, help="等待单个进程启动的秒数")
+    args = parser.parse_args()
+    if args.port is None:
+        args.port = Config.API_PORT if args.app == "api" else Config.APP_PORT
+    if args.worker_base_port is None:
+        args.worker_base_port = args.port + 1
+    if args.balance is None:
+        args.balance = "round-robin" if args.app == "api" else "sticky"
+    
+    # 先在启动进程中完成表结构迁移，避免多个工作进程同时迁移
+    from async_data_system import to_sync_url
+    from data_system import create_db_engine
+    from migrations import migrate
+    engine = create_db_engine(to_sync_url(Config.DATABASE_URL))
+    migrate(engine)
+    engine.dispose()
+    
+    embedding_server = None
+    workers = []
+    try:
+        if args.shared_embedding:
+            embedding_server = subprocess.Popen(
+                [sys.executable, os.path.join(HERE, "embedding_server.py")], cwd=HERE
+            )
+            wait_for_port(Config.EMBEDDING_SERVER_PORT, embedding_server, args.startup_timeout,
+                          host=Config.EMBEDDING_SERVER_HOST)
+            print(f"✓ 共享嵌入服务: {Config.EMBEDDING_SERVER_URL}")
+        
+        workers = [
+            WorkerProcess(i, args.worker_base_port + i,
+                          worker_env(i, args.shared_embedding, args.kb_snapshot),
+                          APP_SCRIPTS[args.app])
+            for i in range(args.workers)
+        ]
+        # writer 先启动（空知识库时由它加载初始知识，快照模式下并导出快照），再启动其余进程
+        for worker in workers:
+            worker.start()
+            if worker.index == 0:
+                wait_for_port(worker.port, worker.process, args.startup_timeout)
+        for worker in workers:
+            wait_for_port(worker.port, worker.process, args.startup_timeout)
+            print(f"✓ 工作进程 {worker.index}（{worker.role}）: http://127.0.0.1:{worker.port}")
+        
+        balancer = LoadBalancer([("127.0.0.1", worker.port) for worker in workers], args.balance)
+        asyncio.run(run(workers, balancer, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.stop()
+        if embedding_server is not None and embedding_server.poll() is None:
+            embedding_server.terminate()
+            embedding_server.wait()
+
+
+if __name__ == "__main__":
+    main()
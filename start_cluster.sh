@@ -0,0 +1,43 @@
+#!/bin/bash
+
+# 多进程启动脚本
+# N 个工作进程 + 本地负载均衡器（监听 7860），工作进程数默认等于CPU核数
+# 用法: WORKERS=4 ./start_cluster.sh [serve.py 的其他参数，如 --shared-embedding]
+
+echo "=================================="
+echo "学习伙伴 - 多进程启动脚本"
+echo "=================================="
+echo ""
+
+WORKERS=${WORKERS:-$(nproc 2>/dev/null || echo 2)}
+
+# 激活虚拟环境（如果存在）
+if [ -d "venv" ]; then
+    source venv/bin/activate
+    echo "✓ 虚拟环境已激活"
+fi
+
+# 检查环境变量
+if [ ! -f ".env" ]; then
+    echo "❗ .env 文件不存在，请先运行 start.sh 或从 .env.example 复制并填写"
+    exit 1
+fi
+echo "✓ 环境变量文件存在"
+
+# 知识库由 writer 进程（工作进程0）初始化，这里提前初始化可以缩短首次启动时间
+if [ ! -d "chroma_db" ]; then
+    echo "初始化知识库..."
+    python3 init_knowledge.py
+    echo "✓ 知识库初始化完成"
+fi
+echo ""
+
+echo "=================================="
+echo "启动 $WORKERS 个工作进程..."
+echo "=================================="
+echo ""
+echo "应用将在 http://localhost:7860 启动"
+echo "按 Ctrl+C 停止所有进程"
+echo ""
+
+python3 serve.py --workers "$WORKERS" "$@"
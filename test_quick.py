@@ -55,6 +55,56 @@ def test_prompt_engineering():
         return False
 
 
+def test_prompt_prefix_caching():
+    """测试提示词前缀缓存布局"""
+    print("\n=== 测试提示词前缀缓存布局 ===")
+    try:
+        from prompt_engineering import PromptBuilder, PromptTemplate
+        
+        docs = [
+            {"id": "doc_2", "content": "番茄工作法", "metadata": {"category": "压力"}},
+            {"id": "doc_1", "content": "深呼吸练习", "metadata": {"category": "焦虑"}},
+        ]
+        
+        # 预渲染片段拼接结果与模板格式化一致
+        builder = PromptBuilder(prefix_caching=False)
+        expected = PromptTemplate.RAG_ENHANCED_PROMPT.format(
+            knowledge_context="[参考1] (压力) 番茄工作法\n\n[参考2] (焦虑) 深呼吸练习",
+            user_message="我压力很大"
+        )
+        assert builder.build_rag_enhanced_prompt("我压力很大", docs) == expected
+        
+        # 相同文档集合无论检索顺序都渲染出相同内容
+        builder = PromptBuilder(prefix_caching=True)
+        assert builder.build_rag_enhanced_prompt("问题", docs) == \
+            builder.build_rag_enhanced_prompt("问题", list(reversed(docs)))
+        
+        # 历史按块截断：连续两轮的消息前缀保持一致
+        history = []
+        previous = None
+        stable_turns = 0
+        for turn in range(12):
+            messages = builder.build_messages(f"第{turn}轮", history, docs)
+            if previous and messages[:len(previous) - 1] == previous[:-1]:
+                stable_turns += 1
+            previous = messages
+            history = builder.trim_history(history + [
+                {"role": "user", "content": f"第{turn}轮"},
+                {"role": "assistant", "content": "好的"},
+            ])
+            assert len(history) <= builder.config.MAX_CONVERSATION_HISTORY
+        assert stable_turns >= 6
+        print(f"✓ 12轮中有 {stable_turns} 轮复用了上一轮的完整前缀")
+        
+        print("✅ 提示词前缀缓存布局测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 提示词前缀缓存布局测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def test_data_system():
     """测试数据系统"""
     print("\n=== 测试数据系统 ===")
@@ -98,6 +148,898 @@ def test_data_system():
         return False
 
 
+def test_quantized_store():
+    """测试量化向量存储"""
+    print("\n=== 测试量化向量存储 ===")
+    try:
+        import numpy as np
+        from vector_store import QuantizedVectorStore
+        
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(200, 32)).astype(np.float32)
+        ids = [f"doc_{i}" for i in range(200)]
+        
+        for dtype in QuantizedVectorStore.DTYPES:
+            store = QuantizedVectorStore(dtype=dtype, block_size=64)
+            store.add(ids, vectors)
+            assert store.nbytes < vectors.nbytes
+            
+            hits = store.search(vectors[7], top_k=3)
+            assert hits[0][0] == "doc_7"
+            
+            store.remove(["doc_7"])
+            assert len(store) == 199
+            assert store.search(vectors[7], top_k=1)[0][0] != "doc_7"
+            print(f"✓ {dtype}: {store.nbytes} 字节（float32 为 {vectors.nbytes} 字节）")
+        
+        print("✅ 量化向量存储测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 量化向量存储测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_quantized_store_files():
+    """测试量化向量存储的文件：追加写入、重新打开、未提交的尾部和重写"""
+    print("\n=== 测试量化向量存储文件 ===")
+    try:
+        import os
+        import tempfile
+        import numpy as np
+        from vector_store import QuantizedVectorStore
+        
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(size=(300, 16)).astype(np.float32)
+        ids = [f"doc_{i}" for i in range(300)]
+        directory = os.path.join(tempfile.mkdtemp(), "vectors")
+        
+        store = QuantizedVectorStore.open(directory, dtype="int8")
+        for start in range(0, 300, 100):
+            store.add(ids[start:start + 100], vectors[start:start + 100])
+            # 每批只追加本批的数据，不重写已有的行
+            assert os.path.getsize(os.path.join(directory, "0.codes")) == (start + 100) * 16
+        store.remove(ids[:10])
+        # 写了数据但没写日志（进程中途退出）的行不算提交，最后半行日志同样忽略
+        with open(os.path.join(directory, "0.codes"), "ab") as f:
+            f.write(b"\x01" * 16)
+        with open(os.path.join(directory, "0.log"), "ab") as f:
+            f.write(b"+doc_half")
+        store.close()
+        
+        reader = QuantizedVectorStore.open(directory, dtype="int8", read_only=True)
+        assert len(reader) == 290 and "doc_half" not in reader.ids
+        assert np.array_equal(reader.originals(["doc_42", "doc_11"]), vectors[[42, 11]])
+        assert reader.search(vectors[42], top_k=1)[0][0] == "doc_42"
+        assert "doc_0" not in {doc_id for doc_id, _ in reader.search(vectors[0], top_k=5)}
+        try:
+            reader.add(["doc_x"], vectors[:1])
+            assert False, "只读存储不应允许写入"
+        except RuntimeError:
+            pass
+        
+        # writer 重新打开时截掉未提交的尾部，之后的写入接在已提交的行后面
+        store = QuantizedVectorStore.open(directory, dtype="int8")
+        assert os.path.getsize(os.path.join(directory, "0.codes")) == 300 * 16
+        store.add(["doc_new"], vectors[:1])
+        assert np.array_equal(store.originals(["doc_new"]), vectors[:1])
+        
+        # 已删除的行多于有效行时重写为新一代文件，旧文件删除
+        store.COMPACT_MIN_ROWS = 0
+        store.remove(ids[10:200])
+        assert store._generation == 1
+        assert not os.path.exists(os.path.join(directory, "0.codes"))
+        store.close()
+        reopened = QuantizedVectorStore.open(directory, dtype="int8", read_only=True)
+        assert sorted(reopened.ids) == sorted(ids[200:] + ["doc_new"])
+        assert np.array_equal(reopened.originals(ids[250:252]), vectors[250:252])
+        assert reopened.search(vectors[250], top_k=1)[0][0] == "doc_250"
+        print(f"✓ 重新打开后 {len(reopened)} 条向量，常驻内存 {reopened.nbytes} 字节")
+        
+        print("✅ 量化向量存储文件测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 量化向量存储文件测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_duplicate_clusters():
+    """测试分块相似度计算的近似重复聚类"""
+    print("\n=== 测试近似重复聚类 ===")
+    try:
+        import numpy as np
+        from kb_maintenance import find_duplicate_clusters
+        
+        rng = np.random.default_rng(0)
+        base = rng.normal(size=(300, 48)).astype(np.float32)
+        # 前20个向量各有两份带微小噪声的副本，其余互不相似
+        copies = np.concatenate([base[:20] + rng.normal(scale=0.01, size=(20, 48)) for _ in range(2)])
+        vectors = np.concatenate([base, copies]).astype(np.float32)
+        
+        expected = sorted([i, 300 + i, 320 + i] for i in range(20))
+        for block_size in (7, 64, 1000):
+            clusters = sorted(find_duplicate_clusters(vectors, threshold=0.99, block_size=block_size))
+            assert clusters == expected, block_size
+        print(f"✓ 不同分块大小得到相同的 {len(expected)} 个重复簇")
+        
+        assert find_duplicate_clusters(vectors[:300], threshold=0.99) == []
+        print("✓ 不相似的向量不会被合并")
+        
+        print("✅ 近似重复聚类测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 近似重复聚类测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_embedding_server():
+    """测试共享嵌入服务与微批处理"""
+    print("\n=== 测试共享嵌入服务 ===")
+    try:
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+        from embedding_backends import RemoteEncoder
+        from embedding_server import EmbeddingServer
+        
+        class StubEncoder:
+            """按文本长度生成向量，避免下载模型"""
+            def get_sentence_embedding_dimension(self):
+                return 4
+            
+            def encode(self, texts, batch_size=32, **kwargs):
+                return np.array([[len(t), 1.0, 0.0, -1.0] for t in texts], dtype=np.float32)
+        
+        server = EmbeddingServer(StubEncoder(), port=0, max_wait_ms=20).start()
+        try:
+            client = RemoteEncoder(server.address)
+            assert client.get_sentence_embedding_dimension() == 4
+            assert client.encode("你好").tolist() == [2.0, 1.0, 0.0, -1.0]
+            
+            texts = ["字" * i for i in range(1, 33)]
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                results = list(pool.map(lambda t: client.encode([t]), texts))
+            for text, result in zip(texts, results):
+                assert result.shape == (1, 4) and result[0][0] == len(text)
+            
+            # 并发请求应被合并成较少的批次
+            assert server.batcher.batch_count < len(texts) + 2
+            print(f"✓ {server.batcher.item_count} 个请求合并为 {server.batcher.batch_count} 批")
+        finally:
+            server.shutdown()
+        
+        print("✅ 共享嵌入服务测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 共享嵌入服务测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_crisis_screen():
+    """测试危机风险快速筛查"""
+    print("\n=== 测试危机风险筛查 ===")
+    try:
+        from safety import CrisisScreener, PhraseAutomaton
+        
+        automaton = PhraseAutomaton(["he", "she", "his", "hers"])
+        assert sorted(automaton.find_all("ushers")) == ["he", "hers", "she"]
+        
+        screener = CrisisScreener()
+        result = screener.screen("我最近真的不想活了")
+        assert result["flagged"] and result["method"] == "phrase"
+        assert "不想活" in result["matched_phrases"]
+        print(f"✓ 命中短语: {result['matched_phrases']}")
+        
+        result = screener.screen("我对考试感到很焦虑")
+        assert not result["flagged"]
+        print("✓ 普通消息未被标记")
+        
+        print("✅ 危机风险筛查测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 危机风险筛查测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_micro_batcher_close():
+    """测试微批处理器关闭时不遗留未完成的请求"""
+    print("\n=== 测试微批处理器关闭 ===")
+    try:
+        import threading
+        from concurrent.futures import wait
+        from batching import MicroBatcher
+        
+        # 关闭与提交并发：每个请求要么提交时被拒绝，要么得到结果
+        for _ in range(20):
+            batcher = MicroBatcher(lambda items: items, max_wait_ms=0.5)
+            futures, rejected = [], []
+            
+            def submit_many():
+                for i in range(200):
+                    try:
+                        futures.append(batcher.submit_async(i))
+                    except RuntimeError:
+                        rejected.append(i)
+            
+            threads = [threading.Thread(target=submit_many) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            batcher.close()
+            for thread in threads:
+                thread.join()
+            _, pending = wait(futures, timeout=5)
+            assert not pending and len(futures) + len(rejected) == 800
+        print("✓ 并发关闭后所有已提交的请求都已完成")
+        
+        # 后台线程异常退出后提交的请求在关闭时失败
+        def crash(items):
+            raise SystemExit
+        
+        batcher = MicroBatcher(crash)
+        batcher.submit_async("first")
+        batcher._worker.join(timeout=5)
+        orphan = batcher.submit_async("second")
+        batcher.close()
+        try:
+            orphan.result(timeout=1)
+            raise AssertionError("遗留的请求没有失败")
+        except RuntimeError:
+            pass
+        print("✓ 后台线程退出后遗留的请求在关闭时失败")
+        
+        print("✅ 微批处理器关闭测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 微批处理器关闭测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_latency_metrics():
+    """测试阶段延迟指标"""
+    print("\n=== 测试延迟指标 ===")
+    try:
+        import time
+        from metrics import MetricsRegistry, StageTimer
+        
+        registry = MetricsRegistry(window=100)
+        for i in range(50):
+            timer = StageTimer(registry=registry)
+            with timer.span("retrieval"):
+                time.sleep(0.001)
+            with timer.span("llm_call"):
+                pass
+        assert timer.timings["retrieval"] >= 1.0
+        
+        summary = registry.summary()
+        assert summary["retrieval"]["count"] == 50
+        assert summary["retrieval"]["p50_ms"] <= summary["retrieval"]["p99_ms"]
+        print(f"✓ retrieval p50={summary['retrieval']['p50_ms']:.2f}ms")
+        
+        text = registry.render_prometheus()
+        assert 'chat_stage_latency_seconds{stage="retrieval",quantile="0.95"}' in text
+        assert 'chat_stage_latency_seconds_count{stage="llm_call"} 50' in text
+        
+        # 禁用时不记录任何数据
+        timer = StageTimer(registry=registry, enabled=False)
+        with timer.span("retrieval"):
+            pass
+        assert timer.timings == {} and registry.summary()["retrieval"]["count"] == 50
+        print("✓ Prometheus 输出格式正确")
+        
+        print("✅ 延迟指标测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 延迟指标测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_cost_accounting():
+    """测试token用量与成本统计"""
+    print("\n=== 测试成本统计 ===")
+    try:
+        import sqlite3
+        import tempfile
+        import uuid
+        from config import Config
+        from data_system import DataCollector
+        from prompt_engineering import PromptBuilder
+        from chatbot import EmotionalSupportChatbot
+        
+        # 独立的临时数据库：报表是全局统计，不受其他测试或上次运行写入的数据影响
+        cost_db = os.path.join(tempfile.mkdtemp(), "cost.db")
+        collector = DataCollector(f"sqlite:///{cost_db}")
+        session_id = str(uuid.uuid4())
+        collector.create_session(session_id)
+        for _ in range(2):
+            collector.record_conversation(
+                session_id=session_id,
+                user_message="测试消息",
+                ai_response="测试回复",
+                usage={"prompt_tokens": 1000, "completion_tokens": 200, "cached_tokens": 400,
+                       "rag_context_tokens": 300, "history_tokens": 250,
+                       "latency_ms": 800.0, "model": "gpt-4o-mini"}
+            )
+        
+        stats = collector.get_session_statistics(session_id)
+        assert stats["total_prompt_tokens"] == 2000 and stats["total_cached_tokens"] == 800
+        expected = collector.estimate_cost(2000, 400, 800)
+        assert abs(stats["estimated_cost_usd"] - expected) < 1e-12
+        print(f"✓ 会话累计: {stats['total_prompt_tokens']} prompt tokens, ${expected:.6f}")
+        
+        report = collector.get_cost_report(days=1)
+        top = report["top_sessions"][0]
+        assert top["session_id"] == session_id and abs(top["cost_usd"] - expected) < 1e-9
+        composition = report["prompt_composition"]
+        assert composition["rag_context_tokens"] == 600 and composition["history_tokens"] == 500
+        assert report["daily"][-1]["avg_llm_latency_ms"] == 800.0
+        print(f"✓ 成本报表: 知识库参考占比 {composition['rag_context_share']:.0%}")
+        collector.close()
+        
+        # 提示词构成按字符占比分摊token
+        builder = PromptBuilder()
+        messages = builder.build_messages(
+            "考试好焦虑",
+            conversation_history=[{"role": "user", "content": "你好"},
+                                  {"role": "assistant", "content": "你好呀"}],
+            rag_docs=[{"content": "深呼吸练习", "metadata": {"category": "焦虑"}}]
+        )
+        composition = builder.prompt_composition(messages, "考试好焦虑")
+        assert composition["history"] == 5 and composition["rag_context"] > len("深呼吸练习")
+        split = EmotionalSupportChatbot._split_prompt_tokens(1000, composition)
+        assert 0 < split["rag_context_tokens"] < 1000 and 0 < split["history_tokens"] < 1000
+        print(f"✓ 提示词构成: {composition}")
+        
+        # 旧数据库自动补齐新增的列
+        old_db = os.path.join(tempfile.mkdtemp(), "old.db")
+        conn = sqlite3.connect(old_db)
+        conn.execute("CREATE TABLE user_sessions (id INTEGER PRIMARY KEY, session_id VARCHAR(100), "
+                     "message_count INTEGER)")
+        conn.execute("INSERT INTO user_sessions (session_id, message_count) VALUES ('old', 3)")
+        conn.commit()
+        conn.close()
+        
+        original_url = Config.DATABASE_URL
+        Config.DATABASE_URL = f"sqlite:///{old_db}"
+        try:
+            old_collector = DataCollector()
+        finally:
+            Config.DATABASE_URL = original_url
+        conn = sqlite3.connect(old_db)
+        total = conn.execute("SELECT total_prompt_tokens FROM user_sessions").fetchone()[0]
+        conn.close()
+        old_collector.close()
+        assert total == 0
+        print("✓ 旧数据库已补齐token统计列")
+        
+        print("✅ 成本统计测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 成本统计测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_export_logs():
+    """测试对话日志增量导出"""
+    print("\n=== 测试日志导出 ===")
+    try:
+        import json
+        import tempfile
+        import uuid
+        from config import Config
+        from data_system import DataCollector
+        from export_logs import export_logs
+        
+        workdir = tempfile.mkdtemp()
+        original_url = Config.DATABASE_URL
+        Config.DATABASE_URL = f"sqlite:///{os.path.join(workdir, 'export.db')}"
+        try:
+            collector = DataCollector()
+            session_id = str(uuid.uuid4())
+            collector.create_session(session_id)
+            for i in range(7):
+                collector.record_conversation(session_id, f"消息{i}", f"回复{i}", ["焦虑"],
+                                              rag_docs=[{"content": "参考", "metadata": {}}])
+                collector.record_emotion_trend(session_id, "焦虑")
+            
+            output_dir = os.path.join(workdir, "exports")
+            summary = export_logs(output_dir, "jsonl", chunk_size=3)
+            assert summary["conversations"]["rows"] == 7
+            assert summary["emotion_trends"]["rows"] == 7
+            assert summary["user_sessions"]["rows"] == 1
+            files = summary["conversations"]["files"]
+            assert len(files) == 1 and "date=" in files[0]
+            with open(files[0], encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f]
+            assert [r["user_message"] for r in rows] == [f"消息{i}" for i in range(7)]
+            assert rows[0]["rag_docs_used"][0]["content"] == "参考"
+            print(f"✓ 全量导出: {len(rows)} 条对话（分块大小3）")
+            
+            # 增量导出：只导出水位之后的新行
+            summary = export_logs(output_dir, "jsonl", chunk_size=3)
+            assert summary["conversations"]["rows"] == 0
+            collector.record_conversation(session_id, "新消息", "新回复")
+            summary = export_logs(output_dir, "jsonl", chunk_size=3)
+            assert summary["conversations"]["rows"] == 1
+            assert summary["user_sessions"]["rows"] == 1  # last_active 已更新
+            
+            # 导出之后补充的反馈会在下次导出中带上
+            first_id = rows[0]["id"]
+            assert collector.add_feedback(first_id, 5, "很有帮助")
+            summary = export_logs(output_dir, "jsonl", chunk_size=3)
+            assert summary["conversations"]["rows"] == 1
+            with open(summary["conversations"]["files"][0], encoding="utf-8") as f:
+                updated = json.loads(f.readline())
+            assert updated["id"] == first_id and updated["feedback_score"] == 5
+            print("✓ 增量导出只包含新增和更新的行（包括导出后补充的反馈）")
+            
+            try:
+                import pyarrow.parquet as pq
+                summary = export_logs(os.path.join(workdir, "parquet"), "parquet", chunk_size=3)
+                table = pq.read_table(summary["conversations"]["files"][0])
+                assert table.num_rows == 8
+                print("✓ Parquet 导出")
+            except ImportError:
+                print("⚠️  未安装 pyarrow，跳过 Parquet 导出")
+            collector.close()
+            
+            # 源数据库只读打开：写入失败，旧数据库不做迁移，缺少水位列的表跳过并报告
+            import sqlite3
+            from sqlalchemy.exc import OperationalError
+            from data_system import create_readonly_engine
+            engine = create_readonly_engine(Config.DATABASE_URL)
+            try:
+                with engine.connect() as conn:
+                    conn.exec_driver_sql("DELETE FROM conversations")
+                raise AssertionError("只读连接不应允许写入")
+            except OperationalError:
+                pass
+            finally:
+                engine.dispose()
+            
+            legacy_db = os.path.join(workdir, "legacy.db")
+            conn = sqlite3.connect(legacy_db)
+            conn.executescript("""
+                CREATE TABLE conversations (id INTEGER PRIMARY KEY, session_id VARCHAR(100),
+                    timestamp DATETIME, user_message TEXT, ai_response TEXT);
+                INSERT INTO conversations (session_id, timestamp, user_message, ai_response)
+                    VALUES ('s1', '2024-01-01 10:00:00', '你好', '你好呀');
+            """)
+            conn.commit()
+            conn.close()
+            summary = export_logs(os.path.join(workdir, "legacy"), "jsonl",
+                                  database_url=f"sqlite:///{legacy_db}")
+            assert "updated_at" in summary["conversations"]["skipped"]
+            assert summary["user_sessions"]["skipped"]
+            conn = sqlite3.connect(legacy_db)
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}
+            conn.close()
+            assert tables == {"conversations"} and "updated_at" not in columns
+            print("✓ 只读导出：不修改表结构，缺少的列只报告")
+        finally:
+            Config.DATABASE_URL = original_url
+        
+        print("✅ 日志导出测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 日志导出测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_retention():
+    """测试数据保留与归档"""
+    print("\n=== 测试数据保留 ===")
+    try:
+        import gzip
+        import json
+        import tempfile
+        import uuid
+        from datetime import datetime, timedelta
+        from config import Config
+        from data_system import DataCollector, Conversation, EmotionTrend
+        from retention import RetentionManager
+        
+        workdir = tempfile.mkdtemp()
+        database_url = f"sqlite:///{os.path.join(workdir, 'retention.db')}"
+        original_url = Config.DATABASE_URL
+        Config.DATABASE_URL = database_url
+        try:
+            collector = DataCollector()
+        finally:
+            Config.DATABASE_URL = original_url
+        
+        session_id = str(uuid.uuid4())
+        collector.create_session(session_id)
+        old = datetime.now() - timedelta(days=200)
+        for i in range(7):
+            collector.session.add(Conversation(session_id=session_id, user_message=f"旧消息{i}",
+                                               ai_response="回复", timestamp=old))
+            collector.session.add(EmotionTrend(session_id=session_id, emotion="焦虑",
+                                               intensity="中", timestamp=old))
+        collector.session.commit()
+        collector.record_conversation(session_id, "新消息", "新回复")
+        collector.record_emotion_trend(session_id, "焦虑")
+        
+        manager = RetentionManager(database_url=database_url,
+                                   archive_dir=os.path.join(workdir, "archive"),
+                                   batch_size=3, pause_ms=0)
+        assert manager.count_expired(180, 30) == {"conversations": 7, "emotion_trends": 7}
+        summary = manager.run(conversation_days=180, emotion_days=30)
+        assert summary["conversations"]["archived"] == 7
+        assert summary["emotion_trends"]["rolled_up"] == 7
+        assert summary["compaction"]["analyzed"]
+        
+        with gzip.open(summary["conversations"]["archive_file"], "rt", encoding="utf-8") as f:
+            archived = [json.loads(line) for line in f]
+        assert [r["user_message"] for r in archived] == [f"旧消息{i}" for i in range(7)]
+        print(f"✓ 归档 {len(archived)} 条旧对话（每批3条）")
+        
+        # 热表只保留新数据，汇总后的情绪统计保持不变
+        collector.session.expire_all()
+        assert collector.session.query(Conversation).count() == 1
+        assert collector.session.query(EmotionTrend).count() == 1
+        stats = collector.get_session_statistics(session_id)
+        assert stats["emotion_distribution"]["焦虑"] == 8
+        print("✓ 情绪记录已汇总，会话统计不变")
+        
+        assert manager.compact(force_vacuum=True)["vacuumed"]
+        print("✓ ANALYZE / VACUUM 完成")
+        manager.close()
+        collector.close()
+        
+        print("✅ 数据保留测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 数据保留测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_emotion_analytics():
+    """测试情绪趋势分析（队列周环比、滚动占比、增量计算）"""
+    print("\n=== 测试情绪趋势分析 ===")
+    try:
+        import sqlite3
+        import tempfile
+        from datetime import date, datetime, timedelta
+        import pandas as pd
+        from sqlalchemy import insert
+        from data_system import EmotionTrend, UserSession, create_db_engine
+        from migrations import migrate
+        from analytics import EmotionAnalytics
+        
+        workdir = tempfile.mkdtemp()
+        database_url = f"sqlite:///{os.path.join(workdir, 'analytics.db')}"
+        engine = create_db_engine(database_url)
+        migrate(engine)
+        
+        # 队列A：20天前开始，负面占比稳定在50%；队列B：13天前开始，上周积极、本周以焦虑为主
+        end = date.today() - timedelta(days=1)
+        midnight = datetime.combine(end, datetime.min.time())
+        sessions, trends = [], []
+        for i in range(1000):
+            cohort_b = i % 2 == 1
+            first_day = 13 if cohort_b else 20
+            session_id = f"analytics-{i}"
+            start = midnight - timedelta(days=first_day)
+            sessions.append({"session_id": session_id, "user_id": f"user-{i}", "start_time": start,
+                             "last_active": start, "message_count": 0})
+            for days_back in range(first_day, -1, -1):
+                if cohort_b:
+                    emotion = "积极" if days_back >= 7 or (i + days_back) % 4 == 0 else "焦虑"
+                else:
+                    emotion = "焦虑" if (i // 2 + days_back) % 2 else "积极"
+                trends.append({"session_id": session_id, "emotion": emotion, "intensity": "中",
+                               "timestamp": midnight - timedelta(days=days_back) + timedelta(hours=10)})
+        with engine.begin() as conn:
+            conn.execute(insert(UserSession), sessions)
+            conn.execute(insert(EmotionTrend), trends)
+        
+        analytics = EmotionAnalytics(database_url, cache_dir=os.path.join(workdir, "cache"))
+        report = analytics.report(by="cohort", end=end)
+        assert int(report["daily"].to_numpy().sum()) == len(trends)
+        
+        weekly = report["week_over_week"]
+        cohort_a = (midnight - timedelta(days=20 + (midnight - timedelta(days=20)).weekday())).strftime("%Y-%m-%d")
+        cohort_b = (midnight - timedelta(days=13 + (midnight - timedelta(days=13)).weekday())).strftime("%Y-%m-%d")
+        assert list(report["alerts"].index) == [cohort_b]
+        assert report["alerts"].loc[cohort_b, "top_rising_emotion"] == "焦虑"
+        assert abs(weekly.loc[cohort_a, "negative_shift"]) < 0.05
+        print(f"✓ 队列 {cohort_b} 负面占比 {weekly.loc[cohort_b, 'negative_share_previous']:.0%} -> "
+              f"{weekly.loc[cohort_b, 'negative_share_current']:.0%}，触发预警")
+        
+        # 滚动占比与按定义逐日计算一致
+        rows = pd.DataFrame(trends)
+        rows = rows[rows["session_id"].str.rsplit("-", n=1).str[1].astype(int) % 2 == 1]
+        window = rows[rows["timestamp"] >= midnight - timedelta(days=6)]
+        expected = (window["emotion"] == "焦虑").mean()
+        assert abs(report["rolling"].loc[(cohort_b, pd.Timestamp(end)), "negative_share"] - expected) < 1e-9
+        print("✓ 滚动负面占比正确")
+        
+        # 增量：只读取缓存之后的日期，结果与全部重算一致
+        today = datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=9)
+        with engine.begin() as conn:
+            conn.execute(insert(EmotionTrend), [
+                {"session_id": f"analytics-{i}", "emotion": "沮丧", "intensity": "高", "timestamp": today}
+                for i in range(50)
+            ])
+        incremental = analytics.report(by="user", end=date.today())
+        load = analytics.last_load
+        assert load["cached_rows"] > 0 and load["new_rows"] == 50
+        full = analytics.report(by="user", end=date.today(), full=True)
+        pd.testing.assert_frame_equal(incremental["daily"], full["daily"])
+        pd.testing.assert_frame_equal(incremental["week_over_week"], full["week_over_week"])
+        print(f"✓ 增量计算只读取 {load['new_rows']} 行新数据，与全部重算一致")
+        analytics.close()
+        engine.dispose()
+        
+        # 只读打开，不迁移：结构不是最新版本时报错，数据库保持原样
+        legacy_path = os.path.join(workdir, "legacy.db")
+        sqlite3.connect(legacy_path).close()
+        try:
+            EmotionAnalytics(f"sqlite:///{legacy_path}", cache_dir=os.path.join(workdir, "cache"))
+            raise AssertionError("未迁移的数据库未被拒绝")
+        except RuntimeError as e:
+            assert "migrations.py" in str(e)
+        with sqlite3.connect(legacy_path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+        print("✓ 结构不是最新版本时报错且不修改数据库")
+        
+        print("✅ 情绪趋势分析测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 情绪趋势分析测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_schema_migrations():
+    """测试旧数据库的结构迁移"""
+    print("\n=== 测试结构迁移 ===")
+    try:
+        import sqlite3
+        import tempfile
+        from sqlalchemy import inspect
+        from data_system import create_db_engine
+        from migrations import LATEST_VERSION, current_version, migrate
+        
+        # 按最初版本的表结构建一个旧数据库，包含一条没有会话记录的对话
+        old_db = os.path.join(tempfile.mkdtemp(), "legacy.db")
+        conn = sqlite3.connect(old_db)
+        conn.executescript("""
+            CREATE TABLE conversations (id INTEGER PRIMARY KEY, session_id VARCHAR(100),
+                user_id VARCHAR(100), timestamp DATETIME, user_message TEXT, ai_response TEXT,
+                detected_emotions JSON, rag_docs_used JSON, feedback_score FLOAT, feedback_text TEXT);
+            CREATE INDEX ix_conversations_session_id ON conversations (session_id);
+            CREATE INDEX ix_conversations_user_id ON conversations (user_id);
+            CREATE TABLE user_sessions (id INTEGER PRIMARY KEY, session_id VARCHAR(100),
+                user_id VARCHAR(100), start_time DATETIME, last_active DATETIME,
+                message_count INTEGER, avg_feedback_score FLOAT);
+            CREATE UNIQUE INDEX ix_user_sessions_session_id ON user_sessions (session_id);
+            INSERT INTO user_sessions (session_id, message_count) VALUES ('s1', 1);
+            INSERT INTO conversations (session_id, timestamp, user_message, ai_response)
+                VALUES ('s1', '2024-01-01 10:00:00', '你好', '你好呀'),
+                       ('orphan', '2024-01-02 10:00:00', '旧消息', '旧回复');
+        """)
+        conn.commit()
+        conn.close()
+        
+        engine = create_db_engine(f"sqlite:///{old_db}")
+        assert migrate(engine) == LATEST_VERSION
+        with engine.connect() as conn:
+            assert current_version(conn) == LATEST_VERSION
+            inspector = inspect(conn)
+            index_names = {ix["name"] for ix in inspector.get_indexes("conversations")}
+            assert "ix_conversations_session_timestamp" in index_names
+            assert "ix_conversations_feedback_timestamp" in index_names
+            assert "ix_conversations_session_id" not in index_names
+            fk = inspector.get_foreign_keys("conversations")[0]
+            assert fk["referred_table"] == "user_sessions"
+            assert conn.exec_driver_sql("SELECT COUNT(*) FROM conversations").scalar() == 2
+            assert conn.exec_driver_sql(
+                "SELECT message_count FROM user_sessions WHERE session_id = 'orphan'"
+            ).scalar() == 1
+            assert conn.exec_driver_sql(
+                "SELECT COUNT(*) FROM conversations WHERE updated_at = timestamp"
+            ).scalar() == 2
+        print(f"✓ 旧数据库迁移到版本 {LATEST_VERSION}，数据完整，孤立对话已补建会话")
+        
+        # 外键约束生效
+        from sqlalchemy.exc import IntegrityError
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql("INSERT INTO conversations (session_id) VALUES ('missing')")
+            raise AssertionError("外键约束未生效")
+        except IntegrityError:
+            print("✓ 外键约束生效")
+        engine.dispose()
+        
+        print("✅ 结构迁移测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 结构迁移测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def _exercise_collector(collector, name):
+    """同步与异步数据收集器共用的测试用例"""
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    
+    session_id = str(uuid.uuid4())
+    collector.create_session(session_id)
+    usage = {"prompt_tokens": 100, "completion_tokens": 20, "cached_tokens": 40,
+             "rag_context_tokens": 30, "history_tokens": 25, "latency_ms": 50.0, "model": "gpt-4o-mini"}
+    first = collector.record_conversation(session_id, "你好", "你好呀", ["开心"], usage=usage)
+    second = collector.record_conversation(session_id, "有点焦虑", "我在听", ["焦虑"], usage=usage)
+    assert second.id > first.id
+    collector.record_emotion_trends(session_id, ["焦虑", "压力"])
+    collector.record_emotion_trend(session_id, "焦虑")
+    collector.record_safety_check(session_id, {"method": "phrase", "matched_phrases": ["不想活"]},
+                                  conversation_id=second.id)
+    
+    assert collector.add_feedback(first.id, 5.0, "很好")
+    assert collector.add_feedback(second.id, 3.0)
+    assert not collector.add_feedback(-1, 5.0)
+    assert collector.get_conversation(first.id)["feedback_score"] == 5.0
+    
+    history = collector.get_conversation_history(session_id, limit=1)
+    assert [turn["content"] for turn in history] == ["有点焦虑", "我在听"]
+    assert collector.get_message_count(session_id) == 2
+    assert collector.get_message_count("不存在的会话") is None
+    
+    stats = collector.get_session_statistics(session_id)
+    assert stats["message_count"] == 2 and stats["avg_feedback_score"] == 4.0
+    assert stats["emotion_distribution"] == {"焦虑": 2, "压力": 1}
+    assert stats["total_prompt_tokens"] == 200 and stats["total_cached_tokens"] == 80
+    
+    assert any(c["user_message"] == "你好" for c in collector.get_high_quality_conversations(limit=1000))
+    report = collector.get_cost_report(days=1, top_n=1000)
+    row = next(r for r in report["top_sessions"] if r["session_id"] == session_id)
+    assert row["conversations"] == 2 and abs(row["cost_usd"] - stats["estimated_cost_usd"]) < 1e-9
+    
+    # 并发写入同一会话，计数不丢失
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: collector.record_conversation(session_id, f"并发{i}", "好"), range(8)))
+    assert collector.get_message_count(session_id) == 10
+    
+    # 两种实现的约定一致：重复创建会话保持原会话；未知会话的对话自动建会话
+    again = collector.create_session(session_id, user_id="另一个用户")
+    assert again.session_id == session_id and again.user_id is None
+    assert collector.get_message_count(session_id) == 10
+    unknown = str(uuid.uuid4())
+    collector.record_conversation(unknown, "首条消息", "你好", usage=usage)
+    assert collector.get_message_count(unknown) == 1
+    assert collector.get_session_statistics(unknown)["total_prompt_tokens"] == 100
+    
+    # 并发写入同一个未知会话：只建一条会话，计数不丢失
+    racing = str(uuid.uuid4())
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: collector.record_conversation(racing, f"并发{i}", "好"), range(8)))
+    assert collector.get_message_count(racing) == 8
+    print(f"✓ {name}: 读写、反馈、统计与成本报表一致，并发计数无丢失")
+
+
+def test_data_collector_backends():
+    """测试同步与异步数据收集器（同一组用例）"""
+    print("\n=== 测试数据收集器后端 ===")
+    try:
+        import tempfile
+        from data_system import DataCollector, create_data_collector
+        
+        workdir = tempfile.mkdtemp()
+        backends = [("同步 SQLite", f"sqlite:///{os.path.join(workdir, 'sync.db')}")]
+        try:
+            import aiosqlite  # noqa: F401  可选依赖
+            backends.append(("异步 SQLite", f"sqlite+aiosqlite:///{os.path.join(workdir, 'async.db')}"))
+        except ImportError:
+            print("⚠️  未安装 aiosqlite，跳过异步 SQLite")
+        # 例如 TEST_POSTGRES_URL=postgresql://postgres@localhost/chatbot_test
+        postgres_url = os.getenv("TEST_POSTGRES_URL")
+        if postgres_url:
+            backends.append(("同步 PostgreSQL", postgres_url.replace("postgresql://", "postgresql+psycopg2://", 1)))
+            backends.append(("异步 PostgreSQL", postgres_url))
+        else:
+            print("⚠️  未设置 TEST_POSTGRES_URL，跳过 PostgreSQL")
+        
+        for name, url in backends:
+            collector = create_data_collector(url)
+            assert isinstance(collector, DataCollector) == name.startswith("同步")
+            try:
+                _exercise_collector(collector, name)
+            finally:
+                collector.close()
+        
+        print("✅ 数据收集器后端测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 数据收集器后端测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_load_balancer():
+    """测试多进程部署的负载均衡器"""
+    print("\n=== 测试负载均衡器 ===")
+    try:
+        import asyncio
+        from serve import LoadBalancer
+        
+        async def scenario():
+            async def make_backend(name):
+                async def handle(reader, writer):
+                    data = await reader.read(100)
+                    writer.write(name + b":" + data)
+                    await writer.drain()
+                    writer.close()
+                return await asyncio.start_server(handle, "127.0.0.1", 0)
+            
+            servers = [await make_backend(b"w0"), await make_backend(b"w1")]
+            backends = [("127.0.0.1", srv.sockets[0].getsockname()[1]) for srv in servers]
+            
+            async def request(port):
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(b"ping")
+                writer.write_eof()
+                reply = await reader.read()
+                writer.close()
+                return reply
+            
+            replies = {}
+            for strategy in LoadBalancer.STRATEGIES:
+                balancer = LoadBalancer(backends, strategy)
+                lb = await balancer.start("127.0.0.1", 0)
+                port = lb.sockets[0].getsockname()[1]
+                replies[strategy] = [await request(port) for _ in range(4)]
+                lb.close()
+            
+            # sticky 选中的工作进程下线后，请求转到另一个工作进程
+            balancer = LoadBalancer(backends, "sticky")
+            down = balancer.candidates("127.0.0.1")[0]
+            servers[down].close()
+            await servers[down].wait_closed()
+            lb = await balancer.start("127.0.0.1", 0)
+            failover = await request(lb.sockets[0].getsockname()[1])
+            lb.close()
+            servers[1 - down].close()
+            return replies, failover, down
+        
+        replies, failover, down = asyncio.run(scenario())
+        assert len(set(replies["sticky"])) == 1
+        assert replies["round-robin"] == [b"w0:ping", b"w1:ping"] * 2
+        assert failover == f"w{1 - down}:ping".encode()
+        print("✓ sticky 固定同一工作进程，round-robin 轮询，失败时转移")
+        
+        print("✅ 负载均衡器测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 负载均衡器测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def cleanup():
     """清理测试数据"""
     print("\n=== 清理测试数据 ===")
@@ -123,7 +1065,22 @@ def main():
     # 运行核心测试
     results.append(("配置模块", test_config()))
     results.append(("Prompt工程", test_prompt_engineering()))
+    results.append(("前缀缓存布局", test_prompt_prefix_caching()))
     results.append(("数据系统", test_data_system()))
+    results.append(("量化向量存储", test_quantized_store()))
+    results.append(("量化向量存储文件", test_quantized_store_files()))
+    results.append(("近似重复聚类", test_duplicate_clusters()))
+    results.append(("共享嵌入服务", test_embedding_server()))
+    results.append(("危机风险筛查", test_crisis_screen()))
+    results.append(("微批处理器关闭", test_micro_batcher_close()))
+    results.append(("延迟指标", test_latency_metrics()))
+    results.append(("成本统计", test_cost_accounting()))
+    results.append(("日志导出", test_export_logs()))
+    results.append(("数据保留", test_retention()))
+    results.append(("情绪趋势分析", test_emotion_analytics()))
+    results.append(("结构迁移", test_schema_migrations()))
+    results.append(("数据收集器后端", test_data_collector_backends()))
+    results.append(("负载均衡器", test_load_balancer()))
     
     # 清理
     cleanup()
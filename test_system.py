@@ -58,6 +58,629 @@ def test_rag_system():
         return False
 
 
+def test_hybrid_retrieval():
+    """测试混合检索（BM25 + 向量，RRF融合）"""
+    print("\n=== 测试混合检索 ===")
+    try:
+        from rag_system import RAGSystem, KeywordIndex
+        
+        # 测试关键词索引
+        index = KeywordIndex()
+        index.add("a", "学习压力大时，番茄工作法很有效")
+        index.add("b", "感到孤独是正常的")
+        hits = index.search("番茄工作法", top_k=2)
+        assert hits and hits[0][0] == "a"
+        index.remove("a")
+        assert index.search("番茄", top_k=2) == []
+        print("✓ 关键词索引检索正确")
+        
+        rag = RAGSystem()
+        for mode in RAGSystem.RETRIEVAL_MODES:
+            results = rag.retrieve("番茄工作法", top_k=2, mode=mode)
+            assert len(results) > 0
+            print(f"✓ {mode} 模式检索到 {len(results)} 个结果")
+        
+        results = rag.retrieve("番茄工作法", top_k=1, mode="keyword")
+        assert "番茄工作法" in results[0]['content']
+        
+        print("✅ 混合检索测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 混合检索测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_reranking():
+    """测试检索结果重排"""
+    print("\n=== 测试检索重排 ===")
+    try:
+        from config import Config
+        from rag_system import RAGSystem, KeywordIndex
+        from reranker import Reranker
+        
+        index = KeywordIndex()
+        index.add("a", "学习压力大时，番茄工作法很有效")
+        index.add("b", "感到孤独是正常的，可以参加社团")
+        index.add("c", "考试焦虑时做深呼吸")
+        expected = dict(index.search("番茄工作法 社团", top_k=3))
+        scores = index.score("番茄工作法 社团", ["a", "b", "c", "missing"])
+        assert scores[:2] == [expected["a"], expected["b"]] and scores[2:] == [0.0, 0.0]
+        print("✓ 指定文档的BM25分数与检索一致")
+        
+        def candidates():
+            return [
+                {"id": "a", "content": "番茄工作法", "distance": 0.50, "metadata": {"category": "压力"}},
+                {"id": "b", "content": "参加社团", "distance": 0.52, "metadata": {"category": "孤独"}},
+                {"id": "c", "content": "深呼吸", "distance": 0.90,
+                 "metadata": {"type": "成功案例", "feedback_score": 1.0}},
+            ]
+        
+        reranker = Reranker(budget_ms=1000)
+        assert [d["id"] for d in reranker.rerank("学习", candidates(), 2)] == ["a", "b"]
+        ranked = reranker.rerank("怎么办", candidates(), 2, emotions=["孤独"], keyword_index=index)
+        assert [d["id"] for d in ranked] == ["b", "a"] and ranked[0]["score"] >= ranked[1]["score"]
+        print("✓ 与本轮情绪一致的类别被提前，只返回 top_k 篇")
+        
+        # 预算耗尽时只用第一个（向量）信号排序
+        ranked = Reranker(budget_ms=0).rerank("学习", candidates(), 3, emotions=["孤独"], keyword_index=index)
+        assert [d["id"] for d in ranked] == ["a", "b", "c"]
+        print("✓ 超出时间预算时跳过剩余信号")
+        
+        original = Config.RAG_RERANK
+        Config.RAG_RERANK = True
+        try:
+            rag = RAGSystem()
+            doc_id = rag.add_knowledge("睡前远离手机有助于入睡", {"category": "疲惫"})
+            metadata = rag.collection.get(ids=[doc_id], include=["metadatas"])["metadatas"][0]
+            assert metadata["created_at"] > 0
+            for mode in RAGSystem.RETRIEVAL_MODES:
+                docs = rag.retrieve("学习压力大怎么办", mode=mode, emotions=["压力"])
+                assert 0 < len(docs) <= Config.RAG_RERANK_TOP_K
+            print(f"✓ 启用重排后检索返回 {len(docs)} 篇（候选池 {Config.RAG_RERANK_POOL} 篇）")
+            rag.close()
+        finally:
+            Config.RAG_RERANK = original
+        
+        print("✅ 检索重排测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 检索重排测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_query_coalescing():
+    """测试并发检索查询合并"""
+    print("\n=== 测试检索查询合并 ===")
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+        from config import Config
+        from rag_system import RAGSystem
+        
+        queries = ["番茄工作法", "考试焦虑", "感到孤独", "运动减压"] * 4
+        top_ks = [1, 2, 3, 2] * 4
+        
+        def run(rag):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                return list(pool.map(
+                    lambda args: [d['id'] for d in rag.retrieve(args[0], top_k=args[1], mode="vector")],
+                    zip(queries, top_ks)
+                ))
+        
+        expected = run(RAGSystem())
+        
+        Config.RAG_COALESCE_QUERIES = True
+        try:
+            rag = RAGSystem()
+            assert run(rag) == expected
+            coalescer = rag.query_coalescer
+            print(f"✓ {coalescer.item_count} 个查询合并为 {coalescer.batch_count} 批")
+            rag.close()
+        finally:
+            Config.RAG_COALESCE_QUERIES = False
+        
+        print("✅ 检索查询合并测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 检索查询合并测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_knowledge_base_roles():
+    """测试知识库 writer / reader 角色"""
+    print("\n=== 测试知识库读写角色 ===")
+    try:
+        import tempfile
+        import threading
+        from config import Config
+        from rag_system import RAGSystem
+        
+        original = (Config.CHROMA_PERSIST_DIRECTORY, Config.CHROMA_ROLE, Config.CHROMA_REFRESH_SECONDS)
+        Config.CHROMA_PERSIST_DIRECTORY = tempfile.mkdtemp()
+        Config.CHROMA_REFRESH_SECONDS = 0
+        try:
+            writer = RAGSystem()
+            Config.CHROMA_ROLE = "reader"
+            reader = RAGSystem()
+            assert reader.get_knowledge_count() == writer.get_knowledge_count() > 0
+            
+            try:
+                reader.add_knowledge("只读进程不能写入")
+                raise AssertionError("reader 写入未被拒绝")
+            except RuntimeError:
+                print("✓ reader 拒绝写入")
+            
+            writer.add_knowledge("冥想可以帮助缓解失眠", {"category": "睡眠"})
+            assert reader.refresh_if_stale()
+            assert not reader.refresh_if_stale()
+            docs = reader.retrieve("失眠", top_k=1, mode="keyword")
+            assert docs and "失眠" in docs[0]["content"]
+            print("✓ writer 更新后 reader 重新加载并检索到新知识")
+            
+            # 反复重新加载不累积 Chroma System：旧 System 停止后 SQLite 连接立即关闭，不等垃圾回收
+            sqlite_path = os.path.join(Config.CHROMA_PERSIST_DIRECTORY, "chroma.sqlite3")
+            
+            def open_handles():
+                fds = []
+                for fd in os.listdir("/proc/self/fd") if os.path.isdir("/proc/self/fd") else []:
+                    try:
+                        fds.append(os.readlink(f"/proc/self/fd/{fd}"))
+                    except OSError:
+                        pass
+                return fds.count(os.path.realpath(sqlite_path)), threading.active_count()
+            
+            for refresh in range(7):
+                reader.refresh()
+                # 向量检索会在当前 System 上打开 SQLite 连接
+                assert reader.retrieve("失眠", top_k=1, mode="vector")
+                if refresh == 1:
+                    baseline = open_handles()
+            assert open_handles() == baseline, f"{baseline} -> {open_handles()}"
+            print("✓ 反复重新加载后 SQLite 句柄和线程数不增长")
+            
+            reader.close()
+            writer.close()
+        finally:
+            Config.CHROMA_PERSIST_DIRECTORY, Config.CHROMA_ROLE, Config.CHROMA_REFRESH_SECONDS = original
+        
+        print("✅ 知识库读写角色测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 知识库读写角色测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_knowledge_base_snapshot():
+    """测试只读知识库快照的导出、加载和热切换"""
+    print("\n=== 测试知识库快照 ===")
+    try:
+        import tempfile
+        from config import Config
+        from rag_system import RAGSystem
+        import kb_snapshot
+        
+        names = ("CHROMA_PERSIST_DIRECTORY", "CHROMA_ROLE", "CHROMA_REFRESH_SECONDS",
+                 "KB_SNAPSHOT_DIR", "KB_SNAPSHOT_EXPORT")
+        original = {name: getattr(Config, name) for name in names}
+        Config.CHROMA_PERSIST_DIRECTORY = tempfile.mkdtemp()
+        Config.KB_SNAPSHOT_DIR = tempfile.mkdtemp()
+        Config.KB_SNAPSHOT_EXPORT = True
+        Config.CHROMA_REFRESH_SECONDS = 3600  # 测试中手动切换
+        try:
+            # writer 启动时加载初始知识并导出快照
+            writer = RAGSystem()
+            assert kb_snapshot.current_version(Config.KB_SNAPSHOT_DIR)
+            
+            Config.CHROMA_ROLE = "snapshot"
+            server = RAGSystem(embedding_model=writer.embedding_model)
+            assert server.client is None
+            assert server.get_knowledge_count() == writer.get_knowledge_count()
+            for query in ("考试焦虑", "感到孤独"):
+                expected = [d["id"] for d in writer.retrieve(query, top_k=3, mode="vector")]
+                assert [d["id"] for d in server.retrieve(query, top_k=3, mode="vector")] == expected
+            print("✓ 内存快照与 Chroma 集合的检索结果一致")
+            
+            try:
+                server.add_knowledge("快照模式不能写入")
+                raise AssertionError("快照模式写入未被拒绝")
+            except RuntimeError:
+                print("✓ 快照模式拒绝写入")
+            
+            writer.add_knowledge("冥想可以帮助缓解失眠", {"category": "睡眠"})
+            assert not server.refresh_snapshot()
+            writer.export_snapshot()
+            assert server.refresh_snapshot()
+            assert server.get_knowledge_count() == writer.get_knowledge_count()
+            docs = server.retrieve("失眠", top_k=1, mode="hybrid")
+            assert docs and "失眠" in docs[0]["content"]
+            print("✓ 导出新快照后切换到新版本")
+            
+            for _ in range(Config.KB_SNAPSHOT_KEEP + 1):
+                writer.export_snapshot()
+            assert len(kb_snapshot.list_versions(Config.KB_SNAPSHOT_DIR)) == Config.KB_SNAPSHOT_KEEP
+            print(f"✓ 只保留最近 {Config.KB_SNAPSHOT_KEEP} 个快照")
+            
+            server.close()
+            writer.close()
+        finally:
+            for name, value in original.items():
+                setattr(Config, name, value)
+        
+        print("✅ 知识库快照测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 知识库快照测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_knowledge_base_dedup():
+    """测试知识库近似重复去重"""
+    print("\n=== 测试知识库去重 ===")
+    try:
+        import subprocess
+        import tempfile
+        import threading
+        from config import Config
+        from rag_system import RAGSystem
+        from kb_maintenance import KnowledgeDeduplicator
+        import kb_snapshot
+        
+        original = (Config.CHROMA_PERSIST_DIRECTORY, Config.CHROMA_REFRESH_SECONDS)
+        Config.CHROMA_PERSIST_DIRECTORY = tempfile.mkdtemp()
+        try:
+            rag = RAGSystem()
+            case = "用户问题：考试前睡不着怎么办\n有效回复：睡前做几次深呼吸，把担心的事写下来"
+            rag.add_knowledge_batch(
+                [{"content": case, "type": "成功案例", "feedback_score": score} for score in (4.0, 5.0, 4.5)]
+                + [{"content": "番茄工作法：专注25分钟，休息5分钟", "type": "学习方法"},
+                   {"content": "番茄工作法：专注25分钟，休息5分钟", "type": "成功案例", "feedback_score": 5.0}]
+            )
+            count = rag.get_knowledge_count()
+            
+            deduplicator = KnowledgeDeduplicator(rag, threshold=0.99, block_size=4, batch_size=2)
+            report = deduplicator.run(dry_run=True)
+            assert len(report["remove_ids"]) == 3 and report["deleted"] == 0
+            assert rag.get_knowledge_count() == count
+            print(f"✓ 试运行：{len(report['clusters'])} 个重复簇，{len(report['remove_ids'])} 篇可删除")
+            
+            report = deduplicator.run()
+            assert report["deleted"] == 3
+            assert rag.get_knowledge_count() == count - 3
+            kept = rag.collection.get(ids=[c["keep"] for c in report["clusters"]], include=["metadatas"])
+            assert sorted(str(m.get("feedback_score")) for m in kept["metadatas"]) == ["5.0", "None"]
+            removed = set(report["remove_ids"])
+            assert not removed & {d["id"] for d in rag.retrieve("番茄工作法 睡不着", top_k=10, mode="keyword")}
+            print("✓ 每簇保留人工知识或评分最高的案例，关键词索引同步删除")
+            
+            # 删除后新增文档不会与已有ID冲突
+            rag.add_knowledge("新的知识", {"category": "综合"})
+            rag.add_knowledge_batch([{"content": "另一条新的知识", "category": "综合"}])
+            assert rag.get_knowledge_count() == count - 1
+            print("✓ 删除文档后新增文档ID不冲突")
+            
+            # writer 运行时命令行工具不打开第二个 writer，去重和导出交给 writer 执行
+            def run_cli(script, *args):
+                return subprocess.run(
+                    [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), script), *args],
+                    env=dict(os.environ, CHROMA_PERSIST_DIRECTORY=Config.CHROMA_PERSIST_DIRECTORY),
+                    capture_output=True, text=True, timeout=60
+                )
+            
+            Config.CHROMA_REFRESH_SECONDS = 0
+            rag.add_knowledge("番茄工作法：专注25分钟，休息5分钟", {"type": "成功案例", "feedback_score": 3.0})
+            cli = run_cli("kb_maintenance.py", "dedup", "--threshold", "0.99")
+            assert cli.returncode == 0 and "已提交" in cli.stdout, cli.stdout + cli.stderr
+            assert rag.registry.pending_command()["command"] == "dedup"
+            rag.refresh_if_stale()
+            for thread in threading.enumerate():
+                if thread.name == "kb-dedup":
+                    thread.join(timeout=60)
+            assert rag.get_knowledge_count() == count - 1
+            
+            snapshot_dir = tempfile.mkdtemp()
+            cli = run_cli("kb_snapshot.py", "export", "--directory", snapshot_dir)
+            assert cli.returncode == 0 and "已提交" in cli.stdout, cli.stdout + cli.stderr
+            rag.refresh_if_stale()
+            assert kb_snapshot.load_snapshot(snapshot_dir).count() == count - 1
+            print("✓ writer 运行时 dedup 和快照导出交给 writer 执行")
+            rag.close()
+        finally:
+            Config.CHROMA_PERSIST_DIRECTORY, Config.CHROMA_REFRESH_SECONDS = original
+        
+        print("✅ 知识库去重测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 知识库去重测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_quantized_knowledge_base():
+    """测试量化集合：向量只保存在量化存储中"""
+    print("\n=== 测试量化知识库 ===")
+    try:
+        import tempfile
+        import numpy as np
+        from config import Config
+        from rag_system import RAGSystem
+        from vector_store import QuantizedVectorStore
+        import kb_snapshot
+        
+        original = (Config.CHROMA_PERSIST_DIRECTORY, Config.CHROMA_ROLE, Config.EMBEDDING_QUANTIZATION)
+        Config.CHROMA_PERSIST_DIRECTORY = tempfile.mkdtemp()
+        Config.EMBEDDING_QUANTIZATION = "int8"
+        try:
+            rag = RAGSystem()
+            name = rag.collection_name
+            assert rag.registry.quantization(name) == "int8"
+            doc_id = rag.add_knowledge("晚上睡不着时可以试试渐进式肌肉放松", {"category": "睡眠"})
+            count = rag.get_knowledge_count()
+            assert len(rag.quantized_store) == count
+            # Chroma 只保存 1 维占位向量，float32 向量在量化存储中
+            page = rag.collection.get(limit=count, include=["embeddings"])
+            assert all(len(vector) == 1 for vector in page["embeddings"])
+            embedding = rag.get_embeddings([doc_id])
+            assert embedding.shape == (1, rag.quantized_store.dimension) and embedding.shape[1] > 1
+            docs = rag.retrieve("晚上睡不着时可以试试渐进式肌肉放松", top_k=1, mode="vector")
+            assert docs[0]["id"] == doc_id
+            print(f"✓ {count} 条向量保存在量化存储中，检索用 float32 重排")
+            
+            # 快照导出从量化存储读取 float32 向量
+            snapshot_dir = tempfile.mkdtemp()
+            rag.export_snapshot(snapshot_dir)
+            assert kb_snapshot.load_snapshot(snapshot_dir).embeddings.shape == (count, embedding.shape[1])
+            rag.close()
+            
+            # 增删各一条使条数不变（模拟写入 Chroma 后未写入存储就退出）：writer 重新打开时按ID修复
+            store = QuantizedVectorStore.open(rag._quantized_store_directory(name), dtype="int8")
+            store.remove([doc_id])
+            store.add(["doc_ghost"], embedding)
+            store.close()
+            assert len(store) == count
+            
+            Config.CHROMA_ROLE = "reader"
+            reader = RAGSystem()
+            assert doc_id not in reader.quantized_store.ids
+            reader.close()
+            Config.CHROMA_ROLE = "writer"
+            rag = RAGSystem()
+            assert sorted(rag.quantized_store.ids) == sorted(rag._collection_ids(rag.collection))
+            assert rag.retrieve("晚上睡不着时可以试试渐进式肌肉放松", top_k=1, mode="vector")[0]["id"] == doc_id
+            print("✓ 量化存储与集合的ID不一致时 writer 重新编码补齐")
+            
+            rag.delete_documents([doc_id])
+            assert doc_id not in rag.quantized_store.ids
+            rag.close()
+        finally:
+            Config.CHROMA_PERSIST_DIRECTORY, Config.CHROMA_ROLE, Config.EMBEDDING_QUANTIZATION = original
+        
+        print("✅ 量化知识库测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 量化知识库测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_embedding_cache():
+    """测试文档嵌入持久化缓存"""
+    print("\n=== 测试嵌入缓存 ===")
+    try:
+        import tempfile
+        from config import Config
+        from rag_system import RAGSystem
+        from embedding_cache import EmbeddingCache
+        
+        class CountingEncoder:
+            """记录实际经过模型的文本数"""
+            def __init__(self, encoder):
+                self.encoder = encoder
+                self.encoded = 0
+            
+            def get_sentence_embedding_dimension(self):
+                return self.encoder.get_sentence_embedding_dimension()
+            
+            def encode(self, texts, **kwargs):
+                self.encoded += len(texts)
+                return self.encoder.encode(texts, **kwargs)
+        
+        names = ("CHROMA_PERSIST_DIRECTORY", "EMBEDDING_CACHE_ENABLED", "EMBEDDING_CACHE_PATH")
+        original = {name: getattr(Config, name) for name in names}
+        Config.CHROMA_PERSIST_DIRECTORY = tempfile.mkdtemp()
+        Config.EMBEDDING_CACHE_ENABLED = True
+        Config.EMBEDDING_CACHE_PATH = os.path.join(tempfile.mkdtemp(), "embeddings.db")
+        try:
+            rag = RAGSystem()
+            counter = CountingEncoder(rag.document_encoder.encoder)
+            rag.document_encoder.encoder = counter
+            knowledge = [{"content": f"第{i}条知识：规律作息有助于缓解压力", "category": "压力"} for i in range(20)]
+            rag.add_knowledge_batch(knowledge)
+            assert counter.encoded == 20
+            expected = rag.retrieve("规律作息", top_k=3, mode="vector")
+            
+            # 清空后重建：全部命中缓存，检索结果不变
+            rag.clear_knowledge_base()
+            rag.add_knowledge_batch(knowledge + [{"content": "新的一条知识", "category": "综合"}])
+            assert counter.encoded == 21
+            assert [d["content"] for d in rag.retrieve("规律作息", top_k=3, mode="vector")] == \
+                [d["content"] for d in expected]
+            print(f"✓ 重建知识库只编码了 1 条新文本（命中缓存 {rag.embedding_cache.hits} 次）")
+            
+            # 查询不写入缓存；不同模型的向量互不混用
+            cached = rag.embedding_cache.count()
+            rag.encode_query("不应写入缓存的用户消息")
+            assert rag.embedding_cache.count() == cached
+            other = EmbeddingCache(Config.EMBEDDING_CACHE_PATH, model="onnx:other-model")
+            assert other.get_many([knowledge[0]["content"]]) == {}
+            other.close()
+            print(f"✓ 缓存 {cached} 条文档向量，查询不落盘，按模型隔离")
+            rag.close()
+        finally:
+            for name, value in original.items():
+                setattr(Config, name, value)
+        
+        print("✅ 嵌入缓存测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 嵌入缓存测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_embedding_registry():
+    """测试多模型集合注册表与在线重建索引"""
+    print("\n=== 测试嵌入模型切换 ===")
+    try:
+        import subprocess
+        import tempfile
+        import numpy as np
+        from config import Config
+        from rag_system import RAGSystem
+        from embedding_registry import LEGACY_COLLECTION, acquire_writer_lock, release_writer_lock
+        
+        class WideEncoder:
+            """模拟另一个嵌入模型（向量维度加倍）"""
+            def __init__(self, encoder):
+                self.encoder = encoder
+            
+            def get_sentence_embedding_dimension(self):
+                return 2 * self.encoder.get_sentence_embedding_dimension()
+            
+            def encode(self, texts, **kwargs):
+                vectors = np.asarray(self.encoder.encode(texts, **kwargs))
+                return np.hstack([vectors, vectors])
+        
+        original = Config.CHROMA_PERSIST_DIRECTORY
+        Config.CHROMA_PERSIST_DIRECTORY = tempfile.mkdtemp()
+        try:
+            rag = RAGSystem()
+            base_model = rag.embedding_model_name
+            assert rag.collection_name == LEGACY_COLLECTION
+            wide = WideEncoder(rag.embedding_model)
+            
+            # 重建期间旧集合照常服务
+            name = rag.reindex("wide-model", batch_size=3, encoder=wide)
+            assert rag.collection_name == LEGACY_COLLECTION
+            assert rag.registry.entry(name)["status"] == "ready"
+            assert rag.registry.entry(name)["count"] == rag.get_knowledge_count()
+            assert rag.retrieve("焦虑", top_k=2, mode="vector")
+            
+            # 构建之后的写入在切换时同步到新集合
+            doc_id = rag.add_knowledge("切换模型前写入的知识：睡前放下手机有助于入睡", {"category": "疲惫"})
+            previous = rag.activate_collection(name)
+            assert previous == LEGACY_COLLECTION
+            assert (rag.collection_name, rag.embedding_model_name) == (name, "wide-model")
+            assert rag.encode_query("焦虑").shape[0] == wide.get_sentence_embedding_dimension()
+            docs = rag.retrieve("睡前放下手机", top_k=3, mode="vector")
+            assert doc_id in [d["id"] for d in docs]
+            print(f"✓ 切换到 {name}（同步了构建期间的写入，{rag.get_knowledge_count()} 条文档）")
+            
+            # 新进程按注册表打开当前集合
+            rag.close()
+            rag = RAGSystem(embedding_model=wide)
+            assert rag.collection_name == name
+            
+            # 回滚：切换后的删除同步回旧集合
+            rag.delete_documents([doc_id])
+            assert rag.rollback() == name
+            assert (rag.collection_name, rag.embedding_model_name) == (LEGACY_COLLECTION, base_model)
+            assert doc_id not in [d["id"] for d in rag.retrieve("睡前放下手机", top_k=3, mode="vector")]
+            print("✓ 回滚到原集合")
+            
+            # writer 运行时命令行工具不打开第二个 writer，而是提交命令由 writer 执行
+            cli = subprocess.run(
+                [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_registry.py"),
+                 "activate", "--model", "wide-model"],
+                env=dict(os.environ, CHROMA_PERSIST_DIRECTORY=Config.CHROMA_PERSIST_DIRECTORY),
+                capture_output=True, text=True, timeout=60
+            )
+            assert cli.returncode == 0 and "已提交" in cli.stdout, cli.stdout + cli.stderr
+            assert rag.registry.pending_command()["command"] == "activate"
+            try:
+                rag.registry.submit_command("rollback")
+                raise AssertionError("未执行的命令被覆盖")
+            except RuntimeError:
+                pass
+            refresh_seconds = Config.CHROMA_REFRESH_SECONDS
+            Config.CHROMA_REFRESH_SECONDS = 0
+            try:
+                assert rag.refresh_if_stale()
+            finally:
+                Config.CHROMA_REFRESH_SECONDS = refresh_seconds
+            assert rag.registry.pending_command() is None
+            assert (rag.collection_name, rag.embedding_model_name) == (name, "wide-model")
+            print("✓ writer 运行时命令交给 writer 执行")
+            rag.close()
+            
+            # writer 关闭后命令行工具可以取得排他锁直接执行
+            assert acquire_writer_lock(Config.CHROMA_PERSIST_DIRECTORY, exclusive=True)
+            release_writer_lock(Config.CHROMA_PERSIST_DIRECTORY)
+        finally:
+            Config.CHROMA_PERSIST_DIRECTORY = original
+        
+        print("✅ 嵌入模型切换测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 嵌入模型切换测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_onnx_parity():
+    """测试ONNX后端与PyTorch后端的嵌入一致性"""
+    print("\n=== 测试ONNX嵌入后端 ===")
+    try:
+        from config import Config
+        
+        onnx_files = [name for name in ("model.onnx", "model_quantized.onnx")
+                      if os.path.exists(os.path.join(Config.EMBEDDING_ONNX_PATH, name))]
+        if not onnx_files:
+            print(f"⚠️  未找到ONNX模型（{Config.EMBEDDING_ONNX_PATH}），跳过；可先运行 export_onnx.py --quantize")
+            return True
+        
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+        from embedding_backends import OnnxEncoder
+        
+        texts = ["我最近压力很大", "番茄工作法很有效", "感到孤独是正常的", "I feel anxious before exams"]
+        reference = SentenceTransformer(Config.EMBEDDING_MODEL).encode(texts)
+        
+        # 量化模型允许稍大的误差
+        thresholds = {"model.onnx": 0.999, "model_quantized.onnx": 0.98}
+        for name in onnx_files:
+            encoder = OnnxEncoder(Config.EMBEDDING_ONNX_PATH, model_file=name)
+            embeddings = encoder.encode(texts)
+            assert embeddings.shape == reference.shape
+            
+            cosine = np.sum(embeddings * reference, axis=1) / (
+                np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1)
+            )
+            assert cosine.min() >= thresholds[name], f"{name} 余弦相似度过低: {cosine.min():.4f}"
+            assert encoder.encode(texts[0]).shape == reference[0].shape
+            print(f"✓ {name} 最低余弦相似度: {cosine.min():.4f}")
+        
+        print("✅ ONNX嵌入后端测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ ONNX嵌入后端测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def test_prompt_engineering():
     """测试Prompt工程"""
     print("\n=== 测试Prompt工程 ===")
@@ -132,6 +755,209 @@ def test_data_system():
         return False
 
 
+def test_session_resume():
+    """测试跨实例恢复会话上下文"""
+    print("\n=== 测试会话恢复 ===")
+    try:
+        from chatbot import EmotionalSupportChatbot
+        from rag_system import RAGSystem
+        
+        rag = RAGSystem()
+        bot_a = EmotionalSupportChatbot(rag_system=rag)
+        bot_b = EmotionalSupportChatbot(rag_system=rag)
+        session_id = bot_a.start_new_session()
+        for i in range(3):
+            bot_a.data_collector.record_conversation(
+                session_id=session_id, user_message=f"消息{i}", ai_response=f"回复{i}"
+            )
+        
+        # 另一实例（相当于另一个进程）写入后，缓存的轮数不一致，从数据库重新加载
+        assert bot_b.resume_session(session_id)
+        assert len(bot_b.conversation_history) == 6
+        assert bot_b.conversation_history[-1] == {"role": "assistant", "content": "回复2"}
+        print(f"✓ 从数据库恢复 {len(bot_b.conversation_history)} 条历史消息")
+        
+        # 轮数一致时直接命中缓存
+        bot_b.history_cache.put(session_id, 3, [{"role": "user", "content": "缓存"}])
+        assert bot_a.resume_session(session_id)
+        assert bot_a.conversation_history == [{"role": "user", "content": "缓存"}]
+        print("✓ 命中会话历史缓存")
+        
+        assert not bot_a.resume_session("不存在的会话")
+        
+        bot_a.close()
+        bot_b.close()
+        rag.close()
+        print("✅ 会话恢复测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 会话恢复测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_chatbot_pool():
+    """测试线程池中的机器人共用RAG系统与危机筛查器"""
+    print("\n=== 测试机器人线程池 ===")
+    try:
+        import threading
+        from chatbot import ChatbotPool
+        
+        pool = ChatbotPool()
+        bots = []
+        threads = [threading.Thread(target=lambda: bots.append(pool.bot)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert len({id(bot) for bot in bots}) == 3
+        assert all(bot.rag_system is pool.rag_system for bot in bots)
+        assert all(bot.crisis_screener is pool.crisis_screener for bot in bots)
+        assert all(bot.data_collector is pool.data_collector for bot in bots)
+        exemplars = bots[0].crisis_screener._get_exemplar_embeddings()
+        assert bots[1].crisis_screener._get_exemplar_embeddings() is exemplars
+        print(f"✓ {len(bots)} 个线程的机器人共用同一组危机示例句向量和同一个数据收集器")
+        
+        pool.close()
+        print("✅ 机器人线程池测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 机器人线程池测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_session_stats_cache():
+    """测试增量维护的会话统计与知识库文档数缓存"""
+    print("\n=== 测试会话统计缓存 ===")
+    stub = None
+    from config import Config
+    base_url = Config.OPENAI_BASE_URL
+    try:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+        from synthetic import StubOpenAIServer
+        from chatbot import EmotionalSupportChatbot
+        from rag_system import RAGSystem
+        
+        stub = StubOpenAIServer(latency="fixed:0").start()
+        Config.OPENAI_BASE_URL = stub.base_url
+        rag = RAGSystem()
+        bot = EmotionalSupportChatbot(rag_system=rag)
+        session_id = bot.start_new_session()
+        first = bot.chat("考试前很焦虑，压力好大", session_id=session_id)
+        bot.chat("还是很焦虑", session_id=session_id)
+        bot.add_feedback(first["conversation_id"], 2.0)
+        bot.add_feedback(first["conversation_id"], 5.0)  # 重新评分
+        
+        # 缓存命中时不查询数据库
+        queries = []
+        database_stats = bot.data_collector.get_session_statistics(session_id)
+        bot.data_collector.get_session_statistics = lambda sid: queries.append(sid) or {}
+        cached = bot.get_session_stats(session_id)
+        assert not queries
+        for key in ("message_count", "avg_feedback_score", "feedback_count", "emotion_distribution",
+                    "total_prompt_tokens", "total_completion_tokens", "estimated_cost_usd"):
+            assert cached[key] == database_stats[key], (key, cached[key], database_stats[key])
+        print(f"✓ 增量统计与数据库一致: {cached['message_count']} 条消息，情绪 {cached['emotion_distribution']}")
+        
+        # 过期后从数据库重新加载
+        bot.stats_cache.invalidate(session_id)
+        bot.get_session_stats(session_id)
+        assert queries == [session_id]
+        print("✓ 未命中时从数据库加载")
+        
+        count = rag.get_knowledge_count()
+        assert rag._knowledge_count == count
+        rag.add_knowledge("冥想可以帮助缓解失眠", {"category": "睡眠"})
+        assert rag._knowledge_count is None
+        assert rag.get_knowledge_count() == count + 1
+        print("✓ 知识库写入后文档数缓存失效")
+        
+        bot.close()
+        rag.close()
+        print("✅ 会话统计缓存测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 会话统计缓存测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        Config.OPENAI_BASE_URL = base_url
+        if stub is not None:
+            stub.shutdown()
+
+
+def test_http_api():
+    """测试HTTP/JSON接口（使用本地模拟的LLM服务）"""
+    print("\n=== 测试HTTP接口 ===")
+    stub = None
+    from config import Config
+    base_url = Config.OPENAI_BASE_URL
+    try:
+        from fastapi.testclient import TestClient
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+        from synthetic import StubOpenAIServer
+        from api import create_app
+        
+        stub = StubOpenAIServer(latency="fixed:0").start()
+        Config.OPENAI_BASE_URL = stub.base_url
+        
+        with TestClient(create_app()) as client:
+            # 请求校验
+            assert client.post("/chat", json={"message": ""}).status_code == 422
+            assert client.post("/feedback", json={"conversation_id": 1, "score": 9}).status_code == 422
+            
+            reply = client.post("/chat", json={"message": "考试前总是很焦虑"})
+            assert reply.status_code == 200, reply.text
+            first = reply.json()
+            assert first["response"] == StubOpenAIServer.REPLY
+            session_id = first["session_id"]
+            print(f"✓ /chat 新建会话 {session_id[:8]}...")
+            
+            # 流式接口继续同一会话
+            with client.stream("POST", "/chat/stream", headers={"Accept-Encoding": "gzip"},
+                               json={"message": "还是睡不着", "session_id": session_id}) as stream:
+                assert stream.headers["content-type"].startswith("text/event-stream")
+                assert "content-encoding" not in stream.headers
+                events = [line[len("event: "):] for line in stream.iter_lines() if line.startswith("event: ")]
+            assert events.count("delta") > 1 and events[-1] == "done", events
+            print(f"✓ /chat/stream 返回 {events.count('delta')} 个片段（不压缩）")
+            
+            # 消费方中途关闭流（客户端断开）时已生成的部分回复照常记录
+            stream = client.app.state.chat_api.pool.bot.chat_stream("今天也很累", session_id=session_id)
+            assert next(stream)["type"] == "delta"
+            stream.close()
+            
+            stats = client.get(f"/sessions/{session_id}/stats").json()
+            assert stats["message_count"] == 3
+            print("✓ 流式回复中途断开后对话仍被记录")
+            assert client.get("/sessions/不存在/stats").status_code == 404
+            
+            feedback = client.post("/feedback", json={"conversation_id": first["conversation_id"], "score": 5})
+            assert feedback.json() == {"success": True}
+            assert client.post("/feedback", json={"conversation_id": 10 ** 9, "score": 5}).status_code == 404
+            
+            info = client.get("/knowledge-base", headers={"Accept-Encoding": "gzip"})
+            assert info.json()["total_documents"] > 0
+            print("✓ 反馈、统计和知识库信息接口正常")
+        
+        print("✅ HTTP接口测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ HTTP接口测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        Config.OPENAI_BASE_URL = base_url
+        if stub is not None:
+            stub.shutdown()
+
+
 def test_integration():
     """集成测试（不调用真实API）"""
     print("\n=== 集成测试 ===")
@@ -178,8 +1004,22 @@ def main():
     # 运行各项测试
     results.append(("配置模块", test_config()))
     results.append(("RAG系统", test_rag_system()))
+    results.append(("混合检索", test_hybrid_retrieval()))
+    results.append(("检索重排", test_reranking()))
+    results.append(("检索查询合并", test_query_coalescing()))
+    results.append(("知识库读写角色", test_knowledge_base_roles()))
+    results.append(("知识库快照", test_knowledge_base_snapshot()))
+    results.append(("知识库去重", test_knowledge_base_dedup()))
+    results.append(("量化知识库", test_quantized_knowledge_base()))
+    results.append(("嵌入缓存", test_embedding_cache()))
+    results.append(("嵌入模型切换", test_embedding_registry()))
+    results.append(("ONNX嵌入后端", test_onnx_parity()))
     results.append(("Prompt工程", test_prompt_engineering()))
     results.append(("数据系统", test_data_system()))
+    results.append(("会话恢复", test_session_resume()))
+    results.append(("机器人线程池", test_chatbot_pool()))
+    results.append(("会话统计缓存", test_session_stats_cache()))
+    results.append(("HTTP接口", test_http_api()))
     results.append(("集成测试", test_integration()))
     
     # 清理
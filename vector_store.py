@@ -0,0 +1,393 @@
+"""
+量化向量存储
+以 int8 / float16 数组保存知识库向量（每个向量独立缩放），首轮检索扫描量化编码，候选用 float32 原始向量重排
+
+用 open() 打开目录时作为集合的主向量存储（Chroma 只保存文档、元数据和 1 维占位向量）：
+- 量化编码、缩放系数和 float32 原始向量分别追加写入文件，日志文件逐行记录 +doc_id（写入）/ -doc_id（删除），
+  数据写完后才追加日志，日志即提交记录，进程中途退出时未记入日志的行被忽略
+- 量化编码常驻内存（int8 为 float32 的 1/4，float16 为 1/2）；float32 原始向量以内存映射读取，
+  只有重排的候选行会被读入
+- 删除只追加日志，已删除的行超过有效行数时重写为新一代文件（manifest.json 记录当前代）
+不打开目录时只在内存中保存编码（快照模式），重排向量由调用方提供
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import threading
+import numpy as np
+
+
+class QuantizedVectorStore:
+    """量化向量存储 - 每个向量独立缩放的 int8 或 float16 数组"""
+    
+    DTYPES = {"int8": np.int8, "float16": np.float16}
+    MANIFEST_FILE = "manifest.json"
+    COMPACT_MIN_ROWS = 1024  # 已删除的行少于该数时不重写文件
+    
+    # 目录 -> [存储, 打开次数]；同一进程内以读写方式打开同一目录的调用方共用一个实例
+    _writers = {}
+    _writers_lock = threading.Lock()
+    
+    def __init__(self, dtype: str = "int8", dimension: int = None,
+                 block_size: int = 4096):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"不支持的量化类型: {dtype}")
+        self.dtype = dtype
+        self.dimension = dimension
+        self.block_size = block_size  # 检索时每次反量化的行数，限制临时内存
+        
+        self.directory = None  # 为空时只在内存中保存
+        self.read_only = False
+        self._generation = 0
+        self._row_ids: List[Optional[str]] = []  # 行号 -> doc_id，已删除的行为 None
+        self._positions = {}  # doc_id -> 行号
+        self._size = 0  # 有效行数
+        self._codes = None  # (容量, 维度) 量化编码
+        self._scales = None  # (容量,) 每个向量的缩放系数
+        self._sq_norms = None  # (容量,) 原始向量的平方范数，用于还原L2距离；已删除的行为 inf
+        self._originals = None  # float32 原始向量的内存映射
+        self._files = None  # 追加写入的文件
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    @property
+    def ids(self) -> List[str]:
+        return list(self._positions)
+    
+    @property
+    def nbytes(self) -> int:
+        """常驻内存的编码占用的字节数（float32 原始向量在磁盘上，不计入）"""
+        if self._codes is None:
+            return 0
+        n = len(self._row_ids)
+        return self._codes[:n].nbytes + self._scales[:n].nbytes + self._sq_norms[:n].nbytes
+    
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """量化向量，返回 (编码, 缩放系数)"""
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+        
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    
+    def _reserve(self, capacity: int):
+        """按倍增策略扩容底层数组"""
+        current = 0 if self._codes is None else len(self._codes)
+        if capacity <= current:
+            return
+        new_capacity = max(capacity, current * 2, 64)
+        
+        rows = len(self._row_ids)
+        codes = np.zeros((new_capacity, self.dimension), dtype=self.DTYPES[self.dtype])
+        scales = np.zeros(new_capacity, dtype=np.float32)
+        sq_norms = np.zeros(new_capacity, dtype=np.float32)
+        if self._codes is not None:
+            codes[:rows] = self._codes[:rows]
+            scales[:rows] = self._scales[:rows]
+            sq_norms[:rows] = self._sq_norms[:rows]
+        self._codes, self._scales, self._sq_norms = codes, scales, sq_norms
+    
+    def _drop_row(self, row: int):
+        self._row_ids[row] = None
+        self._scales[row] = 0.0
+        self._sq_norms[row] = np.inf
+        self._size -= 1
+    
+    def add(self, ids: List[str], vectors) -> None:
+        """添加（或覆盖）向量"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if not len(ids):
+            return
+        
+        with self._lock:
+            self._check_writable()
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                if self.directory is not None:
+                    self._write_manifest()
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(
+                    f"向量维度不匹配: 期望 {self.dimension}，实际 {vectors.shape[1]}"
+                )
+            
+            codes, scales = self._quantize(vectors)
+            sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+            if self.directory is not None:
+                self._append(ids, codes, scales, sq_norms, vectors)
+            
+            start = len(self._row_ids)
+            self._reserve(start + len(ids))
+            self._codes[start:start + len(ids)] = codes
+            self._scales[start:start + len(ids)] = scales
+            self._sq_norms[start:start + len(ids)] = sq_norms
+            for row, doc_id in enumerate(ids, start):
+                previous = self._positions.get(doc_id)
+                if previous is not None:
+                    self._drop_row(previous)
+                self._positions[doc_id] = row
+                self._row_ids.append(doc_id)
+                self._size += 1
+    
+    def remove(self, ids: Iterable[str]) -> None:
+        """删除向量（标记删除，已删除的行较多时重写）"""
+        with self._lock:
+            self._check_writable()
+            removed = []
+            for doc_id in ids:
+                row = self._positions.pop(doc_id, None)
+                if row is not None:
+                    self._drop_row(row)
+                    removed.append(doc_id)
+            if removed and self.directory is not None:
+                self._append_log("-", removed)
+            dead = len(self._row_ids) - self._size
+            if dead > max(self._size, self.COMPACT_MIN_ROWS):
+                self._compact()
+    
+    def clear(self) -> None:
+        """清空存储"""
+        with self._lock:
+            self._check_writable()
+            self._positions = {}
+            self._row_ids = []
+            self._size = 0
+            self._codes = self._scales = self._sq_norms = None
+            if self.directory is not None:
+                self._compact()
+    
+    def search(self, query, top_k: int) -> List[Tuple[str, float]]:
+        """近似检索，返回 [(doc_id, 近似平方L2距离)]，按距离升序"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        
+        with self._lock:
+            n = len(self._row_ids)
+            if self._size == 0 or top_k <= 0:
+                return []
+            
+            # 分块反量化计算内积，避免一次性展开全部向量
+            dots = np.empty(n, dtype=np.float32)
+            for start in range(0, n, self.block_size):
+                end = min(start + self.block_size, n)
+                block = self._codes[start:end].astype(np.float32)
+                dots[start:end] = (block @ query) * self._scales[start:end]
+            
+            # 已删除的行平方范数为 inf，不会进入前 k 个
+            distances = self._sq_norms[:n] - 2 * dots + float(query @ query)
+            
+            k = min(top_k, self._size)
+            top = np.argpartition(distances, k - 1)[:k]
+            top = top[np.argsort(distances[top])]
+            return [(self._row_ids[i], float(distances[i])) for i in top]
+    
+    def originals(self, ids: List[str]) -> Optional[np.ndarray]:
+        """按 ids 顺序读取 float32 原始向量（只在内存中保存的存储返回 None）"""
+        with self._lock:
+            if self.directory is None:
+                return None
+            rows = [self._positions[doc_id] for doc_id in ids]
+            if not rows:
+                return np.zeros((0, self.dimension or 0), dtype=np.float32)
+            return np.asarray(self._originals_view()[rows], dtype=np.float32)
+    
+    @classmethod
+    def open(cls, directory: str, dtype: str = "int8", read_only: bool = False,
+             block_size: int = 4096) -> "QuantizedVectorStore":
+        """打开目录中的存储（不存在时新建；只读时不修改任何文件）"""
+        if read_only:
+            return cls._open(directory, dtype, True, block_size)
+        key = os.path.abspath(directory)
+        with cls._writers_lock:
+            held = cls._writers.get(key)
+            if held is None:
+                held = cls._writers[key] = [cls._open(key, dtype, False, block_size), 0]
+            elif held[0].dtype != dtype:
+                raise ValueError(f"{directory} 的量化类型为 {held[0].dtype}，不是 {dtype}")
+            held[1] += 1
+            return held[0]
+    
+    @classmethod
+    def _open(cls, directory: str, dtype: str, read_only: bool, block_size: int) -> "QuantizedVectorStore":
+        store = cls(dtype=dtype, block_size=block_size)
+        store.directory = directory
+        store.read_only = read_only
+        # 只读进程读取期间 writer 可能重写为新一代文件，重新读取 manifest 再试
+        for attempt in range(3):
+            manifest = store._read_manifest()
+            try:
+                if manifest is not None:
+                    if manifest["dtype"] != dtype:
+                        raise ValueError(f"{directory} 的量化类型为 {manifest['dtype']}，不是 {dtype}")
+                    store.dimension = manifest["dimension"]
+                    store._generation = manifest["generation"]
+                store._load()
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+            if manifest is None:
+                store._write_manifest()
+            store._open_files()
+        return store
+    
+    def close(self):
+        """关闭写入文件（共用的实例在最后一个调用方关闭时才关闭）；之后仍可检索"""
+        if self.directory is not None and not self.read_only:
+            key = os.path.abspath(self.directory)
+            with self._writers_lock:
+                held = self._writers.get(key)
+                if held is None or held[0] is not self:
+                    return
+                held[1] -= 1
+                if held[1] > 0:
+                    return
+                del self._writers[key]
+        with self._lock:
+            if self._files is not None:
+                for f in self._files.values():
+                    f.close()
+                self._files = None
+    
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"量化存储 {self.directory} 以只读方式打开")
+    
+    def _path(self, kind: str, generation: int = None) -> str:
+        generation = self._generation if generation is None else generation
+        return os.path.join(self.directory, f"{generation}.{kind}")
+    
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def _write_manifest(self):
+        path = os.path.join(self.directory, self.MANIFEST_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.dtype, "dimension": self.dimension,
+                       "generation": self._generation}, f)
+        os.replace(path + ".tmp", path)
+    
+    def _load(self):
+        """按日志重放当前一代的文件：只读取日志中已提交的行"""
+        self._row_ids, self._positions, self._size = [], {}, 0
+        self._codes = self._scales = self._sq_norms = self._originals = None
+        self._log_bytes = 0
+        try:
+            with open(self._path("log"), "rb") as f:
+                log = f.read()
+        except FileNotFoundError:
+            if self._generation:
+                raise
+            log = b""
+        # 最后一行没有换行符时是未写完的记录
+        committed = log[:log.rfind(b"\n") + 1]
+        self._log_bytes = len(committed)
+        for line in committed.decode("utf-8").splitlines():
+            op, doc_id = line[0], line[1:]
+            previous = self._positions.pop(doc_id, None)
+            if previous is not None:
+                self._row_ids[previous] = None
+            if op == "+":
+                self._positions[doc_id] = len(self._row_ids)
+                self._row_ids.append(doc_id)
+        rows = len(self._row_ids)
+        self._size = len(self._positions)
+        if not rows:
+            return
+        
+        dimension = self.dimension
+        codes = np.fromfile(self._path("codes"), dtype=self.DTYPES[self.dtype], count=rows * dimension)
+        norms = np.fromfile(self._path("norms"), dtype=np.float32, count=rows * 2)
+        if len(codes) < rows * dimension or len(norms) < rows * 2:
+            raise ValueError(f"量化存储 {self.directory} 的数据文件不完整")
+        self._codes = codes.reshape(rows, dimension)
+        norms = norms.reshape(rows, 2)
+        self._scales = norms[:, 0].copy()
+        self._sq_norms = norms[:, 1].copy()
+        for row, doc_id in enumerate(self._row_ids):
+            if doc_id is None:
+                self._scales[row] = 0.0
+                self._sq_norms[row] = np.inf
+        # 打开时即映射，writer 重写后删除旧文件也不影响已打开的只读进程
+        self._originals_view()
+    
+    def _open_files(self):
+        """writer：截掉未提交的尾部（进程中途退出时写了数据未写日志的行），之后追加写入"""
+        rows = len(self._row_ids)
+        item_size = np.dtype(self.DTYPES[self.dtype]).itemsize
+        sizes = {
+            "codes": rows * (self.dimension or 0) * item_size,
+            "norms": rows * 2 * 4,
+            "f32": rows * (self.dimension or 0) * 4,
+            "log": self._log_bytes
+        }
+        self._files = {}
+        for kind, size in sizes.items():
+            f = open(self._path(kind), "ab")
+            f.truncate(size)
+            self._files[kind] = f
+    
+    def _append(self, ids: List[str], codes: np.ndarray, scales: np.ndarray,
+                sq_norms: np.ndarray, vectors: np.ndarray):
+        files = self._files
+        files["codes"].write(np.ascontiguousarray(codes).tobytes())
+        files["norms"].write(np.column_stack([scales, sq_norms]).astype(np.float32).tobytes())
+        files["f32"].write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        for kind in ("codes", "norms", "f32"):
+            files[kind].flush()
+        self._append_log("+", ids)
+    
+    def _append_log(self, op: str, ids: List[str]):
+        self._files["log"].write("".join(f"{op}{doc_id}\n" for doc_id in ids).encode("utf-8"))
+        self._files["log"].flush()
+    
+    def _originals_view(self) -> np.ndarray:
+        """float32 原始向量的内存映射（writer 追加后按需重新映射）"""
+        rows = len(self._row_ids)
+        if self._originals is None or len(self._originals) < rows:
+            self._originals = np.memmap(self._path("f32"), dtype=np.float32, mode="r",
+                                        shape=(rows, self.dimension))
+        return self._originals
+    
+    def _compact(self):
+        """只保留有效行，写成新一代文件后切换 manifest，再删除旧文件
+
+        已打开旧文件的只读进程继续使用原来的内存映射，下次重新加载时读取新一代
+        """
+        live = [row for row, doc_id in enumerate(self._row_ids) if doc_id is not None]
+        ids = [self._row_ids[row] for row in live]
+        old_generation = self._generation
+        new_generation = old_generation + 1
+        originals = self._originals_view() if live else None
+        with open(self._path("codes", new_generation), "wb") as codes, \
+                open(self._path("norms", new_generation), "wb") as norms, \
+                open(self._path("f32", new_generation), "wb") as f32:
+            for start in range(0, len(live), self.block_size):
+                rows = live[start:start + self.block_size]
+                codes.write(np.ascontiguousarray(self._codes[rows]).tobytes())
+                norms.write(np.column_stack([self._scales[rows], self._sq_norms[rows]]).astype(np.float32).tobytes())
+                f32.write(np.ascontiguousarray(originals[rows], dtype=np.float32).tobytes())
+        with open(self._path("log", new_generation), "wb") as log:
+            log.write("".join(f"+{doc_id}\n" for doc_id in ids).encode("utf-8"))
+        
+        for f in (self._files or {}).values():
+            f.close()
+        self._generation = new_generation
+        self._write_manifest()
+        for kind in ("codes", "norms", "f32", "log"):
+            try:
+                os.remove(self._path(kind, old_generation))
+            except FileNotFoundError:
+                pass
+        self._load()
+        self._open_files()
@@ -0,0 +1,107 @@
+"""
+表结构与查询计划检查
+迁移到最新版本后，对每个热点查询打印 EXPLAIN QUERY PLAN（SQLite）或 EXPLAIN（其他数据库），
+并标记出全表扫描
+
+用法：
+    python verify_schema.py
+    python verify_schema.py --database-url sqlite:///./chat_history.db --strict
+"""
+from datetime import datetime
+from typing import Callable, Dict, List
+import argparse
+import sys
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from config import Config
+from data_system import Conversation, UserSession, EmotionTrend, create_db_engine
+from migrations import LATEST_VERSION, current_version, migrate
+
+
+# 与 DataCollector 中的查询保持一致
+HOT_QUERIES: Dict[str, Callable[[Session], object]] = {
+    "get_conversation_history": lambda s: s.query(Conversation).filter_by(
+        session_id="sample"
+    ).order_by(Conversation.timestamp.desc()).limit(10),
+    "get_high_quality_conversations": lambda s: s.query(Conversation).filter(
+        Conversation.feedback_score >= 4.0
+    ).order_by(Conversation.timestamp.desc()).limit(50),
+    "add_feedback (会话平均分)": lambda s: s.query(Conversation).filter(
+        Conversation.session_id == "sample",
+        Conversation.feedback_score.isnot(None)
+    ).with_entities(Conversation.feedback_score),
+    "record_conversation (会话查找)": lambda s: s.query(UserSession).filter_by(session_id="sample"),
+    "get_session_statistics (情绪分布)": lambda s: s.query(EmotionTrend).filter_by(session_id="sample"),
+    "EmotionAnalytics (增量加载)": lambda s: s.query(EmotionTrend).filter(
+        EmotionTrend.timestamp >= datetime(2024, 1, 1)
+    ),
+}
+
+
+def explain(session: Session, query) -> List[str]:
+    """返回查询计划的每一行"""
+    dialect = session.bind.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN QUERY PLAN " if dialect.name == "sqlite" else "EXPLAIN "
+    rows = session.execute(text(prefix + sql)).fetchall()
+    # SQLite 的计划详情在最后一列
+    return [str(row[-1]) for row in rows]
+
+
+def is_full_scan(plan: List[str]) -> bool:
+    """SQLite 中 'SCAN <表>'（未使用索引）、Postgres 中 'Seq Scan' 表示全表扫描"""
+    for line in plan:
+        if line.startswith("SCAN ") and "USING" not in line:
+            return True
+        if "Seq Scan" in line:
+            return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查表结构版本、索引和热点查询的执行计划")
+    parser.add_argument("--database-url", default=Config.DATABASE_URL, help="数据库地址")
+    parser.add_argument("--strict", action="store_true", help="存在全表扫描时以非零状态退出")
+    args = parser.parse_args()
+    
+    engine = create_db_engine(args.database_url)
+    migrate(engine)
+    
+    with engine.connect() as conn:
+        print(f"结构版本: {current_version(conn)} / {LATEST_VERSION}")
+        inspector = inspect(conn)
+        for table in ("conversations", "user_sessions", "emotion_trends"):
+            indexes = ", ".join(
+                f"{ix['name']}({', '.join(ix['column_names'])})" for ix in inspector.get_indexes(table)
+            )
+            print(f"  {table} 索引: {indexes or '无'}")
+        foreign_keys = inspector.get_foreign_keys("conversations")
+        for fk in foreign_keys:
+            print(f"  conversations 外键: {fk['constrained_columns']} -> "
+                  f"{fk['referred_table']}{fk['referred_columns']}")
+    
+    full_scans = []
+    session = Session(bind=engine)
+    try:
+        for name, build in HOT_QUERIES.items():
+            plan = explain(session, build(session))
+            flag = "❌ 全表扫描" if is_full_scan(plan) else "✓"
+            print(f"\n{flag} {name}")
+            for line in plan:
+                print(f"    {line}")
+            if is_full_scan(plan):
+                full_scans.append(name)
+    finally:
+        session.close()
+        engine.dispose()
+    
+    if full_scans:
+        print(f"\n⚠️ {len(full_scans)} 个热点查询使用了全表扫描: {', '.join(full_scans)}")
+        if args.strict:
+            sys.exit(1)
+    else:
+        print("\n✅ 所有热点查询都使用了索引")
+
+
+if __name__ == "__main__":
+    main()